@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import queue
+import hashlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, Future
+from dataclasses import dataclass, asdict
+from typing import Callable
+from loguru import logger
+from rich.progress import Progress, TaskID, TimeElapsedColumn, TextColumn, BarColumn, MofNCompleteColumn
+from typedef import CWindSaveDataInfo
+from data_engines import CDataEngineWind
+from manifest import CManifest
+from qcalendar import CCalendar
+from qmetrics import CMetrics
+from qthrottle import CTokenBucket
+from quniverse import CUniverseHistory
+from qutility import check_and_makedirs, batched, qtimer, setup_logger, SFG, SFY
+
+
+@dataclass(frozen=True)
+class CBackfillEngineCfg:
+    """
+    everything to create an engine in a worker process, so it must be picklable
+
+    """
+    save_root_dir: str
+    save_data_infos: tuple[CWindSaveDataInfo, ...]
+    universe: tuple[str, ...]
+    rate: float  # max calls per second of each worker
+    universe_history_path: str | None = None
+    api_factory: Callable[[], object] | None = None  # WindPy.w if None
+
+    def make_engine(self) -> CDataEngineWind:
+        return CDataEngineWind(
+            save_root_dir=self.save_root_dir,
+            save_data_infos=list(self.save_data_infos),
+            universe=list(self.universe),
+            limiter=CTokenBucket(rate=self.rate),
+            api=None if self.api_factory is None else self.api_factory(),
+            manifest=CManifest(self.save_root_dir),
+            universe_history=None if self.universe_history_path is None else CUniverseHistory(
+                self.universe_history_path
+            ),
+        )
+
+
+@dataclass(frozen=True)
+class CBackfillShard:
+    shard_id: int
+    trade_dates: tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class CShardCheckpoint:
+    shard_id: int
+    done_dates: tuple[str, ...]
+    failed_dates: tuple[str, ...]
+    elapsed: float  # seconds used by this chunk
+
+
+def split_shards(trade_dates: list[str], shards: int) -> list[CBackfillShard]:
+    """
+    contiguous shards of nearly the same size, so each worker keeps the locality of dates for batch mode
+
+    """
+    shards = max(1, min(shards, len(trade_dates)))
+    size, extra = divmod(len(trade_dates), shards)
+    res, i = [], 0
+    for k in range(shards):
+        j = i + size + (1 if k < extra else 0)
+        res.append(CBackfillShard(shard_id=k, trade_dates=tuple(trade_dates[i:j])))
+        i = j
+    return res
+
+
+class CBackfillJournal(object):
+    def __init__(self, journal_path: str):
+        """
+        append-only journal of a backfill job, one json object per line. The first line defines the shards,
+        and each other line is a checkpoint of a shard. Lines are flushed to disk when written, and a broken
+        last line left by a killed process is ignored.
+
+        :param journal_path:
+        """
+        self.journal_path = journal_path
+        self.shards: list[CBackfillShard] = []
+        self.done_dates: dict[int, set[str]] = {}
+        if os.path.exists(journal_path):
+            self.__load()
+
+    def __load(self):
+        with open(self.journal_path, "r") as f:
+            for line in f:
+                try:
+                    content = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Broken line in {self.journal_path} is ignored: {line.strip()}")
+                    continue
+                if "shards" in content:
+                    self.shards = [CBackfillShard(z["shard_id"], tuple(z["trade_dates"])) for z in content["shards"]]
+                    self.done_dates = {z.shard_id: set() for z in self.shards}
+                else:
+                    self.done_dates[content["shard_id"]].update(content["done_dates"])
+        return 0
+
+    def __append(self, content: dict):
+        with open(self.journal_path, "a") as f:
+            f.write(json.dumps(content) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return 0
+
+    def start(self, shards: list[CBackfillShard], job: dict):
+        check_and_makedirs(os.path.dirname(self.journal_path))
+        self.shards = shards
+        self.done_dates = {z.shard_id: set() for z in shards}
+        self.__append({"job": job, "shards": [asdict(z) for z in shards]})
+        return 0
+
+    def record(self, checkpoint: CShardCheckpoint):
+        self.done_dates[checkpoint.shard_id].update(checkpoint.done_dates)
+        self.__append(asdict(checkpoint))
+        return 0
+
+    def get_todo_dates(self, shard: CBackfillShard) -> list[str]:
+        return [d for d in shard.trade_dates if d not in self.done_dates[shard.shard_id]]
+
+    @property
+    def started(self) -> bool:
+        return bool(self.shards)
+
+
+def init_worker():
+    # only warnings of workers are shown, the others are still saved in log file
+    setup_logger(stderr_level="WARNING")
+    return 0
+
+
+def run_shard(
+        engine_cfg: CBackfillEngineCfg, shard_id: int, todo_dates: list[str], calendar: CCalendar,
+        checkpoint_size: int, batch: bool, messages: queue.Queue,
+) -> dict:
+    """
+    run in worker processes, each with its own engine and WIND session. A checkpoint is sent
+    to the parent after each chunk of checkpoint_size dates is saved.
+
+    :return: snapshot of metrics of the engine, merged by the parent
+    """
+    engine = engine_cfg.make_engine()
+    for chunk in batched(todo_dates, checkpoint_size):
+        t0 = time.monotonic()
+        # stp_date is right open, the next natural day also works for the last date of calendar
+        stp_date = CCalendar.move_date_string(chunk[-1], move_days=1)
+        engine.download_data_range(
+            bgn_date=chunk[0], stp_date=stp_date, calendar=calendar, batch=batch, show_progress=False,
+        )
+        failed_dates = set(engine.failed_dates)
+        messages.put(CShardCheckpoint(
+            shard_id=shard_id,
+            done_dates=tuple(d for d in chunk if d not in failed_dates),
+            failed_dates=tuple(d for d in chunk if d in failed_dates),
+            elapsed=time.monotonic() - t0,
+        ))
+    if engine.session is not None:
+        engine.session.stop()
+    return engine.metrics.snapshot()
+
+
+class CBackfill(object):
+    def __init__(
+            self, engine_cfg: CBackfillEngineCfg, calendar: CCalendar, journal_dir: str,
+            metrics: CMetrics | None = None,
+    ):
+        """
+
+        :param engine_cfg: engine_cfg.rate is the max calls per second of each worker
+        :param calendar:
+        :param journal_dir: journals of jobs are saved here, named by datasets and date range
+        :param metrics: metrics of all workers are merged into it, summarized and dumped at the end
+        """
+        self.engine_cfg = engine_cfg
+        self.calendar = calendar
+        self.journal_dir = journal_dir
+        self.metrics = metrics or CMetrics()
+
+    def get_journal_path(self, bgn_date: str, stp_date: str) -> str:
+        names = "+".join(z.name for z in self.engine_cfg.save_data_infos)
+        key = hashlib.sha1(f"{names}/{bgn_date}/{stp_date}".encode()).hexdigest()[:12]
+        return os.path.join(self.journal_dir, f"backfill_{bgn_date}_{stp_date}_{key}.jsonl")
+
+    @qtimer
+    def run(
+            self, bgn_date: str, stp_date: str, workers: int = 4, shards: int | None = None,
+            checkpoint_size: int = 20, batch: bool = False,
+    ) -> list[str]:
+        """
+        a job is identified by datasets and [bgn_date, stp_date). If its journal exists, shards are
+        loaded from it and only dates not done are downloaded, so a killed job resumes where each
+        shard stopped. Failed dates are not done, they are tried again when the job is run again.
+
+        :param bgn_date:
+        :param stp_date:
+        :param workers: number of worker processes
+        :param shards: number of shards for a new job, 4 * workers if not provided. More shards than
+                       workers balance the load, as dates of different years differ in instruments.
+        :param checkpoint_size: number of dates downloaded between two checkpoints
+        :param batch: same as batch of download_data_range
+        :return: failed dates
+        """
+        journal = CBackfillJournal(self.get_journal_path(bgn_date, stp_date))
+        if journal.started:
+            logger.info(f"Resume backfill from {SFG(journal.journal_path)}")
+        else:
+            trade_dates = self.calendar.get_iter_list(bgn_date, stp_date)
+            job = {"datasets": [z.name for z in self.engine_cfg.save_data_infos], "bgn": bgn_date, "stp": stp_date}
+            journal.start(split_shards(trade_dates, shards or 4 * workers), job)
+        todo = {z.shard_id: journal.get_todo_dates(z) for z in journal.shards}
+        n_total = sum(len(z.trade_dates) for z in journal.shards)
+        n_todo = sum(len(z) for z in todo.values())
+        logger.info(f"{n_todo} of {n_total} dates in {len(journal.shards)} shards to download by {workers} workers")
+
+        # create manifest before workers, so they do not race to initialize the database
+        CManifest(self.engine_cfg.save_root_dir).close()
+        failed_dates: set[str] = set()
+        t0 = time.monotonic()
+        with mp.Manager() as manager, ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+            messages = manager.Queue()
+            futures: dict[Future, int] = {
+                executor.submit(
+                    run_shard, self.engine_cfg, shard_id, dates, self.calendar, checkpoint_size, batch, messages,
+                ): shard_id
+                for shard_id, dates in todo.items() if dates
+            }
+            with Progress(
+                    TextColumn("{task.description}"), BarColumn(), MofNCompleteColumn(), TimeElapsedColumn(),
+                    TextColumn("{task.fields[speed]}"),
+            ) as pb:
+                task_all = pb.add_task(description="All shards", total=n_todo, speed="")
+                task_shards: dict[int, TaskID] = {
+                    shard_id: pb.add_task(description=f"Shard {shard_id:>3d}", total=len(dates), speed="")
+                    for shard_id, dates in todo.items() if dates
+                }
+                while not all(f.done() for f in futures) or not messages.empty():
+                    try:
+                        checkpoint: CShardCheckpoint = messages.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+                    journal.record(checkpoint)
+                    failed_dates.update(checkpoint.failed_dates)
+                    n = len(checkpoint.done_dates) + len(checkpoint.failed_dates)
+                    speed = n / checkpoint.elapsed * 60 if checkpoint.elapsed > 0 else float("nan")
+                    pb.update(task_shards[checkpoint.shard_id], advance=n, speed=f"{speed:.1f} dates/min")
+                    pb.update(task_all, advance=n, speed=self.__get_speed(pb, task_all, t0))
+            for future, shard_id in futures.items():
+                if (e := future.exception()) is not None:
+                    logger.error(f"Shard {shard_id} is stopped by {e!r}, run the job again to resume it")
+                    failed_dates.update(d for d in todo[shard_id] if d not in journal.done_dates[shard_id])
+                else:
+                    self.metrics.merge(future.result())
+        self.__report(journal, failed_dates, n_todo, time.monotonic() - t0)
+        self.metrics.log_summary(title="Metrics of all workers")
+        self.metrics.dump()
+        return sorted(failed_dates)
+
+    @staticmethod
+    def __get_speed(pb: Progress, task_id: TaskID, t0: float) -> str:
+        elapsed = time.monotonic() - t0
+        completed = pb.tasks[task_id].completed
+        return f"{completed / elapsed * 60:.1f} dates/min" if elapsed > 0 else ""
+
+    @staticmethod
+    def __report(journal: CBackfillJournal, failed_dates: set[str], n_todo: int, elapsed: float):
+        n_done = n_todo - len(failed_dates)
+        logger.info(
+            f"Backfill: {n_done} of {n_todo} dates are done in {elapsed:.1f} seconds, "
+            f"throughput = {n_done / elapsed * 60 if elapsed > 0 else 0:.1f} dates/min, "
+            f"{sum(len(z) for z in journal.done_dates.values())} dates are done in journal "
+            f"{SFG(journal.journal_path)}"
+        )
+        if failed_dates:
+            logger.error(f"{len(failed_dates)} dates failed: {SFY(sorted(failed_dates))}, run the job again to retry")
+        return 0
@@ -0,0 +1,608 @@
+import os
+import random
+import argparse
+import tempfile
+import timeit
+import datetime as dt
+
+
+def parse_args():
+    arg_parser_main = argparse.ArgumentParser(description="Benchmarks of this project")
+    arg_parser_subs = arg_parser_main.add_subparsers(
+        title="sub function",
+        dest="func",
+        description="use this argument to go to call different benchmarks",
+    )
+
+    # func: calendar
+    arg_parser_sub = arg_parser_subs.add_parser(name="calendar", help="CCalendar lookups against linear scans")
+    arg_parser_sub.add_argument("--calendar", type=str, default=None,
+                                help="path of calendar csv, a synthetic one from 1990 to 2035 is used if not provided")
+    arg_parser_sub.add_argument("--number", type=int, default=2000, help="calls of each method")
+
+    # func: download
+    arg_parser_sub = arg_parser_subs.add_parser(name="download", help="Throughput of engines with a fake WIND api")
+    arg_parser_sub.add_argument("--bgn", type=str, default="20230103")
+    arg_parser_sub.add_argument("--stp", type=str, default="20230401")
+    arg_parser_sub.add_argument("--switch", type=str, nargs="+", default=["basis", "stock"],
+                                choices=("basis", "stock"))
+    arg_parser_sub.add_argument("--workers", type=int, nargs="+", default=[1, 4, 8])
+    arg_parser_sub.add_argument("--batch", type=int, nargs="+", default=[0, 1], choices=(0, 1))
+    arg_parser_sub.add_argument("--latency", type=float, default=0.05, help="seconds of each fake call")
+    arg_parser_sub.add_argument("--jitter", type=float, default=0.02, help="extra random seconds of each fake call")
+    arg_parser_sub.add_argument("--rate", type=float, default=1000.0, help="max calls to API per second")
+
+    # func: read
+    arg_parser_sub = arg_parser_subs.add_parser(name="read", help="CDailyReader against a loop of read_csv")
+    arg_parser_sub.add_argument("--days", type=int, default=500, help="number of synthetic daily files")
+    arg_parser_sub.add_argument("--rows", type=int, default=2000, help="rows of each daily file")
+    arg_parser_sub.add_argument("--workers", type=int, default=8)
+
+    # func: codec
+    arg_parser_sub = arg_parser_subs.add_parser(name="codec", help="Write time, read time and size of codecs")
+    arg_parser_sub.add_argument("--days", type=int, default=250, help="number of daily files of each dataset")
+    arg_parser_sub.add_argument("--src", type=str, default=None,
+                                help="root of daily files in csv.gz, whose latest files are used as samples. "
+                                     "Synthetic data of universe in project configuration if not provided")
+
+    # func: assemble
+    arg_parser_sub = arg_parser_subs.add_parser(
+        name="assemble", help="CPU time of converting responses into daily data, with a fake WIND api",
+    )
+    arg_parser_sub.add_argument("--bgn", type=str, default="20230103")
+    arg_parser_sub.add_argument("--stp", type=str, default="20240101")
+    arg_parser_sub.add_argument("--codes", type=int, default=800,
+                                help="size of universe, contracts are made up from the universe of project")
+
+    # func: minute
+    arg_parser_sub = arg_parser_subs.add_parser(
+        name="minute", help="Throughput and peak memory of the minute engine with a fake WIND api",
+    )
+    arg_parser_sub.add_argument("--days", type=int, nargs="+", default=[1, 5],
+                                help="number of trade dates of each run, peak memory should not grow with it")
+    arg_parser_sub.add_argument("--codes", type=int, default=200)
+    arg_parser_sub.add_argument("--points", type=int, default=100000, help="max data points of each call")
+
+    # func: ratecontrol
+    arg_parser_sub = arg_parser_subs.add_parser(
+        name="ratecontrol", help="Rate of a limiter shared by jobs of the daemon after a quota burst, exit 1 if stuck",
+    )
+    arg_parser_sub.add_argument("--rate", type=float, default=20.0, help="configured max calls to API per second")
+    arg_parser_sub.add_argument("--quota", type=float, default=0.05, help="quota error rate of calls in the first job")
+    arg_parser_sub.add_argument("--days", type=int, default=20, help="number of trade dates of each job")
+    arg_parser_sub.add_argument("--jobs", type=int, default=10, help="max jobs after the one with quota errors")
+
+    # func: importtime
+    arg_parser_sub = arg_parser_subs.add_parser(
+        name="importtime", help="Import time of entry points by 'python -X importtime', exit 1 if over budget",
+    )
+    arg_parser_sub.add_argument("--repeat", type=int, default=5, help="the fastest of repeats is checked")
+    arg_parser_sub.add_argument("--scale", type=float, default=1.0, help="budgets are multiplied by it on slow hosts")
+
+    # --- parse args
+    _args = arg_parser_main.parse_args()
+    return _args
+
+
+def make_synthetic_calendar(save_path: str, bgn_date: str = "19900101", end_date: str = "20351231"):
+    d, end = dt.datetime.strptime(bgn_date, "%Y%m%d"), dt.datetime.strptime(end_date, "%Y%m%d")
+    with open(save_path, "w") as f:
+        f.write("trade_date\n")
+        while d <= end:
+            if d.weekday() < 5:
+                f.write(f"{d:%Y%m%d}\n")
+            d += dt.timedelta(days=1)
+    return 0
+
+
+def report(name: str, t_legacy: float, t_new: float, number: int):
+    print(
+        f"{name:<28s} legacy = {t_legacy / number * 1e6:>10.2f} us/call, "
+        f"new = {t_new / number * 1e6:>8.2f} us/call, speedup = {t_legacy / t_new:>8.1f}x"
+    )
+
+
+# ---------- calendar ----------
+
+class CCalendarLegacy(object):
+    """
+    linear scan implementation of CCalendar before indexes were introduced,
+    kept as the reference of results and timings
+    """
+
+    def __init__(self, trade_dates: list[str]):
+        self.trade_dates = trade_dates
+
+    def get_iter_list(self, bgn_date: str, stp_date: str) -> list[str]:
+        res = []
+        for t_date in self.trade_dates:
+            if t_date < bgn_date:
+                continue
+            if t_date >= stp_date:
+                break
+            res.append(t_date)
+        return res
+
+    def get_sn(self, base_date: str) -> int:
+        return self.trade_dates.index(base_date)
+
+    def get_next_date(self, this_date: str, shift: int = 1) -> str:
+        return self.trade_dates[self.get_sn(this_date) + shift]
+
+    def shift_iter_dates(self, iter_dates: list[str], shift: int) -> list[str]:
+        new_dates = [self.get_next_date(iter_dates[-1], shift=s) for s in range(1, shift + 1)]
+        return iter_dates[shift:] + new_dates
+
+    def get_last_days_in_range(self, bgn_date: str, stp_date: str) -> list[str]:
+        res = []
+        for this_day, next_day in zip(self.trade_dates[:-1], self.trade_dates[1:]):
+            if this_day < bgn_date:
+                continue
+            elif this_day >= stp_date:
+                break
+            else:
+                if this_day[0:6] != next_day[0:6]:
+                    res.append(this_day)
+        return res
+
+    def get_first_day_of_month(self, month: str) -> str:
+        threshold = f"{month}01"
+        for t in self.trade_dates:
+            if t >= threshold:
+                return t
+        raise ValueError(f"Could not find first day for {month}")
+
+    def get_last_day_of_month(self, month: str) -> str:
+        threshold = f"{month}31"
+        for t in self.trade_dates[::-1]:
+            if t <= threshold:
+                return t
+        raise ValueError(f"Could not find last day for {month}")
+
+
+def bench_calendar(calendar_path: str | None, number: int):
+    from qcalendar import CCalendar
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if calendar_path is None:
+            make_synthetic_calendar(calendar_path := os.path.join(tmp_dir, "calendar.csv"))
+        calendar = CCalendar(calendar_path)
+    legacy = CCalendarLegacy(list(calendar.trade_dates))
+    dates = calendar.trade_dates[20:-20]
+    months = sorted({d[0:6] for d in dates})
+    print(f"calendar size = {len(calendar.trade_dates)}, calls of each method = {number}")
+
+    rnd = random.Random(0)
+
+    def __sample_range() -> tuple[str, str]:
+        b, s = sorted(rnd.sample(dates, 2))
+        return b, s
+
+    cases = {
+        "get_sn": lambda c: c.get_sn(rnd.choice(dates)),
+        "get_next_date": lambda c: c.get_next_date(rnd.choice(dates), shift=rnd.randint(-10, 10)),
+        "get_iter_list": lambda c: c.get_iter_list(*__sample_range()),
+        "shift_iter_dates": lambda c: c.shift_iter_dates(c.get_iter_list(*__sample_range()) or dates[0:1], 5),
+        "get_last_days_in_range": lambda c: c.get_last_days_in_range(*__sample_range()),
+        "get_first_day_of_month": lambda c: c.get_first_day_of_month(rnd.choice(months)),
+        "get_last_day_of_month": lambda c: c.get_last_day_of_month(rnd.choice(months)),
+    }
+    for name, case in cases.items():
+        # same random queries for both implementations, results must be identical
+        rnd.seed(1)
+        res_legacy = [case(legacy) for _ in range(200)]
+        rnd.seed(1)
+        res_new = [case(calendar) for _ in range(200)]
+        if res_legacy != res_new:
+            raise AssertionError(f"results of {name} are different from legacy implementation")
+
+        rnd.seed(2)
+        t_legacy = timeit.timeit(lambda: case(legacy), number=number)
+        rnd.seed(2)
+        t_new = timeit.timeit(lambda: case(calendar), number=number)
+        report(name, t_legacy, t_new, number)
+    return 0
+
+
+# ---------- download ----------
+
+def bench_download(
+        bgn_date: str, stp_date: str, switches: list[str], workers_list: list[int], batch_list: list[int],
+        latency: float, jitter: float, rate: float,
+):
+    import sys
+    from loguru import logger
+    from project_cfg import pro_cfg
+    from qcalendar import CCalendar
+    from qthrottle import CTokenBucket
+    from wind_fake import CFakeWindApi
+    from data_engines import CDataEngineWind
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    # each dataset alone, and all of them in one pass
+    runs = [[switch] for switch in switches] + ([switches] if len(switches) > 1 else [])
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        make_synthetic_calendar(calendar_path := os.path.join(tmp_dir, "calendar.csv"))
+        calendar = CCalendar(calendar_path)
+        n_dates = len(calendar.get_iter_list(bgn_date, stp_date))
+        results = []
+        for run in runs:
+            run_name = "+".join(run)
+            for batch in batch_list:
+                for workers in workers_list:
+                    api = CFakeWindApi(trade_dates=calendar.trade_dates, latency=latency, jitter=jitter)
+                    engine = CDataEngineWind(
+                        save_root_dir=os.path.join(tmp_dir, f"{run_name}-{batch}-{workers}"),
+                        save_data_infos=[pro_cfg.datasets[switch] for switch in run],
+                        universe=pro_cfg.universe,
+                        limiter=CTokenBucket(rate=rate, capacity=workers),
+                        api=api,
+                    )
+                    t0 = timeit.default_timer()
+                    engine.download_data_range(
+                        bgn_date=bgn_date, stp_date=stp_date, calendar=calendar, batch=bool(batch), workers=workers,
+                    )
+                    duration = timeit.default_timer() - t0
+                    results.append((run_name, batch, workers, duration, api.stats.calls))
+
+    print(f"dates = {n_dates}, latency = {latency}s, jitter = {jitter}s, rate = {rate}/s")
+    for run_name, batch, workers, duration, calls in results:
+        print(
+            f"{run_name:<12s} batch = {batch}, workers = {workers:>2d}: {duration:>7.2f}s, "
+            f"{n_dates / duration:>8.2f} dates/sec, {calls / duration:>7.2f} requests/sec, {calls:>4d} requests"
+        )
+    return 0
+
+
+# ---------- read ----------
+
+def bench_read(days: int, rows: int, workers: int):
+    import numpy as np
+    import pandas as pd
+    from project_cfg import pro_cfg
+    from qcalendar import CCalendar
+    from reader import CDailyReader
+
+    save_data_info = pro_cfg.futures_basis
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        make_synthetic_calendar(calendar_path := os.path.join(tmp_dir, "calendar.csv"))
+        calendar = CCalendar(calendar_path)
+        trade_dates = calendar.get_iter_list("20200101", "20350101")[0:days]
+        bgn_date, stp_date = trade_dates[0], calendar.get_next_date(trade_dates[-1], shift=1)
+        codes = [f"{i:06d}.CFE" for i in range(rows)]
+        for trade_date in trade_dates:
+            df = pd.DataFrame({"ts_code": codes, "wd_code": codes})
+            for f in save_data_info.value_fields:
+                df[f] = rng.standard_normal(rows)
+            save_path = save_data_info.get_save_path(tmp_dir, trade_date)
+            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+            df.to_csv(save_path, index=False)
+
+        def __read_loop() -> pd.DataFrame:
+            frames = []
+            for d in calendar.get_iter_list(bgn_date, stp_date):
+                df = pd.read_csv(save_data_info.get_save_path(tmp_dir, d))
+                df.insert(0, "trade_date", d)
+                frames.append(df)
+            return pd.concat(frames, axis=0, ignore_index=True)
+
+        field = save_data_info.value_fields[0]
+        t0 = timeit.default_timer()
+        expected = __read_loop()
+        results = [("loop of read_csv", timeit.default_timer() - t0)]
+        for n, use_processes in ((1, False), (workers, False), (workers, True)):
+            with CDailyReader(tmp_dir, save_data_info, calendar, workers=n, use_processes=use_processes) as r:
+                kind = f"{n} processes" if use_processes else (f"{n} threads" if n > 1 else "calling thread")
+                t0 = timeit.default_timer()
+                df = r.read_range(bgn_date, stp_date)
+                results.append((f"reader, {kind}, cold", timeit.default_timer() - t0))
+                pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+                t0 = timeit.default_timer()
+                r.read_range(bgn_date, stp_date)
+                results.append((f"reader, {kind}, cached", timeit.default_timer() - t0))
+                t0 = timeit.default_timer()
+                r.read_panel(bgn_date, stp_date, field=field)
+                results.append((f"reader, {kind}, panel usecols", timeit.default_timer() - t0))
+
+    print(f"days = {days}, rows = {rows}, workers = {workers}")
+    for name, duration in results:
+        print(f"{name:<40s} {duration:>7.3f}s, speedup = {results[0][1] / duration:>7.1f}x")
+    return 0
+
+
+# ---------- codec ----------
+
+def bench_codec(days: int, src_root_dir: str | None):
+    import dataclasses
+    import numpy as np
+    import pandas as pd
+    from project_cfg import pro_cfg
+    from qcodec import CODECS
+    from qwriter import save_atomically
+
+    rng = np.random.default_rng(0)
+    samples: dict[str, list[pd.DataFrame]] = {}
+    for switch, save_data_info in pro_cfg.datasets.items():
+        if src_root_dir is not None:
+            # real files, the same file is reused if there are less than days files
+            paths = sorted(
+                os.path.join(root, f) for root, _, files in os.walk(src_root_dir) for f in files
+                if f.startswith(save_data_info.name) and f.endswith(CODECS["csv.gz"].suffix)
+            )[-days:]
+            frames = [save_data_info.read_file(p) for p in paths]
+            samples[switch] = [frames[i % len(frames)] for i in range(days)]
+        else:
+            codes = pro_cfg.universe
+            values = {f: np.round(rng.standard_normal(len(codes)) * 1000, 2) for f in save_data_info.value_fields}
+            df = pd.DataFrame({"ts_code": codes, "wd_code": codes, **values}).astype(save_data_info.dtypes)
+            samples[switch] = [df] * days
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for switch, frames in samples.items():
+            for codec in CODECS:
+                save_data_info = dataclasses.replace(pro_cfg.datasets[switch], codec=codec)
+                trade_dates = [f"{20000101 + i:08d}" for i in range(len(frames))]
+                paths = [save_data_info.get_save_path(os.path.join(tmp_dir, codec), d) for d in trade_dates]
+                for p in paths:
+                    os.makedirs(os.path.dirname(p), exist_ok=True)
+                t0 = timeit.default_timer()
+                for df, p in zip(frames, paths):
+                    save_atomically(df, p)
+                t_write = timeit.default_timer() - t0
+                t0 = timeit.default_timer()
+                for p in paths:
+                    save_data_info.read_file(p)
+                t_read = timeit.default_timer() - t0
+                field = save_data_info.value_fields[0]
+                t0 = timeit.default_timer()
+                for p in paths:
+                    save_data_info.read_file(p, columns=["wd_code", field])
+                t_read_field = timeit.default_timer() - t0
+                size = sum(os.path.getsize(p) for p in paths)
+                pd.testing.assert_frame_equal(save_data_info.read_file(paths[0]), frames[0], check_dtype=False)
+                results.append((switch, codec, t_write, t_read, t_read_field, size, len(paths)))
+
+    print(f"days = {days}, samples = {'synthetic' if src_root_dir is None else src_root_dir}")
+    for switch, codec, t_write, t_read, t_read_field, size, n in results:
+        print(
+            f"{switch:<8s} {codec:<8s} write = {t_write / n * 1e3:>7.2f} ms/file, "
+            f"read = {t_read / n * 1e3:>7.2f} ms/file, read 1 field = {t_read_field / n * 1e3:>7.2f} ms/file, "
+            f"size = {size / n / 1024:>7.2f} KiB/file"
+        )
+    return 0
+
+
+# ---------- assemble ----------
+
+def bench_assemble(bgn_date: str, stp_date: str, n_codes: int):
+    import sys
+    from loguru import logger
+    from project_cfg import pro_cfg
+    from qcalendar import CCalendar
+    from qthrottle import CTokenBucket
+    from wind_fake import CFakeWindApi
+    from data_engines import CDataEngineWind
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    # like contracts of each product, ".CFE" and the others are kept in different groups of fields
+    universe = [f"{c.split('.')[0]}{i:02d}.{c.split('.')[1]}" for i in range(n_codes) for c in pro_cfg.universe]
+    universe = universe[:n_codes]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        make_synthetic_calendar(calendar_path := os.path.join(tmp_dir, "calendar.csv"))
+        calendar = CCalendar(calendar_path)
+        n_dates = len(calendar.get_iter_list(bgn_date, stp_date))
+        print(f"dates = {n_dates}, codes = {len(universe)}, datasets = {list(pro_cfg.datasets)}")
+        for batch in (False, True):
+            engine = CDataEngineWind(
+                save_root_dir=os.path.join(tmp_dir, f"batch-{int(batch)}"),
+                save_data_infos=list(pro_cfg.datasets.values()),
+                universe=universe,
+                limiter=CTokenBucket(rate=1e6),
+                api=CFakeWindApi(trade_dates=calendar.trade_dates, latency=0, jitter=0),
+            )
+            engine.download_data_range(
+                bgn_date=bgn_date, stp_date=stp_date, calendar=calendar, batch=batch, show_progress=False,
+            )
+            stages = {
+                d["labels"]["stage"]: d for d in engine.metrics.snapshot()["histograms"] if d["name"] == "stage_seconds"
+            }
+            print(
+                f"batch = {int(batch)}: convert = {stages['convert']['sum'] / n_dates * 1e3:>8.3f} ms/date, "
+                f"fetch = {stages['fetch']['sum'] / n_dates * 1e3:>8.3f} ms/date"
+            )
+    return 0
+
+
+# ---------- minute ----------
+
+def bench_minute(days_list: list[int], n_codes: int, max_data_points: int):
+    import sys
+    import glob
+    import tracemalloc
+    from loguru import logger
+    from project_cfg import pro_cfg
+    from qcalendar import CCalendar, CCalendarSection
+    from qthrottle import CTokenBucket
+    from wind_fake import CFakeWindApi
+    from data_engines import CDataEngineWindMinute
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+    universe = [f"{c.split('.')[0]}{i:02d}.{c.split('.')[1]}" for i in range(n_codes) for c in pro_cfg.universe]
+    universe = universe[:n_codes]
+    print(f"codes = {len(universe)}, max data points = {max_data_points}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        make_synthetic_calendar(calendar_path := os.path.join(tmp_dir, "calendar.csv"))
+        calendar = CCalendar(calendar_path)
+        calendar_section = CCalendarSection(calendar_path, header=0)
+        for days in days_list:
+            bgn_date = "20230103"
+            stp_date = calendar.get_next_date(bgn_date, shift=days)
+            save_root_dir = os.path.join(tmp_dir, f"minute-{days}")
+            engine = CDataEngineWindMinute(
+                save_root_dir=save_root_dir,
+                save_data_infos=[pro_cfg.futures_minute],
+                universe=universe,
+                max_data_points=max_data_points,
+                limiter=CTokenBucket(rate=1e6),
+                api=CFakeWindApi(trade_dates=calendar.trade_dates),
+            )
+            tracemalloc.start()
+            t0 = timeit.default_timer()
+            engine.download_sections(
+                bgn_date=bgn_date, stp_date=stp_date, calendar_section=calendar_section, show_progress=False,
+            )
+            duration = timeit.default_timer() - t0
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            rows = sum(d["value"] for d in engine.metrics.snapshot()["counters"] if d["name"] == "minute_rows_total")
+            size = sum(os.path.getsize(p) for p in glob.glob(os.path.join(save_root_dir, "**", "*"), recursive=True))
+            print(
+                f"days = {days:>4d}: {rows:>10.0f} bars in {duration:>7.2f}s, {rows / duration:>10.0f} bars/sec, "
+                f"files = {size / 1024 ** 2:>8.2f} MiB, peak of traced memory = {peak / 1024 ** 2:>8.2f} MiB"
+            )
+    return 0
+
+
+# ---------- rate control ----------
+
+def bench_ratecontrol(rate: float, quota_rate: float, days: int, jobs: int):
+    """
+    jobs of serve are run by engines of its factory against a fake API. Quota errors of the first
+    job decrease the rate of the shared limiter, later jobs without quota errors should bring it
+    back to the configured rate.
+    """
+    import sys
+    from loguru import logger
+    from project_cfg import pro_cfg
+    from qcalendar import CCalendar
+    from wind_fake import CFakeWindApi
+    from main import make_serve_engine_factory
+
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+    save_data_infos = list(pro_cfg.datasets.values())
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        make_synthetic_calendar(calendar_path := os.path.join(tmp_dir, "calendar.csv"))
+        calendar = CCalendar(calendar_path)
+        trade_dates = calendar.get_iter_list("20200101", "20350101")
+        api = CFakeWindApi(trade_dates=trade_dates, quota_rate=quota_rate)
+        make_engine = make_serve_engine_factory(rate=rate, save_root_dir=tmp_dir, universe=pro_cfg.universe, api=api)
+        rates, t0 = [], timeit.default_timer()
+        for k in range(jobs + 1):
+            engine = make_engine(save_data_infos)
+            api.quota_rate = quota_rate if k == 0 else 0.0
+            bgn_date, stp_date = trade_dates[k * days], trade_dates[(k + 1) * days]
+            engine.download_data_range(bgn_date=bgn_date, stp_date=stp_date, calendar=calendar, show_progress=False)
+            rates.append(engine.limiter.rate)
+            print(
+                f"job {k:>2d} [{bgn_date}, {stp_date}), quota errors = {api.stats.quota_errors:>3d}, "
+                f"rate = {engine.limiter.rate:>6.2f}/s, elapsed = {timeit.default_timer() - t0:>6.1f}s"
+            )
+            if k > 0 and engine.limiter.rate >= rate:
+                break
+
+    if rates[0] >= rate:
+        print(f"no quota error decreased the rate in the first job, try a larger --quota than {quota_rate}")
+        sys.exit(1)
+    if rates[-1] < rate:
+        print(f"rate = {rates[-1]:.2f}/s does not recover to {rate:.2f}/s after {len(rates) - 1} jobs")
+        sys.exit(1)
+    print(f"rate recovers to {rate:.2f}/s after {len(rates) - 1} jobs")
+    return 0
+
+
+# ---------- import time ----------
+
+# (name, args of python, budget in ms above the interpreter itself, modules which must not be imported)
+IMPORT_TIME_TARGETS: list[tuple[str, list[str], float, tuple[str, ...]]] = [
+    ("typedef", ["-c", "import typedef"], 150, ("pandas", "pyarrow", "rich", "WindPy")),
+    ("project_cfg", ["-c", "import project_cfg"], 150, ("pandas", "pyarrow", "rich", "WindPy")),
+    ("qcalendar", ["-c", "import qcalendar"], 400, ("pandas", "rich", "WindPy")),
+    ("main.py --help", ["main.py", "--help"], 200, ("pandas", "pyarrow", "rich", "WindPy", "numpy")),
+    ("data_engines", ["-c", "import data_engines"], 2500, ("WindPy",)),
+]
+
+
+def measure_import_time(py_args: list[str], cwd: str) -> tuple[float, set[str]]:
+    """
+
+    :return: (ms of all top level imports, names of all imported modules)
+    """
+    import subprocess
+    import sys
+
+    p = subprocess.run(
+        [sys.executable, "-X", "importtime"] + py_args, cwd=cwd, capture_output=True, text=True,
+    )
+    if p.returncode != 0:
+        raise RuntimeError(f"python {' '.join(py_args)} failed:\n{p.stderr}")
+    total, modules = 0.0, set()
+    for line in p.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not cumulative.strip().isdigit():
+            # header line
+            continue
+        modules.add(name.strip())
+        if not name.startswith("  "):
+            # nested imports are already counted by the top level one
+            total += int(cumulative) / 1e3
+    return total, modules
+
+
+def bench_importtime(repeat: int, scale: float):
+    import sys
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    baseline = min(measure_import_time(["-c", "pass"], cwd)[0] for _ in range(repeat))
+    print(f"interpreter = {baseline:.1f} ms, it is excluded from the costs below")
+    failures = []
+    for name, py_args, budget, forbidden in IMPORT_TIME_TARGETS:
+        costs, modules = [], set()
+        for _ in range(repeat):
+            total, modules = measure_import_time(py_args, cwd)
+            costs.append(total - baseline)
+        cost, budget = min(costs), budget * scale
+        loaded = sorted(m for m in forbidden if m in {z.split(".")[0] for z in modules})
+        status = "ok" if cost <= budget and not loaded else "FAIL"
+        print(
+            f"{name:<20s} cost = {cost:>8.1f} ms, budget = {budget:>8.1f} ms, "
+            f"forbidden modules loaded = {loaded}, {status}"
+        )
+        if status != "ok":
+            failures.append(name)
+    if failures:
+        print(f"import time regressions: {failures}")
+        sys.exit(1)
+    return 0
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.func == "calendar":
+        bench_calendar(calendar_path=args.calendar, number=args.number)
+    elif args.func == "download":
+        bench_download(
+            bgn_date=args.bgn, stp_date=args.stp, switches=args.switch, workers_list=args.workers,
+            batch_list=args.batch, latency=args.latency, jitter=args.jitter, rate=args.rate,
+        )
+    elif args.func == "read":
+        bench_read(days=args.days, rows=args.rows, workers=args.workers)
+    elif args.func == "codec":
+        bench_codec(days=args.days, src_root_dir=args.src)
+    elif args.func == "assemble":
+        bench_assemble(bgn_date=args.bgn, stp_date=args.stp, n_codes=args.codes)
+    elif args.func == "minute":
+        bench_minute(days_list=args.days, n_codes=args.codes, max_data_points=args.points)
+    elif args.func == "ratecontrol":
+        bench_ratecontrol(rate=args.rate, quota_rate=args.quota, days=args.days, jobs=args.jobs)
+    elif args.func == "importtime":
+        bench_importtime(repeat=args.repeat, scale=args.scale)
+    else:
+        raise ValueError(f"func = {args.func} is illegal")
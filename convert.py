@@ -0,0 +1,111 @@
+import os
+import dataclasses
+import datetime as dt
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from loguru import logger
+from rich.progress import track
+from typedef import CSaveDataInfo
+from manifest import CManifest, CManifestRecord, make_record
+from qcalendar import CCalendar
+from qutility import qtimer, SFG
+from qwriter import save_atomically
+
+
+def convert_daily_file(
+        src_info: CSaveDataInfo, dst_info: CSaveDataInfo, trade_date: str, save_root_dir: str, remove_src: bool,
+) -> CManifestRecord:
+    """
+    run in worker processes of CCodecConverter, the new file is written atomically before the old one is removed
+
+    """
+    src_path = src_info.get_save_path(save_root_dir, trade_date)
+    dst_path = dst_info.get_save_path(save_root_dir, trade_date)
+    data = src_info.read_file(src_path)
+    save_atomically(data, dst_path)
+    download_time = dt.datetime.fromtimestamp(os.path.getmtime(src_path)).strftime("%Y-%m-%d %H:%M:%S")
+    if remove_src:
+        os.remove(src_path)
+    return make_record(dst_info, trade_date, data, dst_path, download_time)
+
+
+class CCodecConverter(object):
+    def __init__(self, save_root_dir: str, manifest: CManifest):
+        """
+        migrate daily files of a tree from one codec to another
+
+        :param save_root_dir:
+        :param manifest: records of converted files are replaced, as their checksums change
+        """
+        self.save_root_dir = save_root_dir
+        self.manifest = manifest
+
+    @qtimer
+    def convert(
+            self, save_data_info: CSaveDataInfo, src_codec: str, bgn_date: str, stp_date: str, calendar: CCalendar,
+            workers: int = 4, remove_src: bool = False,
+    ) -> list[str]:
+        """
+        files of src_codec in [bgn_date, stp_date) are converted to save_data_info.codec, dates
+        already converted are skipped, so a killed conversion can be run again
+
+        :param save_data_info: dataset with the codec to convert to
+        :param src_codec: codec of existing files, like "csv.gz"
+        :param bgn_date:
+        :param stp_date:
+        :param calendar:
+        :param workers: number of processes
+        :param remove_src: if True, old files are removed after new files are saved
+        :return: converted dates, files failed to convert are logged and skipped
+        """
+        if src_codec == save_data_info.codec:
+            raise ValueError(f"{save_data_info.desc} is already saved with codec = {src_codec}")
+        src_info = dataclasses.replace(save_data_info, codec=src_codec)
+        trade_dates = [
+            d for d in calendar.get_iter_list(bgn_date, stp_date)
+            if os.path.exists(src_info.get_save_path(self.save_root_dir, d))
+            and not os.path.exists(save_data_info.get_save_path(self.save_root_dir, d))
+        ]
+        futures: dict[Future, str] = {}
+        converted_dates: list[str] = []
+        failed_dates: list[str] = []
+
+        def __record(future: Future):
+            # each file is recorded once converted, so records of files converted before a failure or an interrupt
+            # are kept, reruns skip these files as new files exist
+            trade_date = futures.pop(future)
+            try:
+                self.manifest.save_records([future.result()])
+                converted_dates.append(trade_date)
+            except Exception as e:
+                logger.error(f"Failed to convert {save_data_info.desc} for {trade_date}: {e}")
+                failed_dates.append(trade_date)
+            return 0
+
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(convert_daily_file, src_info, save_data_info, d, self.save_root_dir, remove_src): d
+                    for d in trade_dates
+                }
+                try:
+                    for future in track(
+                            as_completed(list(futures)), total=len(futures),
+                            description=f"Converting {save_data_info.desc} to {save_data_info.codec}",
+                    ):
+                        __record(future)
+                except KeyboardInterrupt:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            for future in [f for f in futures if f.done() and not f.cancelled()]:
+                __record(future)
+        logger.info(
+            f"{len(converted_dates)} files of {save_data_info.desc} are converted from {SFG(src_codec)} "
+            f"to {SFG(save_data_info.codec)}"
+        )
+        if failed_dates:
+            logger.error(
+                f"{len(failed_dates)} files of {save_data_info.desc} failed to convert: {sorted(failed_dates)}"
+            )
+        return sorted(converted_dates)
@@ -0,0 +1,264 @@
+import re
+import json
+import queue
+import threading
+import datetime as dt
+from dataclasses import dataclass, field, asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+from loguru import logger
+from typedef import CSaveDataInfo
+from database import CColumnarStore
+from qcalendar import CCalendar, CCalendarSection, CSection, CONST_TS2
+
+
+@dataclass
+class CServeJob:
+    bgn_date: str
+    stp_date: str
+    switches: list[str]
+    source: str  # like "section 20241008-TS2" or "http"
+    batch: bool = False
+    job_id: int = 0
+    status: str = "queued"  # queued, running, done, failed
+    failed_dates: list[str] = field(default_factory=list)
+    error: str = ""
+    submit_time: str = ""
+    finish_time: str = ""
+
+
+class CDownloadDaemon(object):
+    def __init__(
+            self,
+            datasets: dict[str, CSaveDataInfo],
+            engine_factory: Callable[[list[CSaveDataInfo]], object],
+            calendar: CCalendar,
+            calendar_section: CCalendarSection,
+            src_root_dir: str,
+            db_root_dir: str,
+            trigger_sections: tuple[str, ...] = (CONST_TS2,),
+            poll_interval: float = 30.0,
+            max_history: int = 100,
+    ):
+        """
+        resident process keeping WIND session and calendars warm. When a section in trigger_sections
+        is closed, data of its trade date is downloaded for all datasets, and the database is updated.
+        Backfill jobs can be submitted by HTTP, and all jobs are run one by one in the main loop.
+
+        :param datasets: {switch: save_data_info}, like pro_cfg.datasets
+        :param engine_factory: create an engine for datasets, engines share the WIND session of the process
+        :param calendar:
+        :param calendar_section:
+        :param src_root_dir: root directory of daily files
+        :param db_root_dir: root directory of database
+        :param trigger_sections: daily data is available after TS2 (day session) of its trade date is closed
+        :param poll_interval: seconds between two checks of sections
+        :param max_history: number of finished jobs kept for status
+        """
+        self.datasets = datasets
+        self.engine_factory = engine_factory
+        self.calendar = calendar
+        self.calendar_section = calendar_section
+        self.src_root_dir = src_root_dir
+        self.db_root_dir = db_root_dir
+        self.trigger_sections = trigger_sections
+        self.poll_interval = poll_interval
+        self.max_history = max_history
+        self.__jobs: queue.Queue[CServeJob] = queue.Queue()
+        self.__history: list[CServeJob] = []
+        self.__lock = threading.Lock()
+        self.__stop_event = threading.Event()
+        self.__last_sec: CSection | None = None
+        self.__last_trigger_sec: CSection | None = None
+        self.__out_of_sections = False
+        self.__checked = False
+        self.__job_id = 0
+        self.__http_server: ThreadingHTTPServer | None = None
+
+    # --- jobs
+    def submit(self, bgn_date: str, stp_date: str, switches: list[str] | None = None, source: str = "http",
+               batch: bool = False) -> CServeJob:
+        for name, date in (("bgn_date", bgn_date), ("stp_date", stp_date)):
+            if not isinstance(date, str):
+                raise TypeError(f"{name} = {date!r} should be a str")
+            if not re.fullmatch(r"\d{8}", date):
+                raise ValueError(f"{name} = {date} should be in the format of YYYYMMDD")
+        if switches is not None and not (isinstance(switches, list) and all(isinstance(z, str) for z in switches)):
+            raise TypeError(f"switches = {switches!r} should be a list of str")
+        switches = switches or list(self.datasets)
+        if illegal_switches := [z for z in switches if z not in self.datasets]:
+            raise ValueError(f"switches {illegal_switches} are illegal")
+        if bgn_date >= stp_date:
+            raise ValueError(f"bgn_date = {bgn_date} should be less than stp_date = {stp_date}")
+        with self.__lock:
+            self.__job_id += 1
+            job = CServeJob(
+                bgn_date=bgn_date, stp_date=stp_date, switches=switches, source=source, batch=batch,
+                job_id=self.__job_id, submit_time=dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            )
+            self.__history.append(job)
+            self.__history = self.__history[-self.max_history:]
+        self.__jobs.put(job)
+        logger.info(f"Job {job.job_id} from {source} is queued: [{bgn_date}, {stp_date}) of {switches}")
+        return job
+
+    def __run_job(self, job: CServeJob):
+        job.status = "running"
+        try:
+            save_data_infos = [self.datasets[z] for z in job.switches]
+            engine = self.engine_factory(save_data_infos)
+            engine.download_data_range(
+                bgn_date=job.bgn_date, stp_date=job.stp_date, calendar=self.calendar, batch=job.batch,
+            )
+            job.failed_dates = list(engine.failed_dates)
+            for save_data_info in save_data_infos:
+                store = CColumnarStore(db_root_dir=self.db_root_dir, save_data_info=save_data_info)
+                store.update(
+                    bgn_date=job.bgn_date, stp_date=job.stp_date, calendar=self.calendar,
+                    src_root_dir=self.src_root_dir,
+                )
+            job.status = "failed" if job.failed_dates else "done"
+        except Exception as e:
+            # the daemon keeps running, the job can be submitted again
+            logger.exception(f"Job {job.job_id} failed: {e}")
+            job.status, job.error = "failed", str(e)
+        job.finish_time = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return 0
+
+    # --- sections
+    def __get_stp_date(self, trade_date: str) -> str:
+        try:
+            return self.calendar.get_next_date(trade_date, shift=1)
+        except IndexError:
+            # last date of calendar, the next natural day is enough for a right open interval
+            return CCalendar.move_date_string(trade_date, move_days=1)
+
+    def __submit_sec(self, sec: CSection):
+        # sections are submitted in order, a section not later than the last one is submitted already
+        if self.__last_trigger_sec is not None and sec <= self.__last_trigger_sec:
+            return 0
+        self.__last_trigger_sec = sec
+        self.submit(
+            bgn_date=sec.trade_date, stp_date=self.__get_stp_date(sec.trade_date), source=f"section {sec.secId}",
+        )
+        return 0
+
+    def __catch_up(self, tp: str):
+        if (sec := self.calendar_section.get_last_closed_sec(tp, self.trigger_sections)) is not None:
+            self.__submit_sec(sec)
+        return 0
+
+    def check_sections(self, tp: str | None = None):
+        """
+        find sections closed since last check, and submit jobs for those in trigger_sections.
+        At the first check, out of sections and when sections begin again, the latest section in
+        trigger_sections closed before tp is submitted, so a daemon started at any time catches
+        up. Dates already downloaded are skipped by engines.
+
+        :param tp: timestamp of the check, with format "YYYYMMDD HH:MM:SS.ffffff", now if not provided
+        """
+        tp = tp or dt.datetime.now().strftime("%Y%m%d %H:%M:%S.%f")
+        matched, this_sec = self.calendar_section.match(tp)
+        if not matched:
+            # like weekends and holidays, last section is kept and compared when sections begin again
+            if not self.__out_of_sections:
+                logger.info("Now is out of calendar sections, waiting for the next section")
+                self.__out_of_sections = True
+            # sections closed at the start of the period are found here, not at its end
+            self.__catch_up(tp)
+            self.__checked = True
+            return 0
+        if self.__last_sec is not None and this_sec != self.__last_sec:
+            for sec in self.calendar_section.get_iter_list(self.__last_sec, this_sec):
+                if sec.section in self.trigger_sections:
+                    self.__submit_sec(sec)
+        if not self.__checked or self.__out_of_sections:
+            self.__catch_up(tp)
+        self.__checked = True
+        self.__out_of_sections = False
+        self.__last_sec = this_sec
+        return 0
+
+    # --- status
+    def get_status(self) -> dict:
+        with self.__lock:
+            history = [asdict(z) for z in self.__history]
+        return {
+            "section": None if self.__last_sec is None else self.__last_sec.secId,
+            "pending": self.__jobs.qsize(),
+            "jobs": history,
+        }
+
+    # --- http
+    def start_http(self, host: str, port: int):
+        daemon = self
+
+        class CHandler(BaseHTTPRequestHandler):
+            def __reply(self, code: int, content: dict):
+                body = json.dumps(content).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/status":
+                    self.__reply(200, daemon.get_status())
+                else:
+                    self.__reply(404, {"error": f"{self.path} is not found"})
+
+            def do_POST(self):
+                if self.path != "/backfill":
+                    self.__reply(404, {"error": f"{self.path} is not found"})
+                    return
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    req = json.loads(self.rfile.read(length) or b"{}")
+                    job = daemon.submit(
+                        bgn_date=req["bgn"], stp_date=req["stp"], switches=req.get("switch"),
+                        batch=bool(req.get("batch", False)),
+                    )
+                except (KeyError, ValueError, TypeError) as e:
+                    self.__reply(400, {"error": f"illegal request: {e}"})
+                    return
+                self.__reply(202, asdict(job))
+
+            def log_message(self, fmt: str, *args):
+                logger.debug(f"HTTP {self.address_string()} {fmt % args}")
+
+        self.__http_server = ThreadingHTTPServer((host, port), CHandler)
+        threading.Thread(target=self.__http_server.serve_forever, daemon=True).start()
+        logger.info(f"Daemon is listening on http://{host}:{self.__http_server.server_port}")
+        return 0
+
+    @property
+    def http_port(self) -> int | None:
+        return None if self.__http_server is None else self.__http_server.server_port
+
+    # --- main loop
+    def serve_forever(self, host: str = "127.0.0.1", port: int = 8765):
+        """
+
+        :param host: only local requests are accepted by default
+        :param port: 0 to pick a free port
+        :return:
+        """
+        self.start_http(host, port)
+        try:
+            while not self.__stop_event.is_set():
+                self.check_sections()
+                try:
+                    job = self.__jobs.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    continue
+                self.__run_job(job)
+        except KeyboardInterrupt:
+            logger.info("Daemon is interrupted")
+        finally:
+            self.__http_server.shutdown()
+        return 0
+
+    def stop(self):
+        self.__stop_event.set()
+        return 0
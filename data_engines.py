@@ -1,151 +1,961 @@
 import os
-import sys
 import time
+import functools
+import queue
+import threading
+import datetime as dt
+import numpy as np
 import pandas as pd
 from loguru import logger
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from rich.progress import Progress, TaskID
-from WindPy import w as wapi
-from qutility import check_and_makedirs, qtimer, SFG
-from qcalendar import CCalendar
+from qutility import qtimer, batched, SFG
+from qcalendar import CCalendar, CCalendarSection, CSection, CONST_TS1, CONST_TS2
+from typedef import CSaveDataInfo, CWindFieldGroup, CWindSaveDataInfo, CWindMinuteSaveDataInfo
+from qthrottle import CTokenBucket, CRetryPolicy, CAdaptiveRateController
+from qmetrics import CMetrics
+from qwriter import CAsyncWriter, CParquetStreamWriter
+from manifest import CManifest
+from quniverse import CUniverseHistory
+from wind_cache import CWindResponseCache
+from wind_session import CWindSession, CWindSessionError, get_wind_session
 
 pd.set_option('display.unicode.east_asian_width', True)
-logger.add("logs/download_and_update.log")
+
+
+class CDownloadError(Exception):
+    pass
+
+
+# kinds of errors from WIND
+WIND_ERR_KIND_TRANSIENT, WIND_ERR_KIND_QUOTA, WIND_ERR_KIND_FATAL = "transient", "quota", "fatal"
+WIND_ERR_CODES_TRANSIENT = {
+    -40520008,  # timeout
+    -40520011,  # server not found
+    -40521009,  # decode failed
+    -40521010,  # network timeout
+    -40520004,  # api is not started, the session is reconnected before retry
+}
+WIND_ERR_CODES_QUOTA = {
+    -40522017,  # data quota exceeded
+}
+WIND_ERR_CODE_NO_DATA = -40520007  # no data in the range, like wsi of a holiday, it is not retried
+
+
+def classify_wind_error_code(error_code: int) -> str:
+    if error_code in WIND_ERR_CODES_QUOTA:
+        return WIND_ERR_KIND_QUOTA
+    elif error_code in WIND_ERR_CODES_TRANSIENT:
+        return WIND_ERR_KIND_TRANSIENT
+    else:
+        return WIND_ERR_KIND_FATAL
+
+
+class CWindApiError(CDownloadError):
+    def __init__(self, error_code: int, method: str, detail: str = ""):
+        self.error_code = error_code
+        self.method = method
+        self.kind = classify_wind_error_code(error_code)
+        super().__init__(f"When call {method} of WIND, ErrorCode = {error_code}, {self.kind} error. {detail}")
+
+
+def plan_date_chunks(
+        trade_dates: list[str], calendar: CCalendar, n_codes: int, n_fields: int, max_data_points: int,
+) -> list[list[str]]:
+    """
+
+    :param trade_dates: dates to download, ascending
+    :param calendar:
+    :param n_codes: number of codes requested in one call
+    :param n_fields: number of fields requested in one call
+    :param max_data_points: upper limit of data points (codes x fields x dates) in one call
+    :return: chunks of trade dates, the calendar window of each chunk is no longer than
+             max_data_points // (n_codes * n_fields) trade dates
+    """
+    win = max(max_data_points // (n_codes * n_fields), 1)
+    chunks: list[list[str]] = []
+    chunk: list[str] = []
+    chunk_bgn_sn = 0
+    for trade_date in trade_dates:
+        sn = calendar.get_sn(trade_date)
+        if chunk and sn - chunk_bgn_sn >= win:
+            chunks.append(chunk)
+            chunk = []
+        if not chunk:
+            chunk_bgn_sn = sn
+        chunk.append(trade_date)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+# {dataset name: {code: missing fields}}, datasets not in it are downloaded completely
+TCells = dict[str, dict[str, tuple[str, ...]]]
+
+
+def get_cells_key(cells: TCells) -> tuple:
+    return tuple(sorted((name, tuple(sorted(code_fields.items()))) for name, code_fields in cells.items()))
 
 
 @dataclass(frozen=True)
-class CSaveDataInfo:
-    file_format: str
-    desc: str
-    fields: tuple[str, ...]
+class CDataBlock:
+    """
+    values of a dataset for a window of dates, with one row for each code in universe. Engines
+    write responses into it in place, and DataFrames are only materialized when they are written.
+
+    """
+    trade_dates: tuple[str, ...]
+    ts_codes: list[str]
+    wd_codes: list[str]
+    value_fields: tuple[str, ...]
+    values: np.ndarray  # shape = (dates, codes, value fields), NaN if not downloaded
+    date_rows: dict[str, int] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "date_rows", {trade_date: i for i, trade_date in enumerate(self.trade_dates)})
+
+    def get_data(self, trade_date: str) -> pd.DataFrame:
+        values = self.values[self.date_rows[trade_date]]
+        return pd.DataFrame({
+            "ts_code": self.ts_codes, "wd_code": self.wd_codes,
+            **{f: values[:, j] for j, f in enumerate(self.value_fields)},
+        })
+
+
+@dataclass(frozen=True)
+class CDownloadJob:
+    trade_dates: list[str]
+    save_data_infos: tuple[CSaveDataInfo, ...]
+    cells: TCells = field(default_factory=dict)  # missing cells of datasets partially downloaded
+
+    @property
+    def desc(self) -> str:
+        return ", ".join(save_data_info.desc for save_data_info in self.save_data_infos)
 
 
 class __CDataEngine:
-    def __init__(self, save_root_dir: str, save_file_format: str, data_desc: str):
+    def __init__(
+            self, save_root_dir: str, save_data_infos: list[CSaveDataInfo], manifest: CManifest | None = None,
+            metrics: CMetrics | None = None,
+    ):
+        """
+
+        :param save_root_dir:
+        :param save_data_infos: datasets downloaded by the engine, dates are iterated once for all of them
+        :param manifest: manifest of save_root_dir, if provided, dates recorded in it are skipped
+                         without probing the file system, and saved files are recorded in it
+        :param metrics: timings of stages and calls, summarized and dumped at the end of each run
+        """
         self.save_root_dir = save_root_dir
-        self.save_file_format = save_file_format
-        self.data_desc = data_desc
+        self.save_data_infos = save_data_infos
+        self.manifest = manifest
+        self.metrics = metrics or CMetrics()
+        self.manifest_records: dict[str, dict] = {}
+
+    @property
+    def data_desc(self) -> str:
+        return ", ".join(save_data_info.desc for save_data_info in self.save_data_infos)
+
+    def download_daily_data(
+            self, trade_date: str, save_data_infos: tuple[CSaveDataInfo, ...], cells: TCells,
+            task_id: TaskID, pb: Progress,
+    ) -> dict[str, CDataBlock]:
+        """
+
+        :return: {save_data_info.name: block of trade_date}, cells not requested are NaN
+        """
+        raise NotImplementedError
+
+    def download_range_data(
+            self, trade_dates: list[str], save_data_infos: tuple[CSaveDataInfo, ...], cells: TCells,
+            task_id: TaskID, pb: Progress,
+    ) -> dict[str, CDataBlock]:
+        """
+
+        :return: {save_data_info.name: block of trade_dates}, cells not requested are NaN
+        """
+        raise NotImplementedError
 
-    def download_daily_data(self, trade_date: str, task_id: TaskID, pb: Progress) -> pd.DataFrame:
+    def plan_date_chunks(
+            self, trade_dates: list[str], calendar: CCalendar, save_data_infos: tuple[CSaveDataInfo, ...],
+            cells: TCells,
+    ) -> list[list[str]]:
         raise NotImplementedError
 
+    def find_gaps(
+            self, existing_codes: set[str], existing_columns: set[str], save_data_info: CSaveDataInfo,
+    ) -> dict[str, tuple[str, ...]]:
+        """
+
+        :param existing_codes: codes in the existing file
+        :param existing_columns: columns of the existing file
+        :param save_data_info:
+        :return: {code: missing fields}, empty if the file is complete
+        """
+        raise NotImplementedError
+
+    def get_save_path(self, trade_date: str, save_data_info: CSaveDataInfo) -> str:
+        return save_data_info.get_save_path(self.save_root_dir, trade_date)
+
+    def check_trade_date(
+            self, trade_date: str, fill_gaps: bool,
+    ) -> tuple[tuple[CSaveDataInfo, ...], TCells]:
+        """
+
+        :param trade_date:
+        :param fill_gaps: if True, codes and columns of existing files are checked to find missing cells,
+                          they are loaded from manifest if recorded, or else read from files
+        :return: (datasets to download, missing cells of datasets partially downloaded)
+        """
+        missing_infos, cells = [], {}
+        for save_data_info in self.save_data_infos:
+            save_path = self.get_save_path(trade_date, save_data_info)
+            if r := self.manifest_records.get(save_data_info.name, {}).get(trade_date):
+                existing_codes, existing_columns = set(r.codes), set(r.columns)
+            elif os.path.exists(save_path):
+                if self.manifest is not None:
+                    logger.warning(f"{save_path} is not in manifest, rebuild manifest to record it")
+                if fill_gaps:
+                    existing_data = save_data_info.read_file(save_path)
+                    existing_codes, existing_columns = set(existing_data["wd_code"]), set(existing_data.columns)
+                else:
+                    existing_codes, existing_columns = set(), set()
+            else:
+                missing_infos.append(save_data_info)
+                continue
+
+            if fill_gaps and (gaps := self.find_gaps(existing_codes, existing_columns, save_data_info)):
+                missing_infos.append(save_data_info)
+                cells[save_data_info.name] = gaps
+            else:
+                logger.info(f"{save_data_info.desc} for {trade_date} exists, program will skip it")
+        return tuple(missing_infos), cells
+
+    def plan_jobs(
+            self, missing: dict[str, tuple[tuple[CSaveDataInfo, ...], TCells]], calendar: CCalendar, batch: bool,
+    ) -> list[CDownloadJob]:
+        """
+
+        :param missing: {trade_date: (datasets to download, missing cells of datasets partially downloaded)}
+        :param calendar:
+        :param batch:
+        :return: jobs sorted by dates, dates missing the same datasets and cells are chunked together
+                 in batch mode, so a contract added to universe is downloaded for long windows in few calls
+        """
+        dates_by_gaps: dict[tuple, tuple[tuple[CSaveDataInfo, ...], TCells, list[str]]] = {}
+        for trade_date, (save_data_infos, cells) in missing.items():
+            key = (save_data_infos, get_cells_key(cells))
+            dates_by_gaps.setdefault(key, (save_data_infos, cells, []))[2].append(trade_date)
+        jobs: list[CDownloadJob] = []
+        for save_data_infos, cells, trade_dates in dates_by_gaps.values():
+            if batch:
+                chunks = self.plan_date_chunks(trade_dates, calendar, save_data_infos, cells)
+            else:
+                chunks = [[d] for d in trade_dates]
+            jobs.extend(
+                CDownloadJob(trade_dates=chunk, save_data_infos=save_data_infos, cells=cells) for chunk in chunks
+            )
+        return sorted(jobs, key=lambda z: z.trade_dates[0])
+
+    def download_job_data(self, job: CDownloadJob, batch: bool, task_id: TaskID, pb: Progress) \
+            -> dict[str, CDataBlock]:
+        if batch:
+            return self.download_range_data(job.trade_dates, job.save_data_infos, job.cells, task_id=task_id, pb=pb)
+        else:
+            trade_date = job.trade_dates[0]
+            return self.download_daily_data(trade_date, job.save_data_infos, job.cells, task_id=task_id, pb=pb)
+
+    @staticmethod
+    def merge_into_existing(new_data: pd.DataFrame, save_path: str, save_data_info: CSaveDataInfo) -> pd.DataFrame:
+        """
+        values in the existing file are kept, missing cells are filled with new data
+
+        :param new_data:
+        :param save_path: path of the existing file
+        :param save_data_info:
+        :return: rows of new data in the same order, followed by rows only in the existing file
+        """
+        if not os.path.exists(save_path):
+            raise CDownloadError(f"{save_path} is in manifest but missing, verify manifest to drop its record")
+        keys = list(save_data_info.key_fields)
+        old_data = save_data_info.read_file(save_path).set_index(keys)
+        new_data = new_data.set_index(keys)
+        merged_data = old_data.combine_first(new_data)
+        index = new_data.index.append(old_data.index.difference(new_data.index))
+        return merged_data.reindex(index=index, columns=save_data_info.value_fields).reset_index()
+
     @qtimer
-    def download_data_range(self, bgn_date: str, stp_date: str, calendar: CCalendar):
+    def download_data_range(
+            self, bgn_date: str, stp_date: str, calendar: CCalendar, batch: bool = False, workers: int = 1,
+            writers: int = 1, retry_rounds: int = 2, fill_gaps: bool = False, show_progress: bool = True,
+    ):
+        """
+
+        :param bgn_date:
+        :param stp_date:
+        :param calendar:
+        :param batch: if True, dates are downloaded in chunks by download_range_data, and then
+                      split back into the same daily files
+        :param workers: number of threads pulling jobs from the queue, calls to API are still
+                        limited by the rate limiter of the engine
+        :param writers: number of background threads saving the downloaded data
+        :param retry_rounds: jobs failed with CDownloadError are put into a retry queue, which is
+                             downloaded again after all the other jobs, for at most retry_rounds times.
+                             Dates still failed are kept in self.failed_dates.
+        :param fill_gaps: if True, existing files are also checked, missing instruments and fields
+                          are downloaded and merged into them
+        :param show_progress: False in worker processes, whose progress is reported by the parent
+        :return:
+        """
         iter_dates = calendar.get_iter_list(bgn_date, stp_date)
-        with Progress() as pb:
+        with Progress(disable=not show_progress) as pb:
             task_pri = pb.add_task(description="Pri-task description to be updated", total=len(iter_dates))
             task_sub = pb.add_task(description="Sub-task description to be updated")
+            if self.manifest is not None:
+                self.manifest_records = {z.name: self.manifest.load(z) for z in self.save_data_infos}
+            missing: dict[str, tuple[tuple[CSaveDataInfo, ...], TCells]] = {}
             for trade_date in iter_dates:
-                pb.update(task_id=task_pri, description=f"Processing data for {SFG(trade_date)}")
-                check_and_makedirs(save_dir := os.path.join(self.save_root_dir, trade_date[0:4], trade_date))
-                save_file = self.save_file_format.format(trade_date)
-                save_path = os.path.join(save_dir, save_file)
-                if os.path.exists(save_path):
-                    logger.info(f"{self.data_desc} for {trade_date} exists, program will skip it")
+                missing_infos, cells = self.check_trade_date(trade_date, fill_gaps)
+                if missing_infos:
+                    missing[trade_date] = (missing_infos, cells)
                 else:
-                    trade_date_data = self.download_daily_data(trade_date, task_id=task_sub, pb=pb)
-                    trade_date_data.to_csv(save_path, index=False)
-                pb.update(task_id=task_pri, advance=1)
+                    pb.update(task_id=task_pri, advance=1)
+            if n_cells := sum(len(z) for _, cells in missing.values() for z in cells.values()):
+                logger.info(f"{n_cells} instruments with missing fields found in existing files of {self.data_desc}")
+
+            jobs = self.plan_jobs(missing, calendar, batch)
+            with CAsyncWriter(workers=writers, max_pending=max(4 * workers, 16), metrics=self.metrics) as writer:
+                failed_jobs = self.__download_jobs(jobs, batch, workers, writer, task_pri, task_sub, pb)
+                for r in range(retry_rounds):
+                    if not failed_jobs:
+                        break
+                    logger.warning(f"Retry {len(failed_jobs)} failed jobs of {self.data_desc}, round {r + 1}")
+                    failed_jobs = self.__download_jobs(failed_jobs, batch, workers, writer, task_pri, task_sub, pb)
+        self.failed_dates = sorted(d for job in failed_jobs for d in job.trade_dates)
+        if self.failed_dates:
+            logger.error(f"{self.data_desc} for {len(self.failed_dates)} dates failed: {self.failed_dates}")
+        self.metrics.log_summary(title=f"Metrics of {self.data_desc}")
+        self.metrics.dump()
         return 0
 
+    def __download_jobs(
+            self, jobs: list[CDownloadJob], batch: bool, workers: int, writer: CAsyncWriter,
+            task_pri: TaskID, task_sub: TaskID, pb: Progress,
+    ) -> list[CDownloadJob]:
+        """
+
+        :return: failed jobs
+        """
+        if workers > 1:
+            return self.__download_jobs_concurrently(jobs, batch, workers, writer, task_pri, task_sub, pb)
+        failed_jobs = []
+        for job in jobs:
+            if not self.__try_download_job(job, batch, writer, task_pri, task_sub, pb):
+                failed_jobs.append(job)
+        return failed_jobs
+
+    def __try_download_job(
+            self, job: CDownloadJob, batch: bool, writer: CAsyncWriter, task_pri: TaskID, task_sub: TaskID,
+            pb: Progress,
+    ) -> bool:
+        try:
+            self.__download_job(job, batch, writer, task_pri, task_sub, pb)
+            return True
+        except CDownloadError as e:
+            logger.error(
+                f"{job.desc} for {job.trade_dates[0]} -> {job.trade_dates[-1]} failed, "
+                f"it is put into retry queue. {e}"
+            )
+            return False
+
+    def __download_job(
+            self, job: CDownloadJob, batch: bool, writer: CAsyncWriter, task_pri: TaskID, task_sub: TaskID,
+            pb: Progress,
+    ):
+        bgn_date, end_date = job.trade_dates[0], job.trade_dates[-1]
+        desc = f"{SFG(bgn_date)} -> {SFG(end_date)}" if batch else SFG(bgn_date)
+        pb.update(task_id=task_pri, description=f"Processing data for {desc}")
+        job_data = self.download_job_data(job, batch=batch, task_id=task_sub, pb=pb)
+        for trade_date in job.trade_dates:
+            for save_data_info in job.save_data_infos:
+                data = job_data[save_data_info.name].get_data(trade_date)
+                save_path = self.get_save_path(trade_date, save_data_info)
+                if save_data_info.name in job.cells:
+                    with self.metrics.timer("stage_seconds", stage="merge"):
+                        data = self.merge_into_existing(data, save_path, save_data_info)
+                if self.manifest is not None:
+                    on_saved = functools.partial(self.manifest.record, save_data_info, trade_date)
+                else:
+                    on_saved = None
+                writer.submit(data, save_path, on_saved=on_saved)
+            pb.update(task_id=task_pri, advance=1)
+        return 0
+
+    def __download_jobs_concurrently(
+            self, jobs: list[CDownloadJob], batch: bool, workers: int, writer: CAsyncWriter,
+            task_pri: TaskID, task_sub: TaskID, pb: Progress,
+    ) -> list[CDownloadJob]:
+        jobs_queue: queue.Queue[CDownloadJob] = queue.Queue()
+        for job in jobs:
+            jobs_queue.put(job)
+        stop_event, errors, failed_jobs = threading.Event(), [], []
+
+        def __worker():
+            while not stop_event.is_set():
+                try:
+                    job = jobs_queue.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    if not self.__try_download_job(job, batch, writer, task_pri, task_sub, pb):
+                        failed_jobs.append(job)
+                except Exception as e:
+                    errors.append(e)
+                    stop_event.set()
+
+        threads = [threading.Thread(target=__worker, daemon=True) for _ in range(min(workers, len(jobs)))]
+        for t in threads:
+            t.start()
+        try:
+            for t in threads:
+                t.join()
+        except KeyboardInterrupt:
+            stop_event.set()
+            raise
+        if errors:
+            raise errors[0]
+        return failed_jobs
+
 
 class __CDataEngineWind(__CDataEngine):
-    def __init__(self, save_root_dir: str, save_file_format: str, data_desc: str, universe: list[str]):
-        self.api = wapi
-        self.api.start()
+    def __init__(
+            self, save_root_dir: str, save_data_infos: list[CSaveDataInfo], universe: list[str],
+            max_data_points: int = 50000, limiter: CTokenBucket | None = None, api=None,
+            retry_policy: CRetryPolicy | None = None, cache: CWindResponseCache | None = None,
+            manifest: CManifest | None = None, universe_history: CUniverseHistory | None = None,
+            metrics: CMetrics | None = None, rate_controller: CAdaptiveRateController | None = None,
+    ):
+        """
+
+        :param save_root_dir:
+        :param save_data_infos:
+        :param universe:
+        :param max_data_points: upper limit of data points in one wsd call, used to plan date chunks
+                                in batch mode
+        :param limiter: shared by all workers (and engines if provided), every call to API takes
+                        one token from it. Default is 2 calls per second.
+        :param api: object with the same interface as WindPy.w, like wind_fake.CFakeWindApi.
+                    WindPy.w is used if not provided. Engines with the same api share one session,
+                    which is started at the first call.
+        :param retry_policy: backoff of retries for transient and quota errors
+        :param cache: cache of responses, if it is in cache-only mode, API is never started
+        :param manifest: manifest of save_root_dir
+        :param universe_history: if provided, only instruments listed on a date
+                                 are requested, and rows of the others are kept with NaN
+        :param metrics: latencies, data points, retries and error codes of calls are also recorded
+        :param rate_controller: adapts the rate of limiter to quota errors. Engines sharing a limiter
+                                should share it too, or else each of them takes the rate already
+                                decreased by the others as its max rate. Created for limiter if not provided.
+        """
+        self.cache = cache
+        self.session: CWindSession | None = None
+        if cache is None or not cache.cache_only:
+            self.session = get_wind_session(api)
         self.universe = universe
-        super().__init__(save_root_dir, save_file_format, data_desc)
+        # built once, rows of blocks follow the order of universe
+        self.code_rows: dict[str, int] = {code: i for i, code in enumerate(universe)}
+        self.ts_codes: list[str] = [self.wind2tushare(z) for z in universe]
+        self.__request_groups: dict[CSaveDataInfo, list[tuple[list[str], dict[str, str]]]] = {}
+        self.__block_targets: dict[CSaveDataInfo, dict[str, list[tuple[int, np.ndarray]]]] = {}
+        self.universe_history = universe_history
+        self.max_data_points = max_data_points
+        self.limiter = limiter or CTokenBucket(rate=2.0)
+        self.rate_controller = rate_controller or CAdaptiveRateController(self.limiter)
+        self.retry_policy = retry_policy or CRetryPolicy()
+        super().__init__(save_root_dir, save_data_infos, manifest, metrics)
+
+    def query(self, method: str, **kwargs):
+        """
+        call API with rate limit, transient and quota errors are retried with backoff,
+        and quota errors also slow down the rate limiter
+
+        :param method: name of API function, like "wss", "wsd"
+        :param kwargs: arguments passed to API function
+        :return: result with ErrorCode = 0, or CWindApiError is raised
+        """
+        if self.cache is not None:
+            if (cached_data := self.cache.get(method, kwargs)) is not None:
+                self.metrics.inc("wind_cache_hits_total", method=method)
+                return cached_data
+            if self.cache.cache_only:
+                raise CDownloadError(f"Response of {method} with {kwargs} is not in cache")
+
+        attempt = 0
+        while True:
+            api = self.check_session()
+            self.metrics.observe("wind_limiter_wait_seconds", self.limiter.acquire(), method=method)
+            t0 = time.monotonic()
+            try:
+                downloaded_data = getattr(api, method)(**kwargs)
+            except TimeoutError as e:
+                err = CWindApiError(error_code=-40521010, method=method, detail=str(e))
+            else:
+                if downloaded_data.ErrorCode == 0:
+                    self.metrics.observe("wind_call_seconds", time.monotonic() - t0, method=method)
+                    self.metrics.observe("wind_call_points", sum(len(z) for z in downloaded_data.Data), method=method)
+                    self.metrics.observe("wind_call_retries", attempt, method=method)
+                    self.rate_controller.on_success()
+                    if self.cache is not None:
+                        self.cache.put(method, kwargs, downloaded_data)
+                    return downloaded_data
+                err = CWindApiError(error_code=downloaded_data.ErrorCode, method=method)
+            self.metrics.observe("wind_call_seconds", time.monotonic() - t0, method=method)
+            self.metrics.inc("wind_call_errors_total", method=method, code=err.error_code)
+
+            if err.kind == WIND_ERR_KIND_QUOTA:
+                self.rate_controller.on_quota_exceeded()
+            elif err.kind == WIND_ERR_KIND_TRANSIENT:
+                # a dead session looks like timeouts, it is checked before the next call
+                self.session.mark_unhealthy()
+            if err.kind == WIND_ERR_KIND_FATAL or attempt >= self.retry_policy.max_retries:
+                self.metrics.observe("wind_call_retries", attempt, method=method)
+                raise err
+            delay = self.retry_policy.get_delay(attempt)
+            self.metrics.observe("wind_retry_sleep_seconds", delay, method=method)
+            logger.warning(f"{err} Retry {attempt + 1} in {delay:.1f} seconds, rate = {self.limiter.rate:.2f}/s")
+            time.sleep(delay)
+            attempt += 1
+
+    @property
+    def api(self):
+        return None if self.session is None else self.session.api
+
+    def check_session(self, check_health: bool = False):
+        """
+
+        :param check_health: if True, isconnected() of the session is called, or else it is called
+                             only if the session is marked unhealthy or not checked for a while
+        :return: api with a live session, None in cache-only mode
+        """
+        if self.session is None:
+            return None
+        try:
+            return self.session.ensure_connected(check_health=check_health)
+        except CWindSessionError as e:
+            raise CDownloadError(str(e))
+
+    def ensure_session(self):
+        """
+        check the session before each batch or section, a session not started yet is started at the first call
+
+        :return:
+        """
+        if self.session is not None and self.session.started:
+            self.check_session(check_health=True)
+        return 0
 
     @staticmethod
     def wind2tushare(instru: str) -> str:
         return instru.replace(".CZC", ".ZCE").replace(".CFE", ".CFX")
 
-    @property
-    def universe_df(self) -> pd.DataFrame:
-        return pd.DataFrame({
-            "ts_code": [self.wind2tushare(z) for z in self.universe],
-            "wd_code": self.universe,
-        })
+    def get_request_groups(self, save_data_info: CSaveDataInfo) -> list[tuple[list[str], dict[str, str]]]:
+        """
 
-    @staticmethod
-    def convert_data_to_dataframe(downloaded_data, download_values: list[str], col_names: list[str]) -> pd.DataFrame:
-        if downloaded_data.ErrorCode != 0:
-            logger.error(f"When download data from WIND, ErrorCode = {downloaded_data.ErrorCode}.")
-            logger.info("Program will terminate at once, please check again.")
-            sys.exit()
-        else:
-            df = pd.DataFrame(downloaded_data.Data, index=download_values, columns=col_names).T
-            return df
+        :param save_data_info:
+        :return: [(codes, {wind field: renamed field}), ...], codes of different groups are disjoint
+        """
+        raise NotImplementedError
 
+    def get_cached_request_groups(self, save_data_info: CSaveDataInfo) -> list[tuple[list[str], dict[str, str]]]:
+        if save_data_info not in self.__request_groups:
+            self.__request_groups[save_data_info] = self.get_request_groups(save_data_info)
+        return self.__request_groups[save_data_info]
 
-class CDataEngineWindFutDailyBasis(__CDataEngineWind):
-    def __init__(self, save_root_dir: str, save_data_info: CSaveDataInfo, universe: list[str]):
-        super().__init__(save_root_dir, save_data_info.file_format, save_data_info.desc, universe)
+    def get_block_targets(self, save_data_info: CSaveDataInfo) -> dict[str, list[tuple[int, np.ndarray]]]:
+        """
 
-    def download_daily_data(self, trade_date: str, task_id: TaskID, pb: Progress) -> pd.DataFrame:
-        while True:
-            try:
-                time.sleep(0.5)
-                unvrs_f = [instru for instru in self.universe if instru.split(".")[1] == "CFE"]
-                unvrs_c = [instru for instru in self.universe if instru.split(".")[1] != "CFE"]
-
-                # download financial
-                indicators = {
-                    "anal_basis_stkidx": "basis",
-                    "anal_basispercent_stkidx": "basis_rate",
-                    "anal_basisannualyield_stkidx": "basis_annual",
-                }
-                f_data = self.api.wss(codes=unvrs_f, fields=list(indicators), options=f"tradeDate={trade_date}")
-                df_f = self.convert_data_to_dataframe(f_data, download_values=list(indicators), col_names=unvrs_f)
-                df_f = df_f.rename(mapper=indicators, axis=1)
-
-                # download commodity
-                indicators = {
-                    "anal_basis": "basis",
-                    "anal_basispercent2": "basis_rate",
-                    "basisannualyield": "basis_annual",
-                }
-                c_data = self.api.wss(codes=unvrs_c, fields=list(indicators), options=f"tradeDate={trade_date}")
-                df_c = self.convert_data_to_dataframe(c_data, download_values=list(indicators), col_names=unvrs_c)
-                df_c = df_c.rename(mapper=indicators, axis=1)
-
-                # concat
-                df = pd.concat([df_f, df_c], axis=0, ignore_index=False)
-                res = pd.merge(
-                    left=self.universe_df[["ts_code", "wd_code"]],
-                    right=df,
-                    left_on="wd_code",
-                    right_index=True,
-                    how="left",
-                )
-                return res
-            except TimeoutError as e:
-                logger.error(e)
-                time.sleep(5)
+        :param save_data_info:
+        :return: {wind field: [(index of value field, mask of rows in universe), ...]}, values of a
+                 wind field are written to a column of the block for rows of codes in the mask
+        """
+        if save_data_info not in self.__block_targets:
+            value_fields = save_data_info.value_fields
+            targets: dict[str, dict[int, np.ndarray]] = {}
+            for codes, indicators in self.get_cached_request_groups(save_data_info):
+                rows = [self.code_rows[code] for code in codes]
+                for wd_field, field_name in indicators.items():
+                    if field_name not in value_fields:
+                        continue
+                    j = value_fields.index(field_name)
+                    mask = targets.setdefault(wd_field, {}).setdefault(j, np.zeros(len(self.universe), dtype=bool))
+                    mask[rows] = True
+            self.__block_targets[save_data_info] = {k: list(v.items()) for k, v in targets.items()}
+        return self.__block_targets[save_data_info]
 
+    def create_blocks(self, trade_dates: list[str], save_data_infos: tuple[CSaveDataInfo, ...]) \
+            -> dict[str, CDataBlock]:
+        return {
+            z.name: CDataBlock(
+                trade_dates=tuple(trade_dates), ts_codes=self.ts_codes, wd_codes=self.universe,
+                value_fields=tuple(z.value_fields),
+                values=np.full((len(trade_dates), len(self.universe), len(z.value_fields)), np.nan),
+            )
+            for z in save_data_infos
+        }
 
-class CDataEngineWindFutDailyStock(__CDataEngineWind):
-    def __init__(self, save_root_dir: str, save_data_info: CSaveDataInfo, universe: list[str]):
-        super().__init__(save_root_dir, save_data_info.file_format, save_data_info.desc, universe)
+    def fill_blocks(
+            self, blocks: dict[str, CDataBlock], save_data_infos: tuple[CSaveDataInfo, ...], date_idx: np.ndarray,
+            rows: np.ndarray, wd_field: str, values: np.ndarray,
+    ):
+        """
 
-    def download_daily_data(self, trade_date: str, task_id: TaskID, pb: Progress) -> pd.DataFrame:
-        while True:
-            try:
-                time.sleep(0.5)
-                indicators = {"st_stock": "stock"}
-                stock_data = self.api.wss(codes=self.universe, fields=list(indicators),
-                                          options=f"tradeDate={trade_date}")
-                df = self.convert_data_to_dataframe(stock_data, download_values=list(indicators),
-                                                    col_names=self.universe)
-                df = df.rename(mapper=indicators, axis=1)
-                res = pd.merge(
-                    left=self.universe_df[["ts_code", "wd_code"]],
-                    right=df,
-                    left_on="wd_code",
-                    right_index=True,
-                    how="left",
+        :param blocks: created by create_blocks
+        :param save_data_infos:
+        :param date_idx: indexes of dates in blocks
+        :param rows: rows of codes in blocks
+        :param wd_field:
+        :param values: shape = (len(date_idx), len(rows))
+        :return:
+        """
+        for save_data_info in save_data_infos:
+            block = blocks[save_data_info.name]
+            for j, mask in self.get_block_targets(save_data_info).get(wd_field, []):
+                sel = mask[rows]
+                block.values[date_idx[:, None], rows[sel], j] = values[:, sel]
+        return 0
+
+    def get_active_codes(self, bgn_date: str, end_date: str | None = None) -> list[str]:
+        """
+
+        :return: codes in universe listed on any day in [bgn_date, end_date]
+        """
+        if self.universe_history is None:
+            return self.universe
+        return self.universe_history.get_active_codes(self.universe, bgn_date, end_date)
+
+    def compile_requests(
+            self, save_data_infos: tuple[CSaveDataInfo, ...], cells: TCells | None = None,
+            active_codes: list[str] | None = None,
+    ) -> list[tuple[list[str], list[str]]]:
+        """
+        fields of all datasets are merged for each code, and codes with the same fields
+        are requested in one call of wss
+
+        :param save_data_infos:
+        :param cells: only missing cells are requested for datasets in it
+        :param active_codes: only these codes are requested, all codes in universe if not provided
+        :return: [(codes, wind fields), ...]
+        """
+        cells = cells or {}
+        codes_to_request = self.universe if active_codes is None else active_codes
+        code_fields: dict[str, list[str]] = {code: [] for code in codes_to_request}
+        for save_data_info in save_data_infos:
+            info_cells = cells.get(save_data_info.name)
+            for codes, indicators in self.get_cached_request_groups(save_data_info):
+                for code in codes:
+                    if code not in code_fields:
+                        continue
+                    if info_cells is None:
+                        wd_fields = list(indicators)
+                    else:
+                        missing_fields = info_cells.get(code, ())
+                        wd_fields = [k for k, v in indicators.items() if v in missing_fields]
+                    code_fields[code] += [f for f in wd_fields if f not in code_fields[code]]
+        requests: dict[tuple[str, ...], list[str]] = {}
+        for code, wd_fields in code_fields.items():
+            if wd_fields:
+                requests.setdefault(tuple(wd_fields), []).append(code)
+        return [(codes, list(wd_fields)) for wd_fields, codes in requests.items()]
+
+    def compile_range_requests(
+            self, save_data_infos: tuple[CSaveDataInfo, ...], cells: TCells | None = None,
+            active_codes: list[str] | None = None,
+    ) -> list[tuple[list[str], str]]:
+        """
+        wsd accepts multiple codes with only one field in each call
+
+        :param save_data_infos:
+        :param cells: only missing cells are requested for datasets in it
+        :param active_codes: only these codes are requested, all codes in universe if not provided
+        :return: [(codes, wind field), ...]
+        """
+        field_codes: dict[str, list[str]] = {}
+        for codes, wd_fields in self.compile_requests(save_data_infos, cells, active_codes):
+            for wd_field in wd_fields:
+                field_codes.setdefault(wd_field, []).extend(codes)
+        return [(codes, wd_field) for wd_field, codes in field_codes.items()]
+
+    def find_gaps(
+            self, existing_codes: set[str], existing_columns: set[str], save_data_info: CSaveDataInfo,
+    ) -> dict[str, tuple[str, ...]]:
+        missing_fields = tuple(f for f in save_data_info.value_fields if f not in existing_columns)
+        gaps: dict[str, tuple[str, ...]] = {}
+        for code in self.universe:
+            if code not in existing_codes:
+                gaps[code] = tuple(save_data_info.value_fields)
+            elif missing_fields:
+                gaps[code] = missing_fields
+        return gaps
+
+    def plan_date_chunks(
+            self, trade_dates: list[str], calendar: CCalendar, save_data_infos: tuple[CSaveDataInfo, ...],
+            cells: TCells,
+    ) -> list[list[str]]:
+        n_codes = max(len(codes) for codes, _ in self.compile_range_requests(save_data_infos, cells))
+        return plan_date_chunks(
+            trade_dates, calendar,
+            n_codes=n_codes, n_fields=1, max_data_points=self.max_data_points,
+        )
+
+    def download_daily_data(
+            self, trade_date: str, save_data_infos: tuple[CSaveDataInfo, ...], cells: TCells,
+            task_id: TaskID, pb: Progress,
+    ) -> dict[str, CDataBlock]:
+        self.ensure_session()
+        requests = self.compile_requests(save_data_infos, cells, self.get_active_codes(trade_date))
+        with self.metrics.timer("stage_seconds", stage="fetch"):
+            responses = [
+                self.query("wss", codes=codes, fields=wd_fields, options=f"tradeDate={trade_date}")
+                for codes, wd_fields in requests
+            ]
+        with self.metrics.timer("stage_seconds", stage="convert"):
+            # no request if no instrument is listed, and the blocks are all NaN
+            blocks, date_idx = self.create_blocks([trade_date], save_data_infos), np.zeros(1, dtype=int)
+            for (codes, wd_fields), downloaded_data in zip(requests, responses):
+                rows = np.array([self.code_rows[code] for code in codes], dtype=np.int64)
+                # Data of wss is [values of codes for each field]
+                for wd_field, values in zip(wd_fields, downloaded_data.Data):
+                    values = np.asarray(values, dtype=np.float64)[None, :]
+                    self.fill_blocks(blocks, save_data_infos, date_idx, rows, wd_field, values)
+            return blocks
+
+    def download_range_data(
+            self, trade_dates: list[str], save_data_infos: tuple[CSaveDataInfo, ...], cells: TCells,
+            task_id: TaskID, pb: Progress,
+    ) -> dict[str, CDataBlock]:
+        self.ensure_session()
+        active_codes = self.get_active_codes(trade_dates[0], trade_dates[-1])
+        requests = self.compile_range_requests(save_data_infos, cells, active_codes)
+        with self.metrics.timer("stage_seconds", stage="fetch"):
+            responses = [
+                self.query(
+                    "wsd", codes=codes, fields=wd_field, beginTime=trade_dates[0], endTime=trade_dates[-1], options="",
                 )
-                return res
-            except TimeoutError as e:
-                logger.error(e)
-                time.sleep(5)
+                for codes, wd_field in requests
+            ]
+        with self.metrics.timer("stage_seconds", stage="convert"):
+            blocks = self.create_blocks(trade_dates, save_data_infos)
+            date_rows = {d: i for i, d in enumerate(trade_dates)}
+            for (codes, wd_field), downloaded_data in zip(requests, responses):
+                data = downloaded_data.Data
+                if len(data) != len(downloaded_data.Codes):
+                    # a single time point comes back as one row across codes
+                    data = [list(z) for z in zip(*data)]
+                # dates not in trade_dates are dropped, and dates not returned by WIND are NaN
+                date_idx = np.array(
+                    [date_rows.get(t.strftime("%Y%m%d"), -1) for t in downloaded_data.Times], dtype=np.int64,
+                )
+                keep = date_idx >= 0
+                rows = np.array([self.code_rows[code] for code in downloaded_data.Codes], dtype=np.int64)
+                values = np.asarray(data, dtype=np.float64).reshape(len(rows), len(date_idx)).T[keep]
+                self.fill_blocks(blocks, save_data_infos, date_idx[keep], rows, wd_field, values)
+            if self.universe_history is not None:
+                # codes listed in the chunk but not on this date are NaN
+                for i, trade_date in enumerate(trade_dates):
+                    inactive = np.ones(len(self.universe), dtype=bool)
+                    inactive[[self.code_rows[code] for code in self.get_active_codes(trade_date)]] = False
+                    for block in blocks.values():
+                        block.values[i, inactive] = np.nan
+            return blocks
+
+
+class CDataEngineWind(__CDataEngineWind):
+    def __init__(
+            self, save_root_dir: str, save_data_infos: list[CWindSaveDataInfo], universe: list[str],
+            max_data_points: int = 50000, limiter: CTokenBucket | None = None, api=None,
+            retry_policy: CRetryPolicy | None = None, cache: CWindResponseCache | None = None,
+            manifest: CManifest | None = None, universe_history: CUniverseHistory | None = None,
+            metrics: CMetrics | None = None, rate_controller: CAdaptiveRateController | None = None,
+    ):
+        """
+        generic engine of datasets declared by CWindSaveDataInfo, fields of all datasets
+        are compiled into the minimal calls of each date
+
+        """
+        super().__init__(
+            save_root_dir, save_data_infos, universe,
+            max_data_points, limiter, api, retry_policy, cache, manifest, universe_history, metrics, rate_controller,
+        )
+
+    def get_request_groups(self, save_data_info: CWindSaveDataInfo) -> list[tuple[list[str], dict[str, str]]]:
+        if not isinstance(save_data_info, CWindSaveDataInfo):
+            raise TypeError(f"{save_data_info.desc} is not a dataset of WIND, groups of fields are not declared")
+        return [(group.select(self.universe), group.indicators_map) for group in save_data_info.groups]
+
+
+class CDataEngineWindMinute(__CDataEngineWind):
+    def __init__(
+            self, save_root_dir: str, save_data_infos: list[CWindMinuteSaveDataInfo], universe: list[str],
+            max_data_points: int = 100000, window_minutes: int = 720, limiter: CTokenBucket | None = None,
+            api=None, retry_policy: CRetryPolicy | None = None, cache: CWindResponseCache | None = None,
+            universe_history: CUniverseHistory | None = None, metrics: CMetrics | None = None,
+            rate_controller: CAdaptiveRateController | None = None,
+    ):
+        """
+        minute bars of sections of CCalendarSection, downloaded by wsi in chunks of instruments and
+        time windows. Each chunk is appended to the file of its section as soon as it is downloaded,
+        so memory is bounded by a chunk instead of a day. A section is skipped if its file exists,
+        and the file only appears when the section is complete, so an interrupted run resumes from
+        the first section not finished.
+
+        :param save_root_dir: like "by_section"
+        :param save_data_infos:
+        :param universe:
+        :param max_data_points: upper limit of codes x fields x bars in one wsi call
+        :param window_minutes: a section is requested in time windows of this length, the length of
+                               a section (12 hours by default) is enough for one window
+        :param limiter: same as CDataEngineWind
+        :param api: same as CDataEngineWind
+        :param retry_policy: same as CDataEngineWind
+        :param cache: same as CDataEngineWind
+        :param universe_history: if provided, only instruments listed on the trade date of a section
+                                 are requested
+        :param metrics: same as CDataEngineWind, rows of each dataset are also counted
+        :param rate_controller: same as CDataEngineWind
+        """
+        super().__init__(
+            save_root_dir, save_data_infos, universe,
+            max_data_points, limiter, api, retry_policy, cache, None, universe_history, metrics, rate_controller,
+        )
+        self.window_minutes = window_minutes
+        self.failed_sections: list[str] = []
+
+    def plan_windows(self, sec: CSection) -> list[tuple[dt.datetime, dt.datetime]]:
+        """
+
+        :return: [(bgn, end), ...], right open windows covering the section
+        """
+        bgn = dt.datetime.strptime(sec.bgnTime, "%Y%m%d %H:%M:%S.%f")
+        end = dt.datetime.strptime(sec.endTime, "%Y%m%d %H:%M:%S.%f")
+        step = dt.timedelta(minutes=self.window_minutes)
+        windows: list[tuple[dt.datetime, dt.datetime]] = []
+        while bgn < end:
+            windows.append((bgn, min(bgn + step, end)))
+            bgn += step
+        return windows
+
+    def plan_code_chunks(self, codes: list[str], save_data_info: CWindMinuteSaveDataInfo) -> list[list[str]]:
+        n_bars = max(self.window_minutes // save_data_info.bar_size, 1)
+        size = max(self.max_data_points // (len(save_data_info.indicators) * n_bars), 1)
+        return list(batched(codes, size))
+
+    def convert_minute_data(
+            self, downloaded_data, codes: list[str], save_data_info: CWindMinuteSaveDataInfo,
+            bgn: dt.datetime, end: dt.datetime,
+    ) -> pd.DataFrame:
+        """
+
+        :param downloaded_data: result of wsi, rows of multiple codes come with a field "windcode"
+        :param codes: codes requested
+        :param save_data_info:
+        :param bgn: bars before it are dropped
+        :param end: bars at or after it are dropped, so a bar on the boundary of sections is only kept once
+        :return: bars with all fields of the dataset, fields not returned are NaN
+        """
+        columns = {f.lower(): values for f, values in zip(downloaded_data.Fields, downloaded_data.Data)}
+        n = len(downloaded_data.Times)
+        wd_codes = columns["windcode"] if "windcode" in columns else [codes[0]] * n
+        timestamps = np.array(downloaded_data.Times, dtype="datetime64[ns]")
+        data = {
+            "ts_code": [self.ts_codes[self.code_rows[code]] for code in wd_codes],
+            "wd_code": wd_codes,
+            "timestamp": timestamps,
+        }
+        renamed = {v: k.lower() for k, v in save_data_info.indicators}
+        for f in save_data_info.value_fields:
+            values = columns.get(renamed.get(f, ""))
+            data[f] = np.full(n, np.nan) if values is None else np.asarray(values, dtype=np.float64)
+        keep = (timestamps >= np.datetime64(bgn, "ns")) & (timestamps < np.datetime64(end, "ns"))
+        return pd.DataFrame(data)[list(save_data_info.fields)][keep].reset_index(drop=True)
+
+    def download_section(
+            self, sec: CSection, save_data_info: CWindMinuteSaveDataInfo, task_id: TaskID, pb: Progress,
+    ) -> int:
+        """
+
+        :return: rows saved
+        """
+        self.ensure_session()
+        save_path = save_data_info.get_section_path(self.save_root_dir, sec.secId)
+        windows = self.plan_windows(sec)
+        chunks = self.plan_code_chunks(self.get_active_codes(sec.trade_date), save_data_info)
+        pb.update(task_id=task_id, completed=0, total=len(chunks) * len(windows))
+        wd_fields = [k for k, _ in save_data_info.indicators]
+        with CParquetStreamWriter(save_path, save_data_info.dtypes) as writer:
+            for codes in chunks:
+                for bgn, end in windows:
+                    with self.metrics.timer("stage_seconds", stage="fetch"):
+                        try:
+                            downloaded_data = self.query(
+                                "wsi", codes=codes, fields=wd_fields,
+                                # both ends of wsi are included
+                                beginTime=f"{bgn:%Y-%m-%d %H:%M:%S}",
+                                endTime=f"{end - dt.timedelta(seconds=1):%Y-%m-%d %H:%M:%S}",
+                                options=f"BarSize={save_data_info.bar_size}",
+                            )
+                        except CWindApiError as e:
+                            if e.error_code != WIND_ERR_CODE_NO_DATA:
+                                raise
+                            downloaded_data = None
+                    if downloaded_data is not None:
+                        with self.metrics.timer("stage_seconds", stage="convert"):
+                            df = self.convert_minute_data(downloaded_data, codes, save_data_info, bgn, end)
+                        with self.metrics.timer("stage_seconds", stage="write"):
+                            writer.write(df)
+                    pb.update(task_id=task_id, advance=1)
+        return writer.rows
+
+    @qtimer
+    def download_sections(
+            self, bgn_date: str, stp_date: str, calendar_section: CCalendarSection,
+            sections: tuple[str, ...] = (CONST_TS1, CONST_TS2), show_progress: bool = True,
+    ):
+        """
+
+        :param bgn_date:
+        :param stp_date: sections of trade dates in [bgn_date, stp_date) are downloaded, TS1 of a trade
+                         date is the night session before it
+        :param calendar_section:
+        :param sections: only these sections are downloaded, like ("TS2",) for day sessions
+        :param show_progress: False in worker processes
+        :return:
+        """
+        secs = [
+            sec for sec in calendar_section.get_iter_list(
+                CSection(trade_date=bgn_date, section=CONST_TS1, bgnTime="", endTime=""),
+                CSection(trade_date=stp_date, section=CONST_TS1, bgnTime="", endTime=""),
+            ) if sec.section in sections
+        ]
+        self.failed_sections = []
+        with Progress(disable=not show_progress) as pb:
+            task_pri = pb.add_task(description="Pri-task description to be updated", total=len(secs))
+            task_sub = pb.add_task(description="Chunks of instruments and time windows")
+            for sec in secs:
+                for save_data_info in self.save_data_infos:
+                    if os.path.exists(save_data_info.get_section_path(self.save_root_dir, sec.secId)):
+                        logger.info(f"{save_data_info.desc} for {sec.secId} exists, program will skip it")
+                        continue
+                    pb.update(task_id=task_pri, description=f"Processing {save_data_info.desc} for {SFG(sec.secId)}")
+                    try:
+                        rows = self.download_section(sec, save_data_info, task_id=task_sub, pb=pb)
+                    except CDownloadError as e:
+                        logger.error(f"{save_data_info.desc} for {sec.secId} failed, run again to resume from it. {e}")
+                        self.failed_sections.append(sec.secId)
+                    else:
+                        self.metrics.inc("minute_rows_total", rows, dataset=save_data_info.name)
+                pb.update(task_id=task_pri, advance=1)
+        if self.failed_sections:
+            logger.error(f"{self.data_desc} for {len(self.failed_sections)} sections failed: {self.failed_sections}")
+        self.metrics.log_summary(title=f"Metrics of {self.data_desc}")
+        self.metrics.dump()
+        return 0
@@ -0,0 +1,111 @@
+import os
+import pandas as pd
+from loguru import logger
+from rich.progress import track
+from typedef import CSaveDataInfo
+from qcalendar import CCalendar
+from qutility import check_and_makedirs, qtimer, SFG
+
+
+class CColumnarStore(object):
+    def __init__(self, db_root_dir: str, save_data_info: CSaveDataInfo):
+        """
+        consolidated store of daily files, one Parquet file for each year, like
+        {db_root_dir}/wind_futures_basis/year=2024/data.parquet
+        dates already ingested are recorded in _ingested_dates.txt of the dataset, with the size and
+        mtime of their daily files, so files rewritten later (like by --fillgaps) are ingested again.
+        Files starting with "_" or "." are ignored when the whole dataset is read by pyarrow
+
+        :param db_root_dir:
+        :param save_data_info:
+        """
+        self.db_root_dir = db_root_dir
+        self.save_data_info = save_data_info
+        self.db_dir = os.path.join(db_root_dir, save_data_info.name)
+        self.ledger_path = os.path.join(self.db_dir, "_ingested_dates.txt")
+
+    def get_partition_path(self, year: str) -> str:
+        return os.path.join(self.db_dir, f"year={year}", "data.parquet")
+
+    @staticmethod
+    def get_file_signature(src_path: str) -> str:
+        st = os.stat(src_path)
+        return f"{st.st_size}-{st.st_mtime_ns}"
+
+    def load_ingested_dates(self) -> dict[str, str]:
+        """
+
+        :return: {trade_date: signature of the daily file when it was ingested}, later lines override
+                 earlier ones, a date without signature is always ingested again
+        """
+        if not os.path.exists(self.ledger_path):
+            return {}
+        ingested_dates: dict[str, str] = {}
+        with open(self.ledger_path, "r") as f:
+            for line in f:
+                if line.strip():
+                    trade_date, _, signature = line.strip().partition(" ")
+                    ingested_dates[trade_date] = signature
+        return ingested_dates
+
+    def append_ingested_dates(self, signatures: dict[str, str]):
+        with open(self.ledger_path, "a") as f:
+            f.writelines(f"{d} {signature}\n" for d, signature in signatures.items())
+        return 0
+
+    def read_daily_data(self, src_root_dir: str, trade_date: str) -> pd.DataFrame:
+        src_path = self.save_data_info.get_save_path(src_root_dir, trade_date)
+        df = self.save_data_info.read_file(src_path)
+        df.insert(0, "trade_date", trade_date)
+        return df[["trade_date"] + list(self.save_data_info.fields)]
+
+    def update_partition(self, year: str, new_data: pd.DataFrame):
+        partition_path = self.get_partition_path(year)
+        if os.path.exists(partition_path):
+            old_data = pd.read_parquet(partition_path)
+            # rows of new dates are replaced, so a rerun after a crash is harmless
+            old_data = old_data[~old_data["trade_date"].isin(new_data["trade_date"])]
+            new_data = pd.concat([old_data, new_data], axis=0, ignore_index=True)
+        new_data = new_data.sort_values(by="trade_date", kind="stable", ignore_index=True)
+        check_and_makedirs(os.path.dirname(partition_path))
+        tmp_path = os.path.join(os.path.dirname(partition_path), ".data.parquet.tmp")
+        new_data.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, partition_path)
+        return 0
+
+    @qtimer
+    def update(self, bgn_date: str, stp_date: str, calendar: CCalendar, src_root_dir: str):
+        """
+        append daily files in [bgn_date, stp_date) not ingested yet or rewritten since they were
+        ingested, only partitions of these dates are rewritten
+
+        :param bgn_date:
+        :param stp_date:
+        :param calendar:
+        :param src_root_dir: root directory of daily files, like "by_date"
+        :return:
+        """
+        ingested_dates = self.load_ingested_dates()
+        signatures: dict[str, str] = {}
+        for trade_date in calendar.get_iter_list(bgn_date, stp_date):
+            src_path = self.save_data_info.get_save_path(src_root_dir, trade_date)
+            if not os.path.exists(src_path):
+                if trade_date not in ingested_dates:
+                    logger.warning(f"{self.save_data_info.desc} for {trade_date} is not downloaded, it will be ignored")
+                continue
+            if (signature := self.get_file_signature(src_path)) != ingested_dates.get(trade_date):
+                signatures[trade_date] = signature
+        if not signatures:
+            logger.info(f"No new data for {self.save_data_info.desc} to update")
+            return 0
+
+        new_dates = list(signatures)
+        for year, year_dates in CCalendar.split_by_year(new_dates).items():
+            new_data = pd.concat(
+                [self.read_daily_data(src_root_dir, d) for d in track(year_dates, description=f"Loading {year}")],
+                axis=0, ignore_index=True,
+            )
+            self.update_partition(year, new_data)
+            self.append_ingested_dates({d: signatures[d] for d in year_dates})
+            logger.info(f"{len(year_dates)} days of {self.save_data_info.desc} are updated to {SFG(year)}")
+        return 0
@@ -1,9 +1,56 @@
 import argparse
 
 
+def add_metrics_arg(arg_parser_sub: argparse.ArgumentParser, of: str = "calls and stages"):
+    arg_parser_sub.add_argument(
+        "--metrics", type=str, default=None,
+        help=f"save metrics of {of} to this path, as Prometheus textfile if it ends with '.prom', or else as json",
+    )
+    return 0
+
+
+def make_serve_engine_factory(rate: float, save_root_dir: str, universe: list[str], manifest=None,
+                              universe_history_path: str | None = None, api=None):
+    """
+    engines of jobs of serve share one limiter and one rate controller, so a rate decreased by quota
+    errors of a job recovers to rate in later jobs. They also share the WIND session of the process.
+
+    :param rate: max calls to API per second of all jobs
+    :param save_root_dir:
+    :param universe:
+    :param manifest: same as CDataEngineWind
+    :param universe_history_path: loaded for each job, so listings inferred between jobs are used
+    :param api: same as CDataEngineWind
+    :return: engine_factory of CDownloadDaemon
+    """
+    from qthrottle import CTokenBucket, CAdaptiveRateController
+    from data_engines import CDataEngineWind
+    from quniverse import CUniverseHistory
+
+    limiter = CTokenBucket(rate=rate)
+    rate_controller = CAdaptiveRateController(limiter, max_rate=rate)
+
+    def make_engine(save_data_infos):
+        return CDataEngineWind(
+            save_root_dir=save_root_dir,
+            save_data_infos=save_data_infos,
+            universe=universe,
+            limiter=limiter,
+            rate_controller=rate_controller,
+            manifest=manifest,
+            universe_history=None if universe_history_path is None else CUniverseHistory(universe_history_path),
+            api=api,
+        )
+
+    return make_engine
+
+
 def parse_args():
+    from project_cfg import pro_cfg
+    from qcodec import CODECS
+
     arg_parser_main = argparse.ArgumentParser(description="Project to download data from tushare")
-    arg_parser_main.add_argument("--bgn", type=str, required=True)
+    arg_parser_main.add_argument("--bgn", type=str, default=None, help="required by all functions except serve")
     arg_parser_main.add_argument("--stp", type=str, default=None)
 
     arg_parser_subs = arg_parser_main.add_subparsers(
@@ -15,53 +62,276 @@ def parse_args():
     # func: download
     arg_parser_sub = arg_parser_subs.add_parser(name="download", help="Download data from tushare and wind")
     arg_parser_sub.add_argument(
-        "--switch", type=str, required=True,
-        choices=("basis", "stock"),
+        "--switch", type=str, nargs="+", required=True,
+        choices=tuple(pro_cfg.datasets),
+        help="datasets to download, multiple datasets are downloaded in one pass, like '--switch basis stock'",
+    )
+    arg_parser_sub.add_argument(
+        "--batch", default=False, action="store_true",
+        help="download a window of dates in one call, instead of one call for each date",
     )
+    arg_parser_sub.add_argument("--workers", type=int, default=1, help="number of concurrent download workers")
+    arg_parser_sub.add_argument("--rate", type=float, default=2.0, help="max calls to API per second")
+    arg_parser_sub.add_argument("--writers", type=int, default=1, help="number of background file writers")
+    arg_parser_sub.add_argument("--fillgaps", default=False, action="store_true",
+                                help="check existing files, missing instruments and fields are downloaded and merged")
+    arg_parser_sub.add_argument("--cache", default=False, action="store_true",
+                                help="save responses of WIND in cache, and reuse them if the same request is made")
+    arg_parser_sub.add_argument("--cacheonly", default=False, action="store_true",
+                                help="only use responses in cache, WIND is not connected")
+    add_metrics_arg(arg_parser_sub)
+
+    # func: minute
+    arg_parser_sub = arg_parser_subs.add_parser(
+        name="minute", help="Download minute bars of each section, and resume from the first section not finished",
+    )
+    arg_parser_sub.add_argument(
+        "--switch", type=str, nargs="+", required=True,
+        choices=tuple(pro_cfg.minute_datasets),
+    )
+    arg_parser_sub.add_argument("--sections", type=str, nargs="+", default=["TS1", "TS2"], choices=("TS1", "TS2"),
+                                help="TS1 is the night session before a trade date, TS2 is the day session")
+    arg_parser_sub.add_argument("--rate", type=float, default=2.0, help="max calls to API per second")
+    arg_parser_sub.add_argument("--window", type=int, default=720,
+                                help="minutes of each time window requested in a section")
+    add_metrics_arg(arg_parser_sub)
+
+    # func: backfill
+    arg_parser_sub = arg_parser_subs.add_parser(
+        name="backfill", help="Download a long range of dates by worker processes, and resume from journal",
+    )
+    arg_parser_sub.add_argument(
+        "--switch", type=str, nargs="+", required=True,
+        choices=tuple(pro_cfg.datasets),
+    )
+    arg_parser_sub.add_argument("--workers", type=int, default=4, help="number of worker processes")
+    arg_parser_sub.add_argument("--shards", type=int, default=None,
+                                help="number of shards of a new job, 4 * workers if not provided")
+    arg_parser_sub.add_argument("--checkpoint", type=int, default=20, help="number of dates between checkpoints")
+    arg_parser_sub.add_argument("--rate", type=float, default=2.0, help="max calls to API per second of all workers")
+    arg_parser_sub.add_argument(
+        "--batch", default=False, action="store_true",
+        help="download a window of dates in one call, instead of one call for each date",
+    )
+    add_metrics_arg(arg_parser_sub, of="all workers")
 
     # func: update
     arg_parser_sub = arg_parser_subs.add_parser(name="update", help="Update data for database")
+    arg_parser_sub.add_argument(
+        "--switch", type=str, nargs="+", required=True,
+        choices=tuple(pro_cfg.datasets),
+    )
+
+    # func: infer-universe
+    arg_parser_sub = arg_parser_subs.add_parser(
+        name="infer-universe", help="Infer listing and delisting dates of instruments from daily files",
+    )
     arg_parser_sub.add_argument(
         "--switch", type=str, required=True,
-        choices=("basis", "stock"),
+        choices=tuple(pro_cfg.datasets),
     )
+    arg_parser_sub.add_argument("--gap", type=int, default=20,
+                                help="instruments without values in the last gap dates are treated as delisted")
+
+    # func: rebuild-manifest
+    arg_parser_sub = arg_parser_subs.add_parser(name="rebuild-manifest", help="Scan daily files to rebuild manifest")
+    arg_parser_sub.add_argument(
+        "--switch", type=str, nargs="+", required=True,
+        choices=tuple(pro_cfg.datasets),
+    )
+    arg_parser_sub.add_argument("--workers", type=int, default=4, help="number of processes reading files")
+
+    # func: check-manifest
+    arg_parser_sub = arg_parser_subs.add_parser(name="check-manifest", help="Report gaps and verify daily files")
+    arg_parser_sub.add_argument(
+        "--switch", type=str, nargs="+", required=True,
+        choices=tuple(pro_cfg.datasets),
+    )
+    arg_parser_sub.add_argument("--verify", default=False, action="store_true",
+                                help="compare checksums of files with manifest")
+    arg_parser_sub.add_argument("--workers", type=int, default=4, help="number of threads computing checksums")
+
+    # func: serve
+    arg_parser_sub = arg_parser_subs.add_parser(
+        name="serve", help="Keep running, download and update data after each section is closed",
+    )
+    arg_parser_sub.add_argument(
+        "--switch", type=str, nargs="+", default=None,
+        choices=tuple(pro_cfg.datasets),
+        help="datasets downloaded after sections are closed, all datasets if not provided",
+    )
+    arg_parser_sub.add_argument("--host", type=str, default="127.0.0.1", help="host of HTTP endpoint for backfill")
+    arg_parser_sub.add_argument("--port", type=int, default=8765, help="port of HTTP endpoint for backfill")
+    arg_parser_sub.add_argument("--poll", type=float, default=30.0, help="seconds between two checks of sections")
+    arg_parser_sub.add_argument("--rate", type=float, default=2.0, help="max calls to API per second")
+
+    # func: convert
+    arg_parser_sub = arg_parser_subs.add_parser(
+        name="convert", help="Convert daily files to the codec of datasets in project configuration",
+    )
+    arg_parser_sub.add_argument(
+        "--switch", type=str, nargs="+", required=True,
+        choices=tuple(pro_cfg.datasets),
+    )
+    arg_parser_sub.add_argument("--src", type=str, default="csv.gz", choices=tuple(CODECS),
+                                help="codec of existing files")
+    arg_parser_sub.add_argument("--workers", type=int, default=4, help="number of processes converting files")
+    arg_parser_sub.add_argument("--remove", default=False, action="store_true",
+                                help="remove old files after they are converted")
 
     # --- parse args
     _args = arg_parser_main.parse_args()
+    if _args.func != "serve" and _args.bgn is None:
+        arg_parser_main.error(f"--bgn is required by {_args.func}")
     return _args
 
 
 if __name__ == "__main__":
+    # args are parsed first, so "--help" and illegal args never load the calendar or heavy modules
+    args = parse_args()
+
     from project_cfg import pro_cfg
     from qcalendar import CCalendar
+    from qutility import setup_logger
 
-    calendar = CCalendar(calendar_path=pro_cfg.calendar_path)
-
-    args = parse_args()
-    bgn, stp = args.bgn, args.stp or calendar.get_next_date(args.bgn, shift=1)
+    setup_logger()
+    calendar = CCalendar(calendar_path=pro_cfg.calendar_path, use_cache=True)
+    if args.func != "serve":
+        bgn, stp = args.bgn, args.stp or calendar.get_next_date(args.bgn, shift=1)
 
     if args.func == "download":
-        if args.switch == "basis":
-            from data_engines import CDataEngineWindFutDailyBasis
+        from qthrottle import CTokenBucket
+        from wind_cache import CWindResponseCache
+        from data_engines import CDataEngineWind
+        from manifest import CManifest
+        from quniverse import CUniverseHistory
+        from qmetrics import CMetrics
 
-            engine = CDataEngineWindFutDailyBasis(
-                save_root_dir=pro_cfg.daily_data_root_dir,
-                save_data_info=pro_cfg.futures_basis,
-                universe=pro_cfg.universe,
-            )
-            engine.download_data_range(bgn_date=bgn, stp_date=stp, calendar=calendar)
-        elif args.switch == "stock":
-            from data_engines import CDataEngineWindFutDailyStock
-
-            engine = CDataEngineWindFutDailyStock(
-                save_root_dir=pro_cfg.daily_data_root_dir,
-                save_data_info=pro_cfg.futures_stock,
-                universe=pro_cfg.universe,
-            )
-            engine.download_data_range(bgn_date=bgn, stp_date=stp, calendar=calendar)
-        else:
-            raise ValueError(f"switch = {args.switch} is illegal")
+        cache = CWindResponseCache(
+            cache_dir=pro_cfg.wind_cache_dir,
+            max_bytes=pro_cfg.wind_cache_max_bytes,
+            cache_only=args.cacheonly,
+        ) if (args.cache or args.cacheonly) else None
+        engine = CDataEngineWind(
+            save_root_dir=pro_cfg.daily_data_root_dir,
+            save_data_infos=[pro_cfg.datasets[switch] for switch in args.switch],
+            universe=pro_cfg.universe,
+            limiter=CTokenBucket(rate=args.rate),
+            cache=cache,
+            manifest=CManifest(pro_cfg.daily_data_root_dir),
+            universe_history=CUniverseHistory(pro_cfg.universe_history_path),
+            metrics=CMetrics(dump_path=args.metrics),
+        )
+        engine.download_data_range(
+            bgn_date=bgn, stp_date=stp, calendar=calendar, batch=args.batch, workers=args.workers,
+            writers=args.writers, fill_gaps=args.fillgaps,
+        )
+        if engine.session is not None:
+            engine.session.report()
+    elif args.func == "minute":
+        from qthrottle import CTokenBucket
+        from qcalendar import CCalendarSection
+        from data_engines import CDataEngineWindMinute
+        from quniverse import CUniverseHistory
+        from qmetrics import CMetrics
+
+        engine = CDataEngineWindMinute(
+            save_root_dir=pro_cfg.minute_data_root_dir,
+            save_data_infos=[pro_cfg.minute_datasets[switch] for switch in args.switch],
+            universe=pro_cfg.universe,
+            window_minutes=args.window,
+            limiter=CTokenBucket(rate=args.rate),
+            universe_history=CUniverseHistory(pro_cfg.universe_history_path),
+            metrics=CMetrics(dump_path=args.metrics),
+        )
+        engine.download_sections(
+            bgn_date=bgn, stp_date=stp,
+            calendar_section=CCalendarSection(pro_cfg.calendar_path, header=0, use_cache=True),
+            sections=tuple(args.sections),
+        )
+        if engine.session is not None:
+            engine.session.report()
+    elif args.func == "backfill":
+        import os
+        from backfill import CBackfillEngineCfg, CBackfill
+        from qmetrics import CMetrics
+
+        engine_cfg = CBackfillEngineCfg(
+            save_root_dir=pro_cfg.daily_data_root_dir,
+            save_data_infos=tuple(pro_cfg.datasets[switch] for switch in args.switch),
+            universe=tuple(pro_cfg.universe),
+            rate=args.rate / args.workers,
+            universe_history_path=pro_cfg.universe_history_path,
+        )
+        backfill = CBackfill(
+            engine_cfg=engine_cfg, calendar=calendar,
+            journal_dir=os.path.join(pro_cfg.daily_data_root_dir, "_backfill"),
+            metrics=CMetrics(dump_path=args.metrics),
+        )
+        backfill.run(
+            bgn_date=bgn, stp_date=stp, workers=args.workers, shards=args.shards,
+            checkpoint_size=args.checkpoint, batch=args.batch,
+        )
     elif args.func == "update":
-        pass
+        from database import CColumnarStore
+
+        for switch in args.switch:
+            store = CColumnarStore(db_root_dir=pro_cfg.db_root_dir, save_data_info=pro_cfg.datasets[switch])
+            store.update(bgn_date=bgn, stp_date=stp, calendar=calendar, src_root_dir=pro_cfg.daily_data_root_dir)
+    elif args.func == "infer-universe":
+        from quniverse import CUniverseHistory
+
+        universe_history = CUniverseHistory(pro_cfg.universe_history_path)
+        universe_history.infer(
+            save_data_info=pro_cfg.datasets[args.switch], src_root_dir=pro_cfg.daily_data_root_dir,
+            bgn_date=bgn, stp_date=stp, calendar=calendar, delist_gap=args.gap,
+        )
+        universe_history.save()
+    elif args.func == "rebuild-manifest":
+        from manifest import CManifest
+
+        manifest = CManifest(pro_cfg.daily_data_root_dir)
+        manifest.rebuild(save_data_infos=[pro_cfg.datasets[switch] for switch in args.switch], workers=args.workers)
+    elif args.func == "check-manifest":
+        from manifest import CManifest
+
+        manifest = CManifest(pro_cfg.daily_data_root_dir)
+        for switch in args.switch:
+            manifest.report_gaps(pro_cfg.datasets[switch], bgn_date=bgn, stp_date=stp, calendar=calendar)
+            if args.verify:
+                manifest.verify(pro_cfg.datasets[switch], bgn_date=bgn, stp_date=stp, workers=args.workers)
+    elif args.func == "convert":
+        from manifest import CManifest
+        from convert import CCodecConverter
+
+        converter = CCodecConverter(pro_cfg.daily_data_root_dir, manifest=CManifest(pro_cfg.daily_data_root_dir))
+        for switch in args.switch:
+            converter.convert(
+                save_data_info=pro_cfg.datasets[switch], src_codec=args.src, bgn_date=bgn, stp_date=stp,
+                calendar=calendar, workers=args.workers, remove_src=args.remove,
+            )
+    elif args.func == "serve":
+        from qcalendar import CCalendarSection
+        from manifest import CManifest
+        from daemon import CDownloadDaemon
+
+        make_engine = make_serve_engine_factory(
+            rate=args.rate,
+            save_root_dir=pro_cfg.daily_data_root_dir,
+            universe=pro_cfg.universe,
+            manifest=CManifest(pro_cfg.daily_data_root_dir),
+            universe_history_path=pro_cfg.universe_history_path,
+        )
+        datasets = {k: v for k, v in pro_cfg.datasets.items() if args.switch is None or k in args.switch}
+        daemon = CDownloadDaemon(
+            datasets=datasets,
+            engine_factory=make_engine,
+            calendar=calendar,
+            calendar_section=CCalendarSection(pro_cfg.calendar_path, header=0, use_cache=True),
+            src_root_dir=pro_cfg.daily_data_root_dir,
+            db_root_dir=pro_cfg.db_root_dir,
+            poll_interval=args.poll,
+        )
+        daemon.serve_forever(host=args.host, port=args.port)
     else:
-        raise ValueError(f"switch = {args.switch} is illegal")
+        raise ValueError(f"func = {args.func} is illegal")
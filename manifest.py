@@ -0,0 +1,245 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import datetime as dt
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from loguru import logger
+from rich.progress import track
+from typedef import CSaveDataInfo
+from qcalendar import CCalendar
+from qutility import check_and_makedirs, qtimer, SFG
+
+
+@dataclass(frozen=True)
+class CManifestRecord:
+    dataset: str
+    trade_date: str
+    rows: int
+    checksum: str
+    download_time: str
+    codes: tuple[str, ...]
+    columns: tuple[str, ...]
+
+
+def get_checksum(path: str, chunk_size: int = 1024 ** 2) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_record(save_data_info: CSaveDataInfo, trade_date: str, data: pd.DataFrame, save_path: str,
+                download_time: str) -> CManifestRecord:
+    return CManifestRecord(
+        dataset=save_data_info.name,
+        trade_date=trade_date,
+        rows=len(data),
+        checksum=get_checksum(save_path),
+        download_time=download_time,
+        codes=tuple(data["wd_code"]) if "wd_code" in data.columns else (),
+        columns=tuple(data.columns),
+    )
+
+
+def scan_daily_file(save_data_info: CSaveDataInfo, trade_date: str, save_path: str) -> CManifestRecord:
+    # run in worker processes of CManifest.rebuild
+    data = save_data_info.read_file(save_path)
+    download_time = dt.datetime.fromtimestamp(os.path.getmtime(save_path)).strftime("%Y-%m-%d %H:%M:%S")
+    return make_record(save_data_info, trade_date, data, save_path, download_time)
+
+
+class CManifest(object):
+    def __init__(self, save_root_dir: str, file_name: str = "_manifest.sqlite"):
+        """
+        index of daily files under save_root_dir, with one record for each (dataset, trade_date).
+        Engines use it to skip downloaded dates without probing the file system, and record
+        files after they are saved.
+
+        :param save_root_dir:
+        :param file_name:
+        """
+        self.save_root_dir = save_root_dir
+        self.path = os.path.join(save_root_dir, file_name)
+        check_and_makedirs(save_root_dir)
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.__conn.execute("PRAGMA journal_mode=WAL")
+        self.__conn.execute("PRAGMA synchronous=NORMAL")
+        self.__conn.execute(
+            "CREATE TABLE IF NOT EXISTS manifest ("
+            "dataset TEXT NOT NULL, trade_date TEXT NOT NULL, rows INTEGER, checksum TEXT, "
+            "download_time TEXT, codes TEXT, columns TEXT, PRIMARY KEY (dataset, trade_date))"
+        )
+        self.__conn.commit()
+
+    def close(self):
+        with self.__lock:
+            self.__conn.close()
+        return 0
+
+    def __upsert(self, records: list[CManifestRecord]):
+        self.__conn.executemany(
+            "INSERT OR REPLACE INTO manifest VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (r.dataset, r.trade_date, r.rows, r.checksum, r.download_time, ",".join(r.codes), ",".join(r.columns))
+                for r in records
+            ],
+        )
+        return 0
+
+    def record(self, save_data_info: CSaveDataInfo, trade_date: str, data: pd.DataFrame, save_path: str):
+        """
+        called after data is saved to save_path
+
+        """
+        download_time = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        r = make_record(save_data_info, trade_date, data, save_path, download_time)
+        with self.__lock:
+            self.__upsert([r])
+            self.__conn.commit()
+        return 0
+
+    def save_records(self, records: list[CManifestRecord]):
+        """
+        records made elsewhere, like in worker processes converting files
+
+        """
+        with self.__lock:
+            self.__upsert(records)
+            self.__conn.commit()
+        return 0
+
+    def load(self, save_data_info: CSaveDataInfo) -> dict[str, CManifestRecord]:
+        """
+
+        :param save_data_info:
+        :return: {trade_date: record}
+        """
+        with self.__lock:
+            rows = self.__conn.execute(
+                "SELECT dataset, trade_date, rows, checksum, download_time, codes, columns "
+                "FROM manifest WHERE dataset = ?",
+                (save_data_info.name,),
+            ).fetchall()
+        return {
+            trade_date: CManifestRecord(
+                dataset=dataset, trade_date=trade_date, rows=n, checksum=checksum, download_time=download_time,
+                codes=tuple(codes.split(",")) if codes else (),
+                columns=tuple(columns.split(",")) if columns else (),
+            )
+            for dataset, trade_date, n, checksum, download_time, codes, columns in rows
+        }
+
+    def find_daily_files(self, save_data_info: CSaveDataInfo, workers: int = 4) -> dict[str, str]:
+        """
+        directories of years are listed in parallel, which matters on network shares
+
+        :param save_data_info:
+        :param workers:
+        :return: {trade_date: save_path} of files found under save_root_dir
+        """
+
+        def __find_in_year(year_dir: str) -> dict[str, str]:
+            res: dict[str, str] = {}
+            for date_dir in os.scandir(year_dir):
+                trade_date = date_dir.name
+                save_path = os.path.join(date_dir.path, save_data_info.get_file_name(trade_date))
+                if date_dir.is_dir() and os.path.exists(save_path):
+                    res[trade_date] = save_path
+            return res
+
+        year_dirs = [z.path for z in os.scandir(self.save_root_dir) if z.is_dir() and z.name.isdigit()]
+        daily_files: dict[str, str] = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for res in executor.map(__find_in_year, year_dirs):
+                daily_files.update(res)
+        return daily_files
+
+    @qtimer
+    def rebuild(self, save_data_infos: list[CSaveDataInfo], workers: int = 4):
+        """
+        scan the tree in worker processes, and replace all records of datasets
+
+        :param save_data_infos:
+        :param workers:
+        :return:
+        """
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for save_data_info in save_data_infos:
+                daily_files = self.find_daily_files(save_data_info, workers)
+                futures = [
+                    executor.submit(scan_daily_file, save_data_info, trade_date, save_path)
+                    for trade_date, save_path in sorted(daily_files.items())
+                ]
+                records = [f.result() for f in track(futures, description=f"Scanning {save_data_info.desc}")]
+                with self.__lock:
+                    self.__conn.execute("DELETE FROM manifest WHERE dataset = ?", (save_data_info.name,))
+                    self.__upsert(records)
+                    self.__conn.commit()
+                logger.info(f"{len(records)} files of {save_data_info.desc} are recorded in manifest")
+        return 0
+
+    def report_gaps(self, save_data_info: CSaveDataInfo, bgn_date: str, stp_date: str, calendar: CCalendar) \
+            -> list[str]:
+        """
+
+        :return: trade dates in [bgn_date, stp_date) not in manifest
+        """
+        records = self.load(save_data_info)
+        gaps = [d for d in calendar.get_iter_list(bgn_date, stp_date) if d not in records]
+        if gaps:
+            logger.warning(
+                f"{len(gaps)} dates of {save_data_info.desc} in [{SFG(bgn_date)}, {SFG(stp_date)}) "
+                f"are not downloaded: {gaps}"
+            )
+        else:
+            logger.info(f"No gap of {save_data_info.desc} in [{SFG(bgn_date)}, {SFG(stp_date)})")
+        return gaps
+
+    def delete(self, save_data_info: CSaveDataInfo, trade_dates: list[str]):
+        with self.__lock:
+            self.__conn.executemany(
+                "DELETE FROM manifest WHERE dataset = ? AND trade_date = ?",
+                [(save_data_info.name, d) for d in trade_dates],
+            )
+            self.__conn.commit()
+        return 0
+
+    @qtimer
+    def verify(
+            self, save_data_info: CSaveDataInfo, bgn_date: str, stp_date: str, workers: int = 4,
+            drop_broken: bool = True,
+    ) -> list[tuple[str, str]]:
+        """
+        compare checksums of files with records in manifest
+
+        :param drop_broken: if True, records of broken files are deleted and files are renamed with
+                            suffix ".broken", so they are downloaded again
+        :return: [(trade_date, reason), ...] of broken files
+        """
+        records = [r for d, r in sorted(self.load(save_data_info).items()) if bgn_date <= d < stp_date]
+
+        def __check(r: CManifestRecord) -> tuple[str, str] | None:
+            save_path = save_data_info.get_save_path(self.save_root_dir, r.trade_date)
+            if not os.path.exists(save_path):
+                return r.trade_date, "file is missing"
+            if get_checksum(save_path) != r.checksum:
+                return r.trade_date, "checksum mismatch"
+            return None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            broken = [z for z in executor.map(__check, records) if z is not None]
+        for trade_date, reason in broken:
+            logger.error(f"{save_data_info.desc} for {trade_date} is broken: {reason}")
+        if drop_broken and broken:
+            for trade_date, _ in broken:
+                save_path = save_data_info.get_save_path(self.save_root_dir, trade_date)
+                if os.path.exists(save_path):
+                    os.replace(save_path, f"{save_path}.broken")
+            self.delete(save_data_info, [trade_date for trade_date, _ in broken])
+        logger.info(f"{len(records)} files of {save_data_info.desc} are verified, {len(broken)} are broken")
+        return broken
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from data_engines import CSaveDataInfo
+from typedef import CWindFieldGroup, CWindSaveDataInfo, CWindMinuteSaveDataInfo
 
 
 # ---------- project configuration ----------
@@ -7,31 +7,98 @@ from data_engines import CSaveDataInfo
 @dataclass(frozen=True)
 class CProCfg:
     calendar_path: str
+    universe_history_path: str
     root_dir: str
     daily_data_root_dir: str
-    futures_basis: CSaveDataInfo
-    futures_stock: CSaveDataInfo
+    minute_data_root_dir: str
+    db_root_dir: str
+    wind_cache_dir: str
+    wind_cache_max_bytes: int
+    futures_basis: CWindSaveDataInfo
+    futures_stock: CWindSaveDataInfo
+    datasets: dict[str, CWindSaveDataInfo]
+    futures_minute: CWindMinuteSaveDataInfo
+    minute_datasets: dict[str, CWindMinuteSaveDataInfo]
     universe: list[str]
 
 
-futures_basis = CSaveDataInfo(
-    file_format="wind_futures_basis_{}.csv.gz",
+# ---------- datasets from WIND ----------
+# a new dataset only needs a declaration here and an entry in datasets, all datasets
+# downloaded together share the calls to WIND for the same instruments
+
+futures_basis = CWindSaveDataInfo(
+    file_format="wind_futures_basis_{}",
+    codec="csv.gz",
     desc="futures daily basis",
     fields=("ts_code", "wd_code", "basis", "basis_rate", "basis_annual"),
+    groups=(
+        CWindFieldGroup(
+            indicators=(
+                ("anal_basis_stkidx", "basis"),
+                ("anal_basispercent_stkidx", "basis_rate"),
+                ("anal_basisannualyield_stkidx", "basis_annual"),
+            ),
+            exchanges=("CFE",),
+        ),
+        CWindFieldGroup(
+            indicators=(
+                ("anal_basis", "basis"),
+                ("anal_basispercent2", "basis_rate"),
+                ("basisannualyield", "basis_annual"),
+            ),
+            exclude_exchanges=("CFE",),
+        ),
+    ),
 )
 
-futures_stock = CSaveDataInfo(
-    file_format="wind_futures_stock_{}.csv.gz",
+futures_stock = CWindSaveDataInfo(
+    file_format="wind_futures_stock_{}",
+    codec="csv.gz",
     desc="futures daily stock",
     fields=("ts_code", "wd_code", "stock"),
+    groups=(
+        CWindFieldGroup(indicators=(("st_stock", "stock"),)),
+    ),
+)
+
+# ---------- minute bars from WIND ----------
+# saved in one file for each section of CCalendarSection
+
+futures_minute = CWindMinuteSaveDataInfo(
+    file_format="wind_futures_minute_{}",
+    desc="futures minute bars",
+    fields=("ts_code", "wd_code", "timestamp", "open", "high", "low", "close", "volume", "amount", "oi"),
+    indicators=(
+        ("open", "open"),
+        ("high", "high"),
+        ("low", "low"),
+        ("close", "close"),
+        ("volume", "volume"),
+        ("amt", "amount"),
+        ("oi", "oi"),
+    ),
+    bar_size=1,
 )
 
 pro_cfg = CProCfg(
     calendar_path=r"SaveDir\Data\Calendar\cne_calendar.csv",
+    universe_history_path=r"SaveDir\Data\Calendar\universe_history.csv",
     root_dir=r"SaveDir\Data\tushare",
     daily_data_root_dir=r"SaveDir\Data\tushare\by_date",
+    minute_data_root_dir=r"SaveDir\Data\tushare\by_section",
+    db_root_dir=r"SaveDir\Data\tushare\database",
+    wind_cache_dir=r"SaveDir\Data\wind_cache",
+    wind_cache_max_bytes=4 * 1024 ** 3,
     futures_basis=futures_basis,
     futures_stock=futures_stock,
+    datasets={
+        "basis": futures_basis,
+        "stock": futures_stock,
+    },
+    futures_minute=futures_minute,
+    minute_datasets={
+        "minute": futures_minute,
+    },
     universe=[
         "A.DCE",
         "AG.SHF",
@@ -1,16 +1,117 @@
 import os
+import json
+import glob
+import bisect
+import hashlib
 import datetime as dt
-import pandas as pd
+import numpy as np
+from typing import Callable, TYPE_CHECKING
 from dataclasses import dataclass, field
 
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+def load_compiled_cache(src_path: str, tag: str, compile_func: Callable[[], np.ndarray]) -> np.ndarray:
+    """
+    cache of data compiled from src_path, saved next to it as .npy, and loaded with mmap.
+    {src_path}.{tag}.json records mtime, size and sha1 of the source, and the cache is
+    {src_path}.{tag}.{sha1[:16]}.npy. The source is only hashed when its mtime or size
+    changed, and the cache is compiled again only if its content changed.
+
+    :param src_path: like "cne_calendar.csv"
+    :param tag: identify different data compiled from the same source
+    :param compile_func: compile data from source, only called when cache is invalid
+    :return:
+    """
+    meta_path = f"{src_path}.{tag}.json"
+    src_stat = os.stat(src_path)
+    meta = {}
+    if os.path.exists(meta_path):
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+    if meta.get("mtime_ns") != src_stat.st_mtime_ns or meta.get("size") != src_stat.st_size:
+        with open(src_path, "rb") as f:
+            sha1 = hashlib.sha1(f.read()).hexdigest()
+        meta_changed = True
+    else:
+        sha1 = meta["sha1"]
+        meta_changed = False
+
+    cache_path = f"{src_path}.{tag}.{sha1[:16]}.npy"
+    if meta.get("sha1") == sha1 and os.path.exists(cache_path):
+        data = np.load(cache_path, mmap_mode="r")
+    else:
+        data = compile_func()
+        for path in glob.glob(f"{glob.escape(src_path)}.{tag}.*.npy"):
+            try:
+                os.remove(path)
+            except OSError:
+                # still used by other processes
+                pass
+        try:
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, data)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            return data
+        meta_changed = True
+
+    if meta_changed:
+        try:
+            tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"mtime_ns": src_stat.st_mtime_ns, "size": src_stat.st_size, "sha1": sha1}, f)
+            os.replace(tmp_path, meta_path)
+        except OSError:
+            pass
+    return data
+
 
 class CCalendar(object):
-    def __init__(self, calendar_path: str, header: int = 0):
+    def __init__(self, calendar_path: str, header: int = 0, use_cache: bool = False):
+        """
+
+        :param calendar_path:
+        :param header:
+        :param use_cache: if True, load trade dates from the compiled cache next to calendar_path,
+                          which is built at the first time
+        """
+        if use_cache:
+            trade_dates = load_compiled_cache(
+                calendar_path, tag=f"dates-h{header}", compile_func=lambda: self.__compile(calendar_path, header),
+            )
+        else:
+            trade_dates = self.__compile(calendar_path, header)
+        self.__trade_dates: list[str] = trade_dates.tolist()
+        self.__build_index()
+
+    @staticmethod
+    def __compile(calendar_path: str, header: int) -> np.ndarray:
+        # pandas is only needed when the cache is compiled again
+        import pandas as pd
+
         if isinstance(header, int):
             calendar_df = pd.read_csv(calendar_path, dtype=str, header=header)
         else:
             calendar_df = pd.read_csv(calendar_path, dtype=str, header=None, names=["trade_date"])
-        self.__trade_dates = [_.replace("-", "") for _ in calendar_df["trade_date"]]
+        return np.array([_.replace("-", "") for _ in calendar_df["trade_date"]], dtype=str)
+
+    def __build_index(self):
+        # trade dates are sorted, so range queries are answered by bisect
+        self.__sn_map: dict[str, int] = {d: sn for sn, d in enumerate(self.__trade_dates)}
+        self.__month_index: dict[str, tuple[int, int]] = {}
+        for sn, d in enumerate(self.__trade_dates):
+            m = d[0:6]
+            self.__month_index[m] = (self.__month_index[m][0], sn) if m in self.__month_index else (sn, sn)
+        # last days of each month, except the last date of calendar, which has no next day to compare
+        self.__month_last_dates = [self.__trade_dates[e] for b, e in self.__month_index.values()]
+        if self.__month_last_dates and self.__month_last_dates[-1] == self.__trade_dates[-1]:
+            self.__month_last_dates.pop()
 
     @property
     def last_date(self):
@@ -25,14 +126,10 @@ class CCalendar(object):
         return self.__trade_dates
 
     def get_iter_list(self, bgn_date: str, stp_date: str, ascending: bool = True) -> list[str]:
-        res = []
-        for t_date in self.__trade_dates:
-            if t_date < bgn_date:
-                continue
-            if t_date >= stp_date:
-                break
-            res.append(t_date)
-        return res if ascending else sorted(res, reverse=True)
+        i = bisect.bisect_left(self.__trade_dates, bgn_date)
+        j = bisect.bisect_left(self.__trade_dates, stp_date, lo=i)
+        res = self.__trade_dates[i:j]
+        return res if ascending else res[::-1]
 
     def shift_iter_dates(self, iter_dates: list[str], shift: int) -> list[str]:
         """
@@ -51,7 +148,10 @@ class CCalendar(object):
         return shift_dates
 
     def get_sn(self, base_date: str) -> int:
-        return self.__trade_dates.index(base_date)
+        try:
+            return self.__sn_map[base_date]
+        except KeyError:
+            raise ValueError(f"{base_date!r} is not in list")
 
     def get_date(self, sn: int) -> str:
         return self.__trade_dates[sn]
@@ -72,16 +172,9 @@ class CCalendar(object):
         return self.get_next_date(bgn_date, -max_win + shift)
 
     def get_last_days_in_range(self, bgn_date: str, stp_date: str) -> list[str]:
-        res = []
-        for this_day, next_day in zip(self.__trade_dates[:-1], self.__trade_dates[1:]):
-            if this_day < bgn_date:
-                continue
-            elif this_day >= stp_date:
-                break
-            else:
-                if this_day[0:6] != next_day[0:6]:
-                    res.append(this_day)
-        return res
+        i = bisect.bisect_left(self.__month_last_dates, bgn_date)
+        j = bisect.bisect_left(self.__month_last_dates, stp_date, lo=i)
+        return self.__month_last_dates[i:j]
 
     def get_last_day_of_month(self, month: str) -> str:
         """
@@ -89,10 +182,12 @@ class CCalendar(object):
 
         """
 
+        if month in self.__month_index:
+            return self.__trade_dates[self.__month_index[month][1]]
         threshold = f"{month}31"
-        for t in self.__trade_dates[::-1]:
-            if t <= threshold:
-                return t
+        sn = bisect.bisect_right(self.__trade_dates, threshold) - 1
+        if sn >= 0:
+            return self.__trade_dates[sn]
         raise ValueError(f"Could not find last day for {month}")
 
     def get_first_day_of_month(self, month: str) -> str:
@@ -101,10 +196,12 @@ class CCalendar(object):
 
         """
 
+        if month in self.__month_index:
+            return self.__trade_dates[self.__month_index[month][0]]
         threshold = f"{month}01"
-        for t in self.__trade_dates:
-            if t >= threshold:
-                return t
+        sn = bisect.bisect_left(self.__trade_dates, threshold)
+        if sn < len(self.__trade_dates):
+            return self.__trade_dates[sn]
         raise ValueError(f"Could not find first day for {month}")
 
     @staticmethod
@@ -118,6 +215,17 @@ class CCalendar(object):
                 res[m].append(t)
         return res
 
+    @staticmethod
+    def split_by_year(dates: list[str]) -> dict[str, list[str]]:
+        res = {}
+        for t in dates:
+            y = t[0:4]
+            if y not in res:
+                res[y] = [t]
+            else:
+                res[y].append(t)
+        return res
+
     @staticmethod
     def move_date_string(trade_date: str, move_days: int = 1) -> str:
         """
@@ -154,7 +262,7 @@ class CCalendar(object):
             ny, nm = ny + 1, nm - 12
         return f"{ny:04d}{nm:02d}"
 
-    def get_dates_header(self, bgn_date: str, stp_date: str, header_name: str = "trade_date") -> pd.DataFrame:
+    def get_dates_header(self, bgn_date: str, stp_date: str, header_name: str = "trade_date") -> "pd.DataFrame":
         """
         :param bgn_date: format = "YYYYMMDD"
         :param stp_date: format = "YYYYMMDD"
@@ -162,11 +270,21 @@ class CCalendar(object):
         :return:
         """
 
+        import pandas as pd
+
         h = pd.DataFrame({header_name: self.get_iter_list(bgn_date, stp_date)})
         return h
 
 
 CONST_TS1, CONST_TS2 = "TS1", "TS2"
+SEC_CODES = {CONST_TS1: 1, CONST_TS2: 2}
+SEC_NAMES = {v: k for k, v in SEC_CODES.items()}
+SECTION_TABLE_DTYPE = np.dtype([
+    ("trade_date", np.int64),
+    ("sec_code", np.int8),
+    ("bgn_time", "datetime64[us]"),
+    ("end_time", "datetime64[us]"),
+])
 
 
 @dataclass(frozen=True)
@@ -208,69 +326,212 @@ class CCalendarSection(object):
             ts1_end_time: str = "07:00:00.000000",
             ts2_bgn_time: str = "07:00:00.000000",
             ts2_end_time: str = "19:00:00.000000",
+            use_cache: bool = False,
     ):
-        self.sections: list[CSection] = []
-        if header:
-            df = pd.read_csv(calendar_path, dtype=str, header=header)
+        """
+        sections are kept as columns, CSection objects are only created when they are returned.
+        For each pair of adjacent trade dates (this, next), there are 2 sections:
+            TS2 of this, from this + ts2_bgn_time to this + ts2_end_time
+            TS1 of next, from this + ts1_bgn_time to (this + 1 day) + ts1_end_time
+
+        if use_cache is True, columns are loaded from the compiled cache next to calendar_path,
+        which is built at the first time for each set of parameters
+        """
+        self.__time_strs = {
+            CONST_TS1: (ts1_bgn_time, ts1_end_time),
+            CONST_TS2: (ts2_bgn_time, ts2_end_time),
+        }
+        params = (header, ts1_bgn_time, ts1_end_time, ts2_bgn_time, ts2_end_time)
+        if use_cache:
+            tag = "sections-" + hashlib.sha1(repr(params).encode()).hexdigest()[:8]
+            table = load_compiled_cache(
+                calendar_path, tag=tag, compile_func=lambda: self.__compile(calendar_path, *params),
+            )
         else:
-            df = pd.read_csv(calendar_path, dtype=str, header=None, names=["trade_date"])
-        for this_trade_date, next_trade_date in zip(df["trade_date"][:-1], df["trade_date"][1:]):
-            next_date = (dt.datetime.strptime(this_trade_date, "%Y%m%d") + dt.timedelta(days=1)).strftime("%Y%m%d")
+            table = self.__compile(calendar_path, *params)
+        self.__trade_dates = table["trade_date"]
+        self.__sec_codes = table["sec_code"]
+        self.__bgn_times = table["bgn_time"]
+        self.__end_times = table["end_time"]
+        self.sections_size = len(table)
+
+        # searchsorted on end times finds the first section which could match a timestamp,
+        # it is the same as a linear scan only if sections do not overlap
+        self.__sorted = bool(
+            np.all(self.__bgn_times[1:] >= self.__end_times[:-1]) and np.all(self.__bgn_times <= self.__end_times)
+        )
 
-            # this section TS2
-            bgn_time = f"{this_trade_date} {ts2_bgn_time}"
-            end_time = f"{this_trade_date} {ts2_end_time}"
-            this_sec_ts2 = CSection(trade_date=this_trade_date, section=CONST_TS2, bgnTime=bgn_time, endTime=end_time)
-            self.sections.append(this_sec_ts2)
+    @staticmethod
+    def __compile(
+            calendar_path: str, header: int,
+            ts1_bgn_time: str, ts1_end_time: str, ts2_bgn_time: str, ts2_end_time: str,
+    ) -> np.ndarray:
+        import pandas as pd
 
-            # next section TS1
-            bgn_time = f"{this_trade_date} {ts1_bgn_time}"
-            end_time = f"{next_date} {ts1_end_time}"
-            next_sec_ts1 = CSection(trade_date=next_trade_date, section=CONST_TS1, bgnTime=bgn_time, endTime=end_time)
-            self.sections.append(next_sec_ts1)
+        if header is not None:
+            df = pd.read_csv(calendar_path, dtype=str, header=header)
+        else:
+            df = pd.read_csv(calendar_path, dtype=str, header=None, names=["trade_date"])
+        trade_dates = df["trade_date"].to_numpy(dtype=str)
+        days = pd.to_datetime(trade_dates, format="%Y%m%d").values.astype("datetime64[D]")
+        this_days = days[:-1].astype("datetime64[us]")
+
+        def __offset(t: str) -> np.timedelta64:
+            return pd.Timedelta(t).to_timedelta64().astype("timedelta64[us]")
+
+        # TS2 of this trade date at even positions and TS1 of next trade date at odd positions
+        table = np.empty(2 * len(this_days), dtype=SECTION_TABLE_DTYPE)
+        table["trade_date"][0::2] = trade_dates[:-1].astype(np.int64)
+        table["trade_date"][1::2] = trade_dates[1:].astype(np.int64)
+        table["sec_code"][0::2] = SEC_CODES[CONST_TS2]
+        table["sec_code"][1::2] = SEC_CODES[CONST_TS1]
+        table["bgn_time"][0::2] = this_days + __offset(ts2_bgn_time)
+        table["end_time"][0::2] = this_days + __offset(ts2_end_time)
+        table["bgn_time"][1::2] = this_days + __offset(ts1_bgn_time)
+        table["end_time"][1::2] = this_days + np.timedelta64(1, "D") + __offset(ts1_end_time)
+        return table
+
+    def get_sec(self, sn: int) -> CSection:
+        section = SEC_NAMES[self.__sec_codes[sn]]
+        bgn_time_str, end_time_str = self.__time_strs[section]
+        bgn_day = str(self.__bgn_times[sn].astype("datetime64[D]")).replace("-", "")
+        end_day = str(self.__end_times[sn].astype("datetime64[D]")).replace("-", "")
+        return CSection(
+            trade_date=str(self.__trade_dates[sn]),
+            section=section,
+            bgnTime=f"{bgn_day} {bgn_time_str}",
+            endTime=f"{end_day} {end_time_str}",
+        )
 
-        self.sections_size = len(self.sections)
+    @property
+    def sections(self) -> list[CSection]:
+        # all sections are created at every call, use get_sec, head, tail or get_iter_list if possible
+        return [self.get_sec(sn) for sn in range(self.sections_size)]
 
     def head(self, n: int) -> list[CSection]:
-        return self.sections[0:n]
+        return [self.get_sec(sn) for sn in range(self.sections_size)[0:n]]
 
     def tail(self, n: int) -> list[CSection]:
-        return self.sections[-n:]
+        return [self.get_sec(sn) for sn in range(self.sections_size)[-n:]]
+
+    def __search(self, trade_date: str, section: str) -> int:
+        """
+
+        :return: position of the first section not less than (trade_date, section),
+                 which is the order of secId
+        """
+        d, c = int(trade_date), SEC_CODES[section]
+        sn = int(np.searchsorted(self.__trade_dates, d, side="left"))
+        while sn < self.sections_size and self.__trade_dates[sn] == d and self.__sec_codes[sn] < c:
+            sn += 1
+        return sn
+
+    def __find(self, trade_date: str, section: str) -> int:
+        sn = self.__search(trade_date, section)
+        if sn < self.sections_size and self.__trade_dates[sn] == int(trade_date) \
+                and self.__sec_codes[sn] == SEC_CODES[section]:
+            return sn
+        return -1
 
     def get_sn(self, sec: CSection) -> int:
-        return self.sections.index(sec)
+        if (sn := self.__find(sec.trade_date, sec.section)) < 0:
+            raise ValueError(f"{sec} is not in list")
+        return sn
 
     def get_next_sec(self, this_sec: CSection, shift: int = 1) -> CSection | None:
         sn = self.get_sn(this_sec)
         sn_dst = sn + shift
         if 0 <= sn_dst < self.sections_size:
-            return self.sections[sn_dst]
+            return self.get_sec(sn_dst)
         else:
             return None
 
+    def get_iter_sns(self, bgn_sec: CSection, stp_sec: CSection) -> range:
+        i = self.__search(bgn_sec.trade_date, bgn_sec.section)
+        j = self.__search(stp_sec.trade_date, stp_sec.section)
+        return range(i, max(i, j))
+
     def get_iter_list(self, bgn_sec: CSection, stp_sec: CSection) -> list[CSection]:
-        iter_list: list[CSection] = []
-        for sec in self.sections:
-            if sec >= stp_sec:
-                break
-            if sec >= bgn_sec:
-                iter_list.append(sec)
-        return iter_list
+        return [self.get_sec(sn) for sn in self.get_iter_sns(bgn_sec, stp_sec)]
 
     def match(self, tp: str) -> tuple[bool, CSection | None]:
-        for sec in self.sections:
-            if sec.match(tp):
-                return True, sec
-        return False, None
+        sn = self.match_batch([tp])[0]
+        return (True, self.get_sec(sn)) if sn >= 0 else (False, None)
+
+    @staticmethod
+    def __to_datetime64(tps: list[str] | np.ndarray) -> np.ndarray:
+        tps = np.asarray(tps)
+        if np.issubdtype(tps.dtype, np.datetime64):
+            return tps.astype("datetime64[us]")
+        import pandas as pd
+
+        try:
+            res = pd.to_datetime(tps, format="%Y%m%d %H:%M:%S.%f")
+        except ValueError:
+            res = pd.to_datetime(tps)
+        return np.asarray(res, dtype="datetime64[us]")
+
+    def match_batch(self, tps: list[str] | np.ndarray) -> np.ndarray:
+        """
+
+        :param tps: timestamps, strings with format "YYYYMMDD HH:MM:SS.ffffff", or datetime64
+        :return: an int64 array, sn of the matched section for each timestamp, -1 if no section matched
+        """
+        tps = self.__to_datetime64(tps)
+        if self.sections_size == 0:
+            # like a calendar with a single date
+            return np.full(len(tps), -1, dtype=np.int64)
+        bgn, end = self.__bgn_times, self.__end_times
+        if not self.__sorted:
+            res = np.full(len(tps), -1, dtype=np.int64)
+            for i, tp in enumerate(tps):
+                hits = np.flatnonzero((bgn <= tp) & (tp <= end))
+                res[i] = hits[0] if len(hits) > 0 else -1
+            return res
+
+        sn = np.searchsorted(end, tps, side="left")
+        sn_safe = np.minimum(sn, self.sections_size - 1)
+        matched = (sn < self.sections_size) & (bgn[sn_safe] <= tps)
+        return np.where(matched, sn, -1).astype(np.int64)
+
+    def get_last_closed_sec(self, tp: str, sections: tuple[str, ...] = (CONST_TS1, CONST_TS2)) -> CSection | None:
+        """
+
+        :param tp: timestamp, same as match_batch
+        :param sections: only sections with these names are searched
+        :return: the latest section in sections which is closed before tp, None if not found
+        """
+        tp = self.__to_datetime64([tp])[0]
+        codes = [SEC_CODES[z] for z in sections]
+        closed = np.flatnonzero((self.__end_times < tp) & np.isin(self.__sec_codes, codes))
+        return self.get_sec(int(closed[-1])) if len(closed) > 0 else None
+
+    def match_sec_ids(self, tps: list[str] | np.ndarray) -> np.ndarray:
+        """
+
+        :param tps: same as match_batch
+        :return: an object array, secId of the matched section for each timestamp, None if no section matched
+        """
+        sn = self.match_batch(tps)
+        hit = sn[sn >= 0]
+        suffixes = np.where(self.__sec_codes[hit] == SEC_CODES[CONST_TS1], f"-{CONST_TS1}", f"-{CONST_TS2}")
+        res = np.full(len(sn), None, dtype=object)
+        res[sn >= 0] = np.char.add(self.__trade_dates[hit].astype(str), suffixes)
+        return res
 
     def match_id(self, tgt_sec_id: str) -> tuple[bool, CSection | None]:
-        for sec in self.sections:
-            if sec.secId == tgt_sec_id:
-                return True, sec
-        return False, None
+        trade_date, _, section = tgt_sec_id.partition("-")
+        if not (trade_date.isdigit() and section in SEC_CODES):
+            return False, None
+        sn = self.__find(trade_date, section)
+        return (True, self.get_sec(sn)) if sn >= 0 else (False, None)
 
     def match_date(self, tgt_date: str) -> tuple[bool, list[CSection]]:
-        res = [sec for sec in self.sections if sec.trade_date == tgt_date]
+        if not tgt_date.isdigit():
+            return False, []
+        i = int(np.searchsorted(self.__trade_dates, int(tgt_date), side="left"))
+        j = int(np.searchsorted(self.__trade_dates, int(tgt_date), side="right"))
+        res = [self.get_sec(sn) for sn in range(i, j)]
         return (True, res) if res else (False, res)
 
     def parse_section(self, using_now: bool, bgn_sec_id: str, stp_sec_id: str) \
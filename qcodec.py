@@ -0,0 +1,167 @@
+"""
+codecs of daily files. All codecs keep the same columns and dtypes, so files of different
+codecs are interchangeable for readers, only their suffixes differ.
+
+    csv.gz  : text csv with gzip, readable by anything
+    csv.zst : text csv with zstd, by pyarrow streams, no extra dependency
+    feather : Arrow IPC file with lz4
+    parquet : columnar with snappy, columns are read selectively
+
+Daily files of this project are small, about 80 instruments by 1 - 3 fields. At this shape,
+"python benchmarks.py codec" measured csv.gz and csv.zst at about 1.5 ms/file to read and 1.5 KiB/file,
+feather and parquet at 4 - 6 ms/file and about 6 KiB/file, for their fixed costs of schema and metadata.
+csv.gz remains the default, binary codecs are only worth measuring again for much wider files.
+
+pandas and pyarrow are imported when files are read or written, so declaring datasets is cheap.
+"""
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class CCodec(object):
+    def __init__(self, name: str, suffix: str):
+        """
+
+        :param name: like "csv.gz", which is used in CSaveDataInfo.codec
+        :param suffix: like ".csv.gz", appended to file names
+        """
+        self.name = name
+        self.suffix = suffix
+
+    def write(self, df: "pd.DataFrame", path: str):
+        raise NotImplementedError
+
+    def read_columns(self, path: str, columns: list[str] | None) -> "pd.DataFrame":
+        raise NotImplementedError
+
+    def get_file_columns(self, path: str) -> list[str]:
+        raise NotImplementedError
+
+    def read(self, path: str, dtypes: dict[str, type | str] | None = None, columns: list[str] | None = None) \
+            -> "pd.DataFrame":
+        """
+
+        :param path:
+        :param dtypes: {column: dtype}, columns not in it are kept as they are parsed
+        :param columns: only these columns are read and returned in this order, columns not in the file
+                        (like a field added to the dataset later) are NaN. All columns if not provided.
+        :return:
+        """
+        if columns is None:
+            df = self.read_columns(path, None)
+        else:
+            wanted = set(columns)
+            df = self.read_columns(path, [c for c in self.get_file_columns(path) if c in wanted])
+            df = df.reindex(columns=columns)
+        if dtypes:
+            df = df.astype({k: v for k, v in dtypes.items() if k in df.columns})
+        return df
+
+
+class CCodecCsv(CCodec):
+    def __init__(self, name: str, suffix: str, compression: str):
+        """
+
+        :param compression: "gzip" by pandas, or "zstd" by pyarrow streams
+        """
+        self.compression = compression
+        super().__init__(name, suffix)
+
+    def write(self, df: "pd.DataFrame", path: str):
+        if self.compression == "gzip":
+            df.to_csv(path, index=False, compression="gzip")
+        else:
+            import pyarrow as pa
+
+            with pa.output_stream(path, compression=self.compression) as f:
+                df.to_csv(f, index=False)
+        return 0
+
+    def read(self, path: str, dtypes: dict[str, type | str] | None = None, columns: list[str] | None = None) \
+            -> "pd.DataFrame":
+        # dtypes and columns are pushed down to the parser, instead of casting and selecting after parsing
+        kwargs = {"dtype": dtypes}
+        if columns is not None:
+            wanted = set(columns)
+            kwargs = {
+                "dtype": {k: v for k, v in (dtypes or {}).items() if k in wanted},
+                "usecols": lambda c: c in wanted,
+            }
+        import pandas as pd
+
+        if self.compression == "gzip":
+            df = pd.read_csv(path, compression="gzip", **kwargs)
+        else:
+            import pyarrow as pa
+
+            with pa.input_stream(path, compression=self.compression) as f:
+                df = pd.read_csv(f, **kwargs)
+        return df if columns is None else df.reindex(columns=columns)
+
+
+class CCodecFeather(CCodec):
+    def __init__(self, name: str, suffix: str, compression: str = "lz4"):
+        self.compression = compression
+        super().__init__(name, suffix)
+
+    def write(self, df: "pd.DataFrame", path: str):
+        df.to_feather(path, compression=self.compression)
+        return 0
+
+    def read_columns(self, path: str, columns: list[str] | None) -> "pd.DataFrame":
+        import pandas as pd
+
+        return pd.read_feather(path, columns=columns)
+
+    def get_file_columns(self, path: str) -> list[str]:
+        import pyarrow as pa
+
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).schema.names
+
+
+class CCodecParquet(CCodec):
+    def __init__(self, name: str, suffix: str, compression: str = "snappy"):
+        self.compression = compression
+        super().__init__(name, suffix)
+
+    def write(self, df: "pd.DataFrame", path: str):
+        df.to_parquet(path, index=False, compression=self.compression)
+        return 0
+
+    def read_columns(self, path: str, columns: list[str] | None) -> "pd.DataFrame":
+        import pandas as pd
+
+        return pd.read_parquet(path, columns=columns)
+
+    def get_file_columns(self, path: str) -> list[str]:
+        import pyarrow.parquet as pq
+
+        return pq.read_schema(path).names
+
+
+CODECS: dict[str, CCodec] = {
+    z.name: z for z in (
+        CCodecCsv(name="csv.gz", suffix=".csv.gz", compression="gzip"),
+        CCodecCsv(name="csv.zst", suffix=".csv.zst", compression="zstd"),
+        CCodecFeather(name="feather", suffix=".feather"),
+        CCodecParquet(name="parquet", suffix=".parquet"),
+    )
+}
+
+
+def get_codec(name: str) -> CCodec:
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"codec = {name} is illegal, available codecs are {list(CODECS)}")
+
+
+def get_codec_by_path(path: str) -> CCodec:
+    for codec in CODECS.values():
+        if path.endswith(codec.suffix):
+            return codec
+    raise ValueError(f"codec of {path} is unknown, available suffixes are {[z.suffix for z in CODECS.values()]}")
@@ -0,0 +1,215 @@
+import os
+import json
+import math
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from loguru import logger
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+POINTS_BUCKETS = (0, 10, 100, 1000, 5000, 10000, 50000, 100000)
+RETRIES_BUCKETS = (0, 1, 2, 3, 5, 8)
+
+# buckets of histograms not in it are LATENCY_BUCKETS
+DEFAULT_BUCKETS: dict[str, tuple[float, ...]] = {
+    "wind_call_points": POINTS_BUCKETS,
+    "wind_call_retries": RETRIES_BUCKETS,
+}
+
+TLabels = tuple[tuple[str, str], ...]
+
+
+class CHistogram(object):
+    def __init__(self, buckets: tuple[float, ...]):
+        """
+
+        :param buckets: upper bounds in ascending order, an extra bucket of +Inf is always kept
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float):
+        # a value equal to an upper bound falls into that bucket, same as "le" of Prometheus
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        return 0
+
+    def quantile(self, q: float) -> float:
+        """
+        upper bound of the bucket where the quantile falls, bounded by the max value observed
+
+        """
+        if self.count == 0:
+            return math.nan
+        rank, cum = q * self.count, 0
+        for bound, n in zip(self.buckets, self.counts):
+            cum += n
+            if cum >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else math.nan
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": list(self.buckets), "counts": self.counts, "count": self.count, "sum": self.total,
+            "min": self.min if self.count else None, "max": self.max if self.count else None,
+        }
+
+    def merge(self, d: dict):
+        if tuple(d["buckets"]) != self.buckets:
+            raise ValueError(f"buckets {d['buckets']} are different from {self.buckets}")
+        self.counts = [a + b for a, b in zip(self.counts, d["counts"])]
+        self.count += d["count"]
+        self.total += d["sum"]
+        if d["count"]:
+            self.min, self.max = min(self.min, d["min"]), max(self.max, d["max"])
+        return 0
+
+
+class CMetrics(object):
+    def __init__(self, dump_path: str | None = None, buckets: dict[str, tuple[float, ...]] | None = None):
+        """
+        histograms and counters with labels, shared by threads of a process. Metrics of worker
+        processes are sent to the parent by snapshot() and merge().
+
+        :param dump_path: metrics are saved by dump(), as a Prometheus textfile if it ends with ".prom",
+                          or else as json
+        :param buckets: {histogram name: upper bounds}, updates DEFAULT_BUCKETS
+        """
+        self.dump_path = dump_path
+        self.buckets = {**DEFAULT_BUCKETS, **(buckets or {})}
+        self.__histograms: dict[tuple[str, TLabels], CHistogram] = {}
+        self.__counters: dict[tuple[str, TLabels], float] = {}
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def __get_labels(labels: dict[str, str]) -> TLabels:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def __get_histogram(self, name: str, labels: TLabels) -> CHistogram:
+        if (key := (name, labels)) not in self.__histograms:
+            self.__histograms[key] = CHistogram(self.buckets.get(name, LATENCY_BUCKETS))
+        return self.__histograms[key]
+
+    def observe(self, name: str, value: float, **labels):
+        with self.__lock:
+            self.__get_histogram(name, self.__get_labels(labels)).observe(value)
+        return 0
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, self.__get_labels(labels))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+        return 0
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        observe seconds used by the block, like
+            with metrics.timer("stage_seconds", stage="fetch"):
+                ...
+
+        """
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - t0, **labels)
+
+    def snapshot(self) -> dict:
+        with self.__lock:
+            return {
+                "histograms": [
+                    {"name": name, "labels": dict(labels), **h.to_dict()}
+                    for (name, labels), h in sorted(self.__histograms.items())
+                ],
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": v}
+                    for (name, labels), v in sorted(self.__counters.items())
+                ],
+            }
+
+    def merge(self, snapshot: dict):
+        with self.__lock:
+            for d in snapshot["histograms"]:
+                h = self.__get_histogram(d["name"], self.__get_labels(d["labels"]))
+                h.merge(d)
+            for d in snapshot["counters"]:
+                key = (d["name"], self.__get_labels(d["labels"]))
+                self.__counters[key] = self.__counters.get(key, 0) + d["value"]
+        return 0
+
+    # --- dump
+    @staticmethod
+    def __format_labels(labels: dict[str, str], **extra) -> str:
+        items = {**labels, **extra}
+        if not items:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in items.items()) + "}"
+
+    def to_prometheus(self) -> str:
+        snapshot, lines, typed = self.snapshot(), [], set()
+        for d in snapshot["histograms"]:
+            if d["name"] not in typed:
+                lines.append(f"# TYPE {d['name']} histogram")
+                typed.add(d["name"])
+            cum = 0
+            for bound, n in zip(d["buckets"] + ["+Inf"], d["counts"]):
+                cum += n
+                lines.append(f"{d['name']}_bucket{self.__format_labels(d['labels'], le=bound)} {cum}")
+            lines.append(f"{d['name']}_sum{self.__format_labels(d['labels'])} {d['sum']}")
+            lines.append(f"{d['name']}_count{self.__format_labels(d['labels'])} {d['count']}")
+        for d in snapshot["counters"]:
+            if d["name"] not in typed:
+                lines.append(f"# TYPE {d['name']} counter")
+                typed.add(d["name"])
+            lines.append(f"{d['name']}{self.__format_labels(d['labels'])} {d['value']}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, dump_path: str | None = None):
+        """
+        written to a temporary file and then renamed, so collectors never read a partial file
+
+        :param dump_path: self.dump_path if not provided
+        """
+        if (dump_path := dump_path or self.dump_path) is None:
+            return 0
+        content = self.to_prometheus() if dump_path.endswith(".prom") else json.dumps(self.snapshot(), indent=2)
+        if save_dir := os.path.dirname(dump_path):
+            os.makedirs(save_dir, exist_ok=True)
+        tmp_path = f"{dump_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, dump_path)
+        logger.info(f"Metrics are saved to {dump_path}")
+        return 0
+
+    def log_summary(self, title: str = "Metrics"):
+        snapshot = self.snapshot()
+        if not snapshot["histograms"] and not snapshot["counters"]:
+            return 0
+        lines = [f"{'metric':<28s}{'labels':<36s}{'count':>8s}{'mean':>10s}{'p50':>10s}{'p95':>10s}{'max':>10s}"
+                 f"{'sum':>12s}"]
+        with self.__lock:
+            histograms = sorted(self.__histograms.items(), key=lambda z: z[0])
+        for (name, labels), h in histograms:
+            lines.append(
+                f"{name:<28s}{','.join(f'{k}={v}' for k, v in labels):<36s}{h.count:>8d}{h.mean:>10.4g}"
+                f"{h.quantile(0.5):>10.4g}{h.quantile(0.95):>10.4g}{h.max:>10.4g}{h.total:>12.4g}"
+            )
+        for d in snapshot["counters"]:
+            labels = ",".join(f"{k}={v}" for k, v in d["labels"].items())
+            lines.append(f"{d['name']:<28s}{labels:<36s}{d['value']:>8g}")
+        logger.info(f"{title}:\n" + "\n".join(lines))
+        return 0
@@ -0,0 +1,119 @@
+import time
+import random
+import threading
+
+
+class CTokenBucket(object):
+    def __init__(self, rate: float, capacity: float = 1.0):
+        """
+
+        :param rate: tokens added per second, i.e. the sustained calls per second
+        :param capacity: max tokens kept in bucket, i.e. the size of a burst
+        """
+        self.__rate = rate
+        self.__capacity = capacity
+        self.__tokens = capacity
+        self.__last = time.monotonic()
+        self.__lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self.__rate
+
+    @rate.setter
+    def rate(self, rate: float):
+        with self.__lock:
+            self.__refill()
+            self.__rate = rate
+
+    @property
+    def capacity(self) -> float:
+        return self.__capacity
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(self.__capacity, self.__tokens + (now - self.__last) * self.__rate)
+        self.__last = now
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """
+        block until tokens are available
+
+        :param tokens:
+        :return: seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self.__lock:
+                self.__refill()
+                if self.__tokens >= tokens:
+                    self.__tokens -= tokens
+                    return waited
+                wait = (tokens - self.__tokens) / self.__rate
+            time.sleep(wait)
+            waited += wait
+
+
+class CRetryPolicy(object):
+    def __init__(self, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0, jitter: float = 0.5):
+        """
+
+        :param max_retries: retries after the first attempt
+        :param base_delay: seconds before the first retry, doubled for each retry after it
+        :param max_delay: upper limit of delay
+        :param jitter: fraction of delay randomly removed, so workers failing at the same time
+                       do not retry at the same time
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def get_delay(self, attempt: int) -> float:
+        """
+
+        :param attempt: 0 for the first retry
+        :return: seconds to wait before the retry
+        """
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (1 - self.jitter * random.random())
+
+
+class CAdaptiveRateController(object):
+    def __init__(
+            self, limiter: CTokenBucket, min_rate: float | None = None, max_rate: float | None = None,
+            decrease: float = 0.5, increase: float = 0.05, cooldown: float = 1.0,
+    ):
+        """
+        additive increase and multiplicative decrease of the rate of limiter
+
+        :param limiter:
+        :param min_rate: default is 1/20 of the current rate of limiter
+        :param max_rate: default is the current rate of limiter
+        :param decrease: rate is multiplied by it when quota is exceeded
+        :param increase: calls per second added to rate for each successful call
+        :param cooldown: rate is decreased at most once in cooldown seconds, so calls already
+                         in flight when quota is exceeded do not decrease it again
+        """
+        self.limiter = limiter
+        self.max_rate = max_rate or limiter.rate
+        self.min_rate = min_rate or self.max_rate / 20
+        self.decrease = decrease
+        self.increase = increase
+        self.cooldown = cooldown
+        self.__last_decrease = -cooldown
+        self.__lock = threading.Lock()
+
+    def on_success(self):
+        with self.__lock:
+            if self.limiter.rate < self.max_rate:
+                self.limiter.rate = min(self.max_rate, self.limiter.rate + self.increase)
+        return 0
+
+    def on_quota_exceeded(self):
+        with self.__lock:
+            now = time.monotonic()
+            if now - self.__last_decrease >= self.cooldown:
+                self.limiter.rate = max(self.min_rate, self.limiter.rate * self.decrease)
+                self.__last_decrease = now
+        return 0
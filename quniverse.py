@@ -0,0 +1,109 @@
+import os
+import pandas as pd
+from dataclasses import dataclass
+from loguru import logger
+from rich.progress import track
+from typedef import CSaveDataInfo
+from qcalendar import CCalendar
+
+
+@dataclass(frozen=True)
+class CListing:
+    list_date: str  # first trade date, "" if listed before any date known
+    delist_date: str  # last trade date, "" if still listed
+
+    def is_active(self, bgn_date: str, end_date: str) -> bool:
+        """
+
+        :return: True if listed on any day in [bgn_date, end_date]
+        """
+        return self.list_date <= end_date and (not self.delist_date or bgn_date <= self.delist_date)
+
+
+class CUniverseHistory(object):
+    def __init__(self, universe_history_path: str):
+        """
+        listing and delisting dates of instruments, saved as csv with columns
+        wd_code, list_date, delist_date. Instruments not in it are always active.
+
+        :param universe_history_path: like "SaveDir/Data/Calendar/universe_history.csv"
+        """
+        self.universe_history_path = universe_history_path
+        self.listings: dict[str, CListing] = {}
+        if os.path.exists(universe_history_path):
+            df = pd.read_csv(universe_history_path, dtype=str, keep_default_na=False)
+            for wd_code, list_date, delist_date in zip(df["wd_code"], df["list_date"], df["delist_date"]):
+                self.listings[wd_code] = CListing(list_date=list_date, delist_date=delist_date)
+        else:
+            logger.warning(f"{universe_history_path} does not exist, all instruments are treated as active")
+
+    def is_active(self, wd_code: str, bgn_date: str, end_date: str | None = None) -> bool:
+        if (listing := self.listings.get(wd_code)) is None:
+            return True
+        return listing.is_active(bgn_date, end_date or bgn_date)
+
+    def get_active_codes(self, universe: list[str], bgn_date: str, end_date: str | None = None) -> list[str]:
+        """
+
+        :param universe:
+        :param bgn_date:
+        :param end_date: same as bgn_date if not provided
+        :return: codes listed on any day in [bgn_date, end_date], in the same order as universe
+        """
+        return [z for z in universe if self.is_active(z, bgn_date, end_date)]
+
+    def save(self):
+        df = pd.DataFrame(
+            [(k, v.list_date, v.delist_date) for k, v in sorted(self.listings.items())],
+            columns=["wd_code", "list_date", "delist_date"],
+        )
+        df.to_csv(self.universe_history_path, index=False)
+        return 0
+
+    def infer(
+            self, save_data_info: CSaveDataInfo, src_root_dir: str, bgn_date: str, stp_date: str,
+            calendar: CCalendar, delist_gap: int = 20,
+    ):
+        """
+        infer listings from daily files: an instrument is listed on the first date it has any value,
+        and delisted on the last date it has any value, if no value is found in the last delist_gap
+        dates of the range. An instrument with values on the first date of files may be listed before
+        the range, its list date is kept if known, or else "". Listings of other instruments are kept.
+
+        :param save_data_info:
+        :param src_root_dir: root directory of daily files
+        :param bgn_date:
+        :param stp_date:
+        :param calendar:
+        :param delist_gap:
+        :return:
+        """
+        first_dates: dict[str, str] = {}
+        last_dates: dict[str, str] = {}
+        first_file_date = ""
+        iter_dates = calendar.get_iter_list(bgn_date, stp_date)
+        if not iter_dates:
+            logger.warning(f"No trade dates in [{bgn_date}, {stp_date}), listings are not inferred")
+            return 0
+        for trade_date in track(iter_dates, description=f"Scanning {save_data_info.desc}"):
+            src_path = save_data_info.get_save_path(src_root_dir, trade_date)
+            if not os.path.exists(src_path):
+                continue
+            first_file_date = first_file_date or trade_date
+            df = save_data_info.read_file(src_path)
+            has_value = df[save_data_info.value_fields].notna().any(axis=1)
+            for wd_code in df.loc[has_value, "wd_code"]:
+                first_dates.setdefault(wd_code, trade_date)
+                last_dates[wd_code] = trade_date
+
+        delist_threshold = iter_dates[-delist_gap] if len(iter_dates) >= delist_gap else iter_dates[0]
+        for wd_code, list_date in first_dates.items():
+            if list_date == first_file_date:
+                list_date = self.listings[wd_code].list_date if wd_code in self.listings else ""
+            last_date = last_dates[wd_code]
+            self.listings[wd_code] = CListing(
+                list_date=list_date,
+                delist_date=last_date if last_date < delist_threshold else "",
+            )
+        logger.info(f"Listings of {len(first_dates)} instruments are inferred from {save_data_info.desc}")
+        return 0
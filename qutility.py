@@ -1,4 +1,5 @@
 import os
+import sys
 import shutil
 import re
 import functools
@@ -108,6 +109,21 @@ def batched(iterable, batch_size: int):
         piece = list(islice(i, batch_size))
 
 
+def setup_logger(log_path: str | None = "logs/download_and_update.log", stderr_level: str = "INFO"):
+    """
+    called by entry points, importing modules never adds handlers
+
+    :param log_path: all messages are saved here, not saved if None
+    :param stderr_level: messages below it are not shown
+    :return:
+    """
+    logger.remove()
+    logger.add(sys.stderr, level=stderr_level)
+    if log_path is not None:
+        logger.add(log_path)
+    return 0
+
+
 if __name__ == "__main__":
     w = 24
     test_string = "食品09ETF"
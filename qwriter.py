@@ -0,0 +1,157 @@
+import os
+import queue
+import threading
+import pandas as pd
+from typing import Callable
+from loguru import logger
+from qcodec import get_codec_by_path
+from qmetrics import CMetrics
+from qutility import check_and_makedirs
+
+
+def get_tmp_path(save_path: str) -> str:
+    """
+    temporary file is in the same directory, so os.replace is atomic, and it keeps
+    the suffix, so the codec is still inferred from it
+
+    :param save_path: like "by_date/2024/20241008/wind_futures_basis_20241008.csv.gz"
+    :return: like "by_date/2024/20241008/~wind_futures_basis_20241008.csv.gz"
+    """
+    save_dir, save_file = os.path.split(save_path)
+    return os.path.join(save_dir, f"~{save_file}")
+
+
+def save_atomically(df: pd.DataFrame, save_path: str):
+    """
+
+    :param df:
+    :param save_path: codec is decided by suffix, like ".csv.gz" or ".parquet"
+    """
+    tmp_path = get_tmp_path(save_path)
+    try:
+        get_codec_by_path(save_path).write(df, tmp_path)
+        os.replace(tmp_path, save_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return 0
+
+
+class CAsyncWriter(object):
+    __STOP = None
+
+    def __init__(self, workers: int = 1, max_pending: int = 16, metrics: CMetrics | None = None):
+        """
+
+        :param workers: number of threads serializing and compressing data
+        :param max_pending: max number of DataFrames waiting to be written,
+                            submit() blocks when it is reached
+        :param metrics: if provided, seconds of writing and on_saved are recorded
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.metrics = metrics or CMetrics()
+        self.__queue: queue.Queue[tuple[pd.DataFrame, str, Callable | None] | None] = queue.Queue(maxsize=max_pending)
+        self.__threads: list[threading.Thread] = []
+        self.__errors: list[Exception] = []
+        self.__made_dirs: set[str] = set()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # data already downloaded is flushed to disk even if exiting with an exception or Ctrl-C
+        self.close(raise_errors=exc_type is None)
+        return False
+
+    def start(self):
+        self.__threads = [threading.Thread(target=self.__work, daemon=True) for _ in range(self.workers)]
+        for t in self.__threads:
+            t.start()
+        return 0
+
+    def __work(self):
+        while (item := self.__queue.get()) is not self.__STOP:
+            df, save_path, on_saved = item
+            try:
+                if (save_dir := os.path.dirname(save_path)) not in self.__made_dirs:
+                    check_and_makedirs(save_dir)
+                    self.__made_dirs.add(save_dir)
+                with self.metrics.timer("stage_seconds", stage="write"):
+                    save_atomically(df, save_path)
+                if on_saved is not None:
+                    with self.metrics.timer("stage_seconds", stage="record"):
+                        on_saved(df, save_path)
+            except Exception as e:
+                logger.error(f"Failed to save {save_path}: {e}")
+                self.__errors.append(e)
+        return 0
+
+    def submit(self, df: pd.DataFrame, save_path: str, on_saved: Callable[[pd.DataFrame, str], None] | None = None):
+        """
+
+        :param df:
+        :param save_path:
+        :param on_saved: called in the writer thread after df is saved, like recording it in a manifest
+        """
+        if self.__errors:
+            raise self.__errors[0]
+        self.__queue.put((df, save_path, on_saved))
+        return 0
+
+    def close(self, raise_errors: bool = True):
+        for _ in self.__threads:
+            self.__queue.put(self.__STOP)
+        for t in self.__threads:
+            t.join()
+        self.__threads = []
+        if raise_errors and self.__errors:
+            raise self.__errors[0]
+        return 0
+
+
+class CParquetStreamWriter(object):
+    def __init__(self, save_path: str, dtypes: dict[str, type | str], compression: str = "snappy"):
+        """
+        append chunks to a parquet file as row groups, so a large file is written without holding
+        all of its rows. Chunks are written to a temporary file, which is renamed to save_path only
+        when the writer is closed without errors, so save_path always holds a complete file.
+
+        :param save_path:
+        :param dtypes: {column: dtype} of all chunks, like CSaveDataInfo.dtypes
+        :param compression:
+        """
+        import pyarrow as pa
+
+        self.save_path = save_path
+        self.tmp_path = get_tmp_path(save_path)
+        self.schema = pa.Schema.from_pandas(
+            pd.DataFrame({k: pd.Series(dtype=v) for k, v in dtypes.items()}), preserve_index=False,
+        )
+        self.compression = compression
+        self.rows = 0
+        self.__writer = None
+
+    def __enter__(self):
+        import pyarrow.parquet as pq
+
+        check_and_makedirs(os.path.dirname(self.save_path))
+        self.__writer = pq.ParquetWriter(self.tmp_path, self.schema, compression=self.compression)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.__writer.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.save_path)
+        elif os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        return False
+
+    def write(self, df: pd.DataFrame):
+        import pyarrow as pa
+
+        if len(df) > 0:
+            self.__writer.write_table(pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+            self.rows += len(df)
+        return 0
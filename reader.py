@@ -0,0 +1,206 @@
+import os
+import threading
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from loguru import logger
+from typedef import CSaveDataInfo
+from qcalendar import CCalendar
+
+
+def read_daily_file(save_data_info: CSaveDataInfo, src_path: str, columns: tuple[str, ...]) -> pd.DataFrame:
+    """
+    run in worker threads or processes of CDailyReader
+
+    :param save_data_info:
+    :param src_path:
+    :param columns: only these columns are parsed, columns not in the file (like a field added
+                    to the dataset later) are NaN
+    :return:
+    """
+    return save_data_info.read_file(src_path, columns=list(columns))
+
+
+@dataclass
+class CReaderCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class CLruFrameCache(object):
+    def __init__(self, max_bytes: int):
+        """
+        least recently used frames are evicted when the memory of all frames exceeds max_bytes
+
+        :param max_bytes: 0 to disable cache
+        """
+        self.max_bytes = max_bytes
+        self.stats = CReaderCacheStats()
+        self.__frames: OrderedDict[tuple, tuple[pd.DataFrame, int]] = OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self.__size
+
+    def get(self, key: tuple) -> pd.DataFrame | None:
+        with self.__lock:
+            if (item := self.__frames.get(key)) is None:
+                self.stats.misses += 1
+                return None
+            self.__frames.move_to_end(key)
+            self.stats.hits += 1
+            return item[0]
+
+    def put(self, key: tuple, df: pd.DataFrame):
+        nbytes = int(df.memory_usage(index=True, deep=True).sum())
+        if nbytes > self.max_bytes:
+            return 0
+        with self.__lock:
+            if key in self.__frames:
+                self.__size -= self.__frames.pop(key)[1]
+            self.__frames[key] = (df, nbytes)
+            self.__size += nbytes
+            while self.__size > self.max_bytes:
+                _, (_, evicted_bytes) = self.__frames.popitem(last=False)
+                self.__size -= evicted_bytes
+                self.stats.evictions += 1
+        return 0
+
+    def clear(self):
+        with self.__lock:
+            self.__frames.clear()
+            self.__size = 0
+        return 0
+
+
+class CDailyReader(object):
+    def __init__(
+            self, src_root_dir: str, save_data_info: CSaveDataInfo, calendar: CCalendar, workers: int = 1,
+            use_processes: bool = False, cache_max_bytes: int = 512 * 1024 ** 2,
+    ):
+        """
+        read daily files of a dataset in a range of dates. Each (date, columns) is cached, so
+        overlapping ranges only read dates not cached yet. Frames in cache are shared, do not
+        modify them in place.
+
+        :param src_root_dir: root directory of daily files, like "by_date"
+        :param save_data_info:
+        :param calendar:
+        :param workers: number of threads or processes parsing files, files are read in the calling
+                        thread if 1. Threads do not speed up parsing, read_csv holds the GIL while
+                        parsing, they only overlap waiting for slow disks
+        :param use_processes: if True, files are parsed in processes, which is the way to parse cold
+                              files in parallel, but frames are pickled back to the main process
+        :param cache_max_bytes: memory limit of cached frames, 0 to disable cache
+        """
+        self.src_root_dir = src_root_dir
+        self.save_data_info = save_data_info
+        self.calendar = calendar
+        self.workers = workers
+        self.use_processes = use_processes
+        self.cache = CLruFrameCache(max_bytes=cache_max_bytes)
+        self.__executor: Executor | None = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown()
+            self.__executor = None
+        return 0
+
+    @property
+    def executor(self) -> Executor:
+        # created at the first read, and kept for later reads
+        if self.__executor is None:
+            if self.use_processes:
+                self.__executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self.__executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self.__executor
+
+    def get_columns(self, fields: list[str] | None) -> tuple[str, ...]:
+        if fields is None:
+            return tuple(self.save_data_info.fields)
+        if illegal_fields := [f for f in fields if f not in self.save_data_info.fields]:
+            raise ValueError(f"{illegal_fields} are not fields of {self.save_data_info.desc}")
+        key_fields = tuple(self.save_data_info.key_fields)
+        return key_fields + tuple(f for f in fields if f not in key_fields)
+
+    def read_dates(self, trade_dates: list[str], fields: list[str] | None = None) -> dict[str, pd.DataFrame]:
+        """
+
+        :param trade_dates:
+        :param fields: fields to read, key fields are always read. All fields if not provided
+        :return: {trade_date: data}, dates without files are ignored with a warning
+        """
+        columns, all_columns = self.get_columns(fields), tuple(self.save_data_info.fields)
+        res: dict[str, pd.DataFrame] = {}
+        to_read: list[tuple[str, str]] = []
+        for trade_date in trade_dates:
+            if (df := self.cache.get((trade_date, columns))) is not None:
+                res[trade_date] = df
+                continue
+            if columns != all_columns and (df := self.cache.get((trade_date, all_columns))) is not None:
+                # a date read with all fields serves any subset of fields
+                res[trade_date] = df[list(columns)]
+                continue
+            src_path = self.save_data_info.get_save_path(self.src_root_dir, trade_date)
+            if not os.path.exists(src_path):
+                logger.warning(f"{self.save_data_info.desc} for {trade_date} is not downloaded, it will be ignored")
+                continue
+            to_read.append((trade_date, src_path))
+
+        if to_read and self.workers <= 1 and not self.use_processes:
+            for trade_date, src_path in to_read:
+                res[trade_date] = df = read_daily_file(self.save_data_info, src_path, columns)
+                self.cache.put((trade_date, columns), df)
+        elif to_read:
+            futures = {
+                trade_date: self.executor.submit(read_daily_file, self.save_data_info, src_path, columns)
+                for trade_date, src_path in to_read
+            }
+            for trade_date, future in futures.items():
+                res[trade_date] = df = future.result()
+                self.cache.put((trade_date, columns), df)
+        return {d: res[d] for d in trade_dates if d in res}
+
+    def read_range(self, bgn_date: str, stp_date: str, fields: list[str] | None = None) -> pd.DataFrame:
+        """
+
+        :param bgn_date:
+        :param stp_date:
+        :param fields: fields to read, key fields are always read. All fields if not provided
+        :return: data of all dates in [bgn_date, stp_date), with a column "trade_date" at first
+        """
+        columns = self.get_columns(fields)
+        daily_data = self.read_dates(self.calendar.get_iter_list(bgn_date, stp_date), fields)
+        if not daily_data:
+            return pd.DataFrame(columns=["trade_date"] + list(columns))
+        df = pd.concat(daily_data, axis=0, names=["trade_date", None]).reset_index(level=0)
+        return df.reset_index(drop=True)
+
+    def read_panel(self, bgn_date: str, stp_date: str, field: str, code: str = "wd_code") -> pd.DataFrame:
+        """
+
+        :param bgn_date:
+        :param stp_date:
+        :param field: a value field
+        :param code: key field used as columns
+        :return: a DataFrame with index = trade dates, columns = instruments
+        """
+        if field in self.save_data_info.key_fields:
+            raise ValueError(f"{field} is a key field of {self.save_data_info.desc}")
+        daily_data = self.read_dates(self.calendar.get_iter_list(bgn_date, stp_date), fields=[field])
+        panel = pd.DataFrame({d: df.set_index(code)[field] for d, df in daily_data.items()}).T
+        panel.index.name = "trade_date"
+        return panel
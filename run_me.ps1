@@ -1,2 +1 @@
-python main.py download --switch basis --bgn 20241008 --stp 20241101
-python main.py download --switch stock --bgn 20241008 --stp 20241101
\ No newline at end of file
+python main.py download --switch basis stock --bgn 20241008 --stp 20241101
@@ -0,0 +1,129 @@
+"""
+declarations of datasets, shared by engines, readers, database and project configuration.
+Only light modules are imported here, so loading project_cfg does not load pandas or engines.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+from qcodec import CCodec, get_codec
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+@dataclass(frozen=True)
+class CSaveDataInfo:
+    file_format: str  # without suffix, like "wind_futures_basis_{}", suffix is decided by codec
+    desc: str
+    fields: tuple[str, ...]
+    key_fields: tuple[str, ...] = ("ts_code", "wd_code")
+    codec: str = "csv.gz"  # name in qcodec.CODECS
+
+    def __post_init__(self):
+        # an illegal codec is found when the dataset is declared, instead of the first write
+        get_codec(self.codec)
+
+    @property
+    def name(self) -> str:
+        # "wind_futures_basis_{}" -> "wind_futures_basis"
+        return self.file_format.split("{}")[0].rstrip("_")
+
+    @property
+    def file_codec(self) -> CCodec:
+        return get_codec(self.codec)
+
+    @property
+    def value_fields(self) -> list[str]:
+        return [f for f in self.fields if f not in self.key_fields]
+
+    @property
+    def dtypes(self) -> dict[str, type | str]:
+        return {f: (str if f in self.key_fields else "float64") for f in self.fields}
+
+    def get_file_name(self, trade_date: str) -> str:
+        return self.file_format.format(trade_date) + self.file_codec.suffix
+
+    def get_save_path(self, save_root_dir: str, trade_date: str) -> str:
+        return os.path.join(save_root_dir, trade_date[0:4], trade_date, self.get_file_name(trade_date))
+
+    def read_file(self, path: str, columns: list[str] | None = None) -> "pd.DataFrame":
+        """
+
+        :param path: a daily file of this dataset
+        :param columns: only these columns are read, all columns if not provided
+        :return:
+        """
+        return self.file_codec.read(path, dtypes=self.dtypes, columns=columns)
+
+
+@dataclass(frozen=True)
+class CWindFieldGroup:
+    """
+    fields requested for a group of instruments, selected by exchanges of codes in WIND, like "CFE"
+
+    """
+    indicators: tuple[tuple[str, str], ...]  # ((wind field, renamed field), ...)
+    exchanges: tuple[str, ...] = ()  # instruments of these exchanges, all exchanges if empty
+    exclude_exchanges: tuple[str, ...] = ()  # instruments of these exchanges are excluded
+
+    @property
+    def indicators_map(self) -> dict[str, str]:
+        return dict(self.indicators)
+
+    def select(self, universe: list[str]) -> list[str]:
+        res = []
+        for instru in universe:
+            exchange = instru.split(".")[1]
+            if (not self.exchanges or exchange in self.exchanges) and (exchange not in self.exclude_exchanges):
+                res.append(instru)
+        return res
+
+
+@dataclass(frozen=True)
+class CWindSaveDataInfo(CSaveDataInfo):
+    """
+    a dataset downloaded from WIND, groups should select disjoint instruments, and
+    each group should rename its fields to all the value fields of the dataset
+
+    """
+    groups: tuple[CWindFieldGroup, ...] = ()
+
+
+@dataclass(frozen=True)
+class CWindMinuteSaveDataInfo(CSaveDataInfo):
+    """
+    minute bars downloaded from WIND by wsi, saved in one file for each section of CCalendarSection,
+    like "by_section/2024/20240105/wind_futures_minute_20240105-TS2.parquet". Files are written
+    chunk by chunk as row groups, so only parquet is supported.
+
+    """
+    key_fields: tuple[str, ...] = ("ts_code", "wd_code", "timestamp")
+    codec: str = "parquet"
+    indicators: tuple[tuple[str, str], ...] = ()  # ((wind field, renamed field), ...)
+    bar_size: int = 1  # minutes of each bar
+
+    def __post_init__(self):
+        super().__post_init__()
+        if self.codec != "parquet":
+            raise ValueError(f"codec = {self.codec} of {self.desc} is illegal, minute bars are saved as parquet")
+        if illegal_fields := [v for _, v in self.indicators if v not in self.value_fields]:
+            raise ValueError(f"{illegal_fields} of indicators are not value fields of {self.desc}")
+
+    @property
+    def indicators_map(self) -> dict[str, str]:
+        return dict(self.indicators)
+
+    @property
+    def dtypes(self) -> dict[str, type | str]:
+        return {**super().dtypes, "timestamp": "datetime64[ns]"}
+
+    def get_section_path(self, save_root_dir: str, sec_id: str) -> str:
+        """
+
+        :param save_root_dir:
+        :param sec_id: like "20240105-TS2"
+        :return: file of the section, in the directory of its trade date
+        """
+        trade_date = sec_id[0:8]
+        return os.path.join(save_root_dir, trade_date[0:4], trade_date, self.get_file_name(sec_id))
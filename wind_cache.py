@@ -0,0 +1,123 @@
+import os
+import json
+import zlib
+import pickle
+import hashlib
+import threading
+from types import SimpleNamespace
+from loguru import logger
+from qutility import check_and_makedirs
+
+
+class CWindResponseCache(object):
+    def __init__(self, cache_dir: str, max_bytes: int = 4 * 1024 ** 3, cache_only: bool = False):
+        """
+        on-disk cache of successful responses from WIND, keyed by sha1 of (method, codes, fields, options, ...)
+        each response is pickled, compressed and saved as {cache_dir}/{key[0:2]}/{key}.bin,
+        the least recently used responses are removed when the total size exceeds max_bytes
+
+        :param cache_dir:
+        :param max_bytes: upper limit of total size of the cache
+        :param cache_only: if True, responses are only read from cache, and a miss is an error
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.cache_only = cache_only
+        self.hits, self.misses = 0, 0
+        self.__lock = threading.Lock()
+        self.__entries: dict[str, tuple[int, float]] = {}  # path: (size, last used time)
+        self.__total_bytes = 0
+        self.__load_entries()
+
+    def __load_entries(self):
+        check_and_makedirs(self.cache_dir)
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith(".bin"):
+                    st = entry.stat()
+                    self.__entries[entry.path] = (st.st_size, st.st_mtime)
+                    self.__total_bytes += st.st_size
+        return 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self.__total_bytes
+
+    @staticmethod
+    def get_key(method: str, kwargs: dict) -> str:
+        normalized = {"method": method}
+        for k, v in kwargs.items():
+            if isinstance(v, str) and k in ("codes", "fields"):
+                v = [z.strip() for z in v.split(",")]
+            normalized[k] = v
+        return hashlib.sha1(json.dumps(normalized, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[0:2], f"{key}.bin")
+
+    def get(self, method: str, kwargs: dict) -> SimpleNamespace | None:
+        path = self.get_path(self.get_key(method, kwargs))
+        try:
+            with open(path, "rb") as f:
+                data = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            with self.__lock:
+                self.misses += 1
+            return None
+        except (OSError, zlib.error, pickle.UnpicklingError) as e:
+            logger.warning(f"Cache {path} is broken, it will be ignored: {e}")
+            with self.__lock:
+                self.misses += 1
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self.__lock:
+            self.hits += 1
+            if path in self.__entries:
+                self.__entries[path] = (self.__entries[path][0], os.path.getmtime(path))
+        return SimpleNamespace(**data)
+
+    def put(self, method: str, kwargs: dict, downloaded_data):
+        if downloaded_data.ErrorCode != 0:
+            return 0
+        data = {
+            "ErrorCode": downloaded_data.ErrorCode,
+            "Codes": list(downloaded_data.Codes),
+            "Fields": list(downloaded_data.Fields),
+            "Times": list(downloaded_data.Times),
+            "Data": [list(row) for row in downloaded_data.Data],
+        }
+        content = zlib.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), 6)
+        path = self.get_path(self.get_key(method, kwargs))
+        check_and_makedirs(os.path.dirname(path))
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        with self.__lock:
+            old_size = self.__entries[path][0] if path in self.__entries else 0
+            self.__entries[path] = (len(content), os.path.getmtime(path))
+            self.__total_bytes += len(content) - old_size
+            if self.__total_bytes > self.max_bytes:
+                self.__evict()
+        return 0
+
+    def __evict(self):
+        # remove least recently used entries, until 90% of max_bytes
+        for path, (size, _) in sorted(self.__entries.items(), key=lambda z: z[1][1]):
+            if self.__total_bytes <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            del self.__entries[path]
+            self.__total_bytes -= size
+        return 0
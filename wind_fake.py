@@ -0,0 +1,255 @@
+import time
+import random
+import zlib
+import threading
+import datetime as dt
+from dataclasses import dataclass, field
+
+# error codes used by the fake, same values as WindPy
+WIND_ERR_QUOTA = -40522017  # data quota exceeded
+WIND_ERR_INVALID_ARGS = -40522005  # invalid arguments, like multiple codes with multiple fields in wsd
+WIND_ERR_TIMEOUT = -40521010  # network timeout
+WIND_ERR_NOT_STARTED = -40520004  # api is not started
+WIND_ERR_NO_DATA = -40520007  # no data in the range, like wsi of a holiday
+
+# (first bar, last bar) of sessions of the fake, bars are labelled by their end minutes
+FAKE_MINUTE_SESSIONS = (("09:31", "11:30"), ("13:31", "15:00"), ("21:01", "23:00"))
+
+
+@dataclass
+class CWindData:
+    ErrorCode: int = 0
+    Codes: list[str] = field(default_factory=list)
+    Fields: list[str] = field(default_factory=list)
+    Times: list[dt.date | dt.datetime] = field(default_factory=list)
+    Data: list[list] = field(default_factory=list)
+
+    def __str__(self):
+        return f".ErrorCode={self.ErrorCode}\n.Codes={self.Codes}\n.Fields={self.Fields}\n" \
+               f".Times={self.Times}\n.Data={self.Data}"
+
+
+@dataclass
+class CFakeWindStats:
+    calls: int = 0
+    data_points: int = 0
+    timeouts: int = 0
+    quota_errors: int = 0
+    starts: int = 0
+    disconnects: int = 0
+    calls_by_method: dict[str, int] = field(default_factory=dict)
+
+
+class CFakeWindApi(object):
+    """
+    a local stand-in of WindPy.w, used to test and benchmark engines without a WIND terminal.
+    Results have the same attributes as WindPy, and values are deterministic for each
+    (code, field, date), so repeated calls return the same data.
+    """
+
+    def __init__(
+            self,
+            trade_dates: list[str] | None = None,
+            latency: float = 0.0,
+            jitter: float = 0.0,
+            timeout_rate: float = 0.0,
+            timeout: float = 0.0,
+            quota_rate: float = 0.0,
+            quota_calls_per_sec: float | None = None,
+            nan_rate: float = 0.0,
+            connect_latency: float = 0.0,
+            disconnect_rate: float = 0.0,
+            seed: int = 0,
+    ):
+        """
+
+        :param trade_dates: trade dates returned by wsd/wsi, weekdays if not provided
+        :param latency: seconds of each call
+        :param jitter: extra seconds of each call, uniform in [0, jitter]
+        :param timeout_rate: probability of a call raising TimeoutError
+        :param timeout: seconds waited before TimeoutError is raised
+        :param quota_rate: probability of a call returning WIND_ERR_QUOTA
+        :param quota_calls_per_sec: calls beyond this rate in the last second return WIND_ERR_QUOTA
+        :param nan_rate: probability of a value being NaN
+        :param connect_latency: seconds of start()
+        :param disconnect_rate: probability of the session being lost before a call, calls
+                                return WIND_ERR_NOT_STARTED until start() is called again
+        :param seed: seed of random errors and latencies, values do not depend on it
+        """
+        self.trade_dates = trade_dates
+        self.latency = latency
+        self.jitter = jitter
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+        self.quota_rate = quota_rate
+        self.quota_calls_per_sec = quota_calls_per_sec
+        self.nan_rate = nan_rate
+        self.connect_latency = connect_latency
+        self.disconnect_rate = disconnect_rate
+        self.stats = CFakeWindStats()
+        self.__rnd = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__recent_calls: list[float] = []
+        self.__connected = False
+        self.__trade_days: list[dt.date] | None = None
+
+    # --- session
+    def start(self, *args, **kwargs) -> CWindData:
+        time.sleep(self.connect_latency)
+        with self.__lock:
+            self.stats.starts += 1
+        self.__connected = True
+        return CWindData(ErrorCode=0, Data=[["OK!"]])
+
+    def stop(self):
+        self.__connected = False
+        return 0
+
+    def isconnected(self) -> bool:
+        return self.__connected
+
+    # --- helpers
+    @staticmethod
+    def __split(s: str | list[str]) -> list[str]:
+        return [z.strip() for z in s.split(",")] if isinstance(s, str) else list(s)
+
+    @staticmethod
+    def __parse_options(options: str | None) -> dict[str, str]:
+        res = {}
+        for kv in (options or "").split(";"):
+            if "=" in kv:
+                k, v = kv.split("=", 1)
+                res[k.strip()] = v.strip()
+        return res
+
+    @staticmethod
+    def __to_date(s: str) -> dt.date:
+        return dt.datetime.strptime(s.replace("-", "")[0:8], "%Y%m%d").date()
+
+    def value(self, code: str, fld: str, tp: str) -> float:
+        h = zlib.crc32(f"{code}|{fld.lower()}|{tp}".encode())
+        if h % 10000 < self.nan_rate * 10000:
+            return float("nan")
+        return round((h % 2000000) / 100 - 10000, 2)
+
+    def __get_dates(self, bgn: str, end: str) -> list[dt.date]:
+        b, e = self.__to_date(bgn), self.__to_date(end)
+        if self.trade_dates is not None:
+            if self.__trade_days is None:
+                # parsed once, a calendar of decades makes every call slow otherwise
+                self.__trade_days = [self.__to_date(d) for d in self.trade_dates]
+            return [d for d in self.__trade_days if b <= d <= e]
+        days = [b + dt.timedelta(days=i) for i in range((e - b).days + 1)]
+        return [d for d in days if d.weekday() < 5]
+
+    def __call(self, method: str, data_points: int) -> CWindData | None:
+        """
+        simulate latency and errors of a call
+
+        :return: an error result, or None if the call succeeds
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.stats.calls += 1
+            self.stats.calls_by_method[method] = self.stats.calls_by_method.get(method, 0) + 1
+            self.__recent_calls = [t for t in self.__recent_calls if now - t < 1.0] + [now]
+            over_quota = (self.quota_calls_per_sec is not None) and len(self.__recent_calls) > self.quota_calls_per_sec
+            p_timeout, p_quota = self.__rnd.random(), self.__rnd.random()
+            delay = self.latency + self.__rnd.uniform(0, self.jitter)
+            if self.__connected and self.__rnd.random() < self.disconnect_rate:
+                self.stats.disconnects += 1
+                self.__connected = False
+
+        if not self.__connected:
+            return CWindData(ErrorCode=WIND_ERR_NOT_STARTED, Data=[["Not started"]])
+        if p_timeout < self.timeout_rate:
+            with self.__lock:
+                self.stats.timeouts += 1
+            time.sleep(self.timeout)
+            raise TimeoutError(f"Fake WIND {method} timeout")
+        time.sleep(delay)
+        if over_quota or p_quota < self.quota_rate:
+            with self.__lock:
+                self.stats.quota_errors += 1
+            return CWindData(ErrorCode=WIND_ERR_QUOTA, Data=[["Quota exceeded"]])
+        with self.__lock:
+            self.stats.data_points += data_points
+        return None
+
+    # --- api
+    def wss(self, codes: str | list[str], fields: str | list[str], options: str | None = None) -> CWindData:
+        codes, fields = self.__split(codes), self.__split(fields)
+        if (err := self.__call("wss", len(codes) * len(fields))) is not None:
+            return err
+        trade_date = self.__parse_options(options).get("tradeDate", dt.date.today().strftime("%Y%m%d"))
+        trade_date = trade_date.replace("-", "")
+        return CWindData(
+            ErrorCode=0,
+            Codes=codes,
+            Fields=[f.upper() for f in fields],
+            Times=[dt.datetime.now()],
+            Data=[[self.value(c, f, trade_date) for c in codes] for f in fields],
+        )
+
+    def wsd(
+            self, codes: str | list[str], fields: str | list[str],
+            beginTime: str | None = None, endTime: str | None = None, options: str | None = None,
+    ) -> CWindData:
+        codes, fields = self.__split(codes), self.__split(fields)
+        if len(codes) > 1 and len(fields) > 1:
+            return CWindData(ErrorCode=WIND_ERR_INVALID_ARGS, Data=[["Multiple codes with multiple fields"]])
+        today = dt.date.today().strftime("%Y%m%d")
+        dates = self.__get_dates(beginTime or today, endTime or today)
+        if (err := self.__call("wsd", len(codes) * len(fields) * len(dates))) is not None:
+            return err
+        date_strs = [d.strftime("%Y%m%d") for d in dates]
+        if len(codes) > 1:
+            data = [[self.value(c, fields[0], d) for d in date_strs] for c in codes]
+        else:
+            data = [[self.value(codes[0], f, d) for d in date_strs] for f in fields]
+        if len(dates) == 1 and len(codes) > 1:
+            # like WindPy, a single time point comes back as one row across codes
+            data = [[row[0] for row in data]]
+        return CWindData(ErrorCode=0, Codes=codes, Fields=[f.upper() for f in fields], Times=dates, Data=data)
+
+    def __get_bar_times(self, bgn: str, end: str, bar_size: int) -> list[dt.datetime]:
+        b, e = dt.datetime.fromisoformat(bgn), dt.datetime.fromisoformat(end)
+        res = []
+        for day in self.__get_dates(bgn, end):
+            for first, last in FAKE_MINUTE_SESSIONS:
+                t = dt.datetime.combine(day, dt.time.fromisoformat(first))
+                t_last = dt.datetime.combine(day, dt.time.fromisoformat(last))
+                while t <= t_last:
+                    if b <= t <= e:
+                        res.append(t)
+                    t += dt.timedelta(minutes=bar_size)
+        return res
+
+    def wsi(
+            self, codes: str | list[str], fields: str | list[str],
+            beginTime: str | None = None, endTime: str | None = None, options: str | None = None,
+    ) -> CWindData:
+        """
+        like WindPy, bars of multiple codes come back in rows of (time, code) with an extra
+        field "windcode", and Codes is ["MultiCodes"]
+
+        :param beginTime: like "2024-01-05 09:00:00"
+        :param endTime: like "2024-01-05 15:00:00"
+        :param options: like "BarSize=1"
+        """
+        codes, fields = self.__split(codes), self.__split(fields)
+        bar_size = int(self.__parse_options(options).get("BarSize", 1))
+        now = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        times = self.__get_bar_times(beginTime or now, endTime or now, bar_size)
+        if (err := self.__call("wsi", len(codes) * len(fields) * len(times))) is not None:
+            return err
+        if not times:
+            return CWindData(ErrorCode=WIND_ERR_NO_DATA, Data=[["No data"]])
+        rows = [(t, c) for t in times for c in codes]
+        data = [[self.value(c, f, f"{t:%Y%m%d %H%M}") for t, c in rows] for f in fields]
+        if len(codes) > 1:
+            return CWindData(
+                ErrorCode=0, Codes=["MultiCodes"], Fields=["WINDCODE"] + [f.upper() for f in fields],
+                Times=[t for t, _ in rows], Data=[[c for _, c in rows]] + data,
+            )
+        return CWindData(ErrorCode=0, Codes=codes, Fields=[f.upper() for f in fields], Times=times, Data=data)
@@ -0,0 +1,144 @@
+import time
+import threading
+from dataclasses import dataclass, field
+from loguru import logger
+from qthrottle import CRetryPolicy
+
+
+class CWindSessionError(Exception):
+    pass
+
+
+@dataclass
+class CWindSessionStats:
+    connects: int = 0
+    reconnects: int = 0
+    failed_connects: int = 0
+    health_checks: int = 0
+    connect_latencies: list[float] = field(default_factory=list)
+
+
+class CWindSession(object):
+    def __init__(self, api=None, retry_policy: CRetryPolicy | None = None, health_check_interval: float = 60.0):
+        """
+        a WIND session shared by all engines of the process, started at the first call
+
+        :param api: object with the same interface as WindPy.w, WindPy.w is imported at the first
+                    connection if not provided
+        :param retry_policy: backoff of connection retries
+        :param health_check_interval: seconds between two isconnected() checks, the session is also
+                                      checked after it is marked unhealthy
+        """
+        self.__api = api
+        self.retry_policy = retry_policy or CRetryPolicy(max_retries=5, base_delay=2.0, max_delay=60.0)
+        self.health_check_interval = health_check_interval
+        self.stats = CWindSessionStats()
+        self.__lock = threading.RLock()
+        self.__started = False
+        self.__healthy = False
+        self.__last_check = 0.0
+
+    @property
+    def api(self):
+        return self.__api
+
+    @property
+    def started(self) -> bool:
+        return self.__started
+
+    def __connect(self):
+        if self.__api is None:
+            from WindPy import w
+            self.__api = w
+        attempt = 0
+        while True:
+            t0 = time.monotonic()
+            try:
+                res = self.__api.start()
+                error_code = getattr(res, "ErrorCode", 0)
+            except Exception as e:
+                error_code, res = None, e
+            if error_code == 0:
+                latency = time.monotonic() - t0
+                self.stats.connects += 1
+                self.stats.connect_latencies.append(latency)
+                self.__started, self.__healthy, self.__last_check = True, True, time.monotonic()
+                logger.info(f"WIND session is started in {latency:.2f} seconds")
+                return 0
+            self.stats.failed_connects += 1
+            if attempt >= self.retry_policy.max_retries:
+                raise CWindSessionError(f"Failed to start WIND session after {attempt + 1} attempts: {res}")
+            delay = self.retry_policy.get_delay(attempt)
+            logger.warning(f"Failed to start WIND session: {res}. Retry {attempt + 1} in {delay:.1f} seconds")
+            time.sleep(delay)
+            attempt += 1
+
+    def reconnect(self):
+        with self.__lock:
+            logger.warning("WIND session is lost, reconnecting")
+            try:
+                self.__api.stop()
+            except Exception as e:
+                logger.warning(f"Failed to stop WIND session: {e}")
+            self.stats.reconnects += 1
+            self.__connect()
+        return 0
+
+    def mark_unhealthy(self):
+        # called when a call fails in a way a dead session would, checked before the next call
+        self.__healthy = False
+        return 0
+
+    def ensure_connected(self, check_health: bool = False):
+        """
+
+        :param check_health: if True, isconnected() is called even if the last check is recent
+        :return: api with a live session
+        """
+        with self.__lock:
+            if not self.__started:
+                self.__connect()
+            elif check_health or not self.__healthy or \
+                    time.monotonic() - self.__last_check >= self.health_check_interval:
+                self.stats.health_checks += 1
+                self.__last_check = time.monotonic()
+                if self.__api.isconnected():
+                    self.__healthy = True
+                else:
+                    self.reconnect()
+        return self.__api
+
+    def stop(self):
+        with self.__lock:
+            if self.__started:
+                self.__api.stop()
+                self.__started, self.__healthy = False, False
+        return 0
+
+    def report(self):
+        latencies = self.stats.connect_latencies
+        avg_latency = sum(latencies) / len(latencies) if latencies else float("nan")
+        logger.info(
+            f"WIND session: connects = {self.stats.connects}, reconnects = {self.stats.reconnects}, "
+            f"failed connects = {self.stats.failed_connects}, health checks = {self.stats.health_checks}, "
+            f"connect latency avg = {avg_latency:.2f}s, max = {max(latencies, default=float('nan')):.2f}s"
+        )
+        return 0
+
+
+_sessions: dict[int, CWindSession] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_wind_session(api=None) -> CWindSession:
+    """
+    sessions are shared by api objects, all engines using WindPy.w share one session
+
+    :param api: object with the same interface as WindPy.w, None for WindPy.w
+    :return:
+    """
+    with _sessions_lock:
+        key = id(api)
+        if key not in _sessions:
+            _sessions[key] = CWindSession(api=api)
+        return _sessions[key]